@@ -0,0 +1,185 @@
+"""
+Benchmark comparing the metadata extraction with the individual media functions (get_image_date, get_image_size and
+get_image_description) against a single MediaProbe. It reports the number of file opens, the number of bytes read and
+the time needed per image. The "legacy" variant rotates the full image to compute its size, as get_image_size used to.
+
+Usage (from the repository root, with the package installed or on the PYTHONPATH):
+    python benchmarks/bench_media_probe.py [-p <path/to/photos>] [-n <number of generated photos>]
+
+If no path is provided, synthetic JPEG photos containing EXIF data are generated in a temporary folder.
+"""
+
+import argparse
+import builtins
+import glob
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+import simplegallery.media as spg_media
+
+
+class CountingFile:
+    """
+    File wrapper counting the number of bytes read from the wrapped file
+    """
+
+    def __init__(self, file, counter):
+        self._file = file
+        self._counter = counter
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._counter["bytes"] += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self._file.readinto(buffer)
+        self._counter["bytes"] += count or 0
+        return count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+@contextmanager
+def count_file_access(counter):
+    """
+    Counts all file opens and bytes read through builtins.open while the context is active
+    :param counter: dict where the counts are accumulated under the keys "opens" and "bytes"
+    """
+    original_open = builtins.open
+
+    def counting_open(file, mode="r", *args, **kwargs):
+        opened = original_open(file, mode, *args, **kwargs)
+        if "r" in mode and "b" in mode:
+            counter["opens"] += 1
+            return CountingFile(opened, counter)
+        return opened
+
+    builtins.open = counting_open
+    try:
+        yield
+    finally:
+        builtins.open = original_open
+
+
+def extract_legacy(path):
+    """
+    Extracts the metadata with the individual media functions, rotating the full image to compute its size
+    :param path: path to the photo
+    """
+    spg_media.get_image_date(path)
+    image = Image.open(path)
+    spg_media.rotate_image_by_orientation(image).size
+    image.close()
+    spg_media.get_image_description(path)
+
+
+def extract_individually(path):
+    """
+    Extracts the metadata by calling the individual media functions
+    :param path: path to the photo
+    """
+    spg_media.get_image_date(path)
+    spg_media.get_image_size(path)
+    spg_media.get_image_description(path)
+
+
+def extract_with_probe(path):
+    """
+    Extracts the metadata with a single MediaProbe
+    :param path: path to the photo
+    """
+    probe = spg_media.MediaProbe(path)
+    return probe.date, probe.size, probe.description
+
+
+def generate_photos(path, count):
+    """
+    Generates synthetic JPEG photos containing EXIF data
+    :param path: folder where the photos will be stored
+    :param count: number of photos
+    :return: list of paths to the generated photos
+    """
+    exif = Image.Exif()
+    exif[spg_media.EXIF_TAG_MAP["Orientation"]] = 6
+    exif[spg_media.EXIF_TAG_MAP["ImageDescription"]] = "Benchmark photo"
+    exif[spg_media.EXIF_TAG_MAP["DateTime"]] = "2020:06:13 10:11:12"
+
+    photos = []
+    random = np.random.default_rng(0)
+    for index in range(count):
+        pixels = random.integers(0, 255, (1500, 2000, 3), dtype=np.uint8)
+        photo_path = os.path.join(path, f"photo{index}.jpg")
+        Image.fromarray(pixels).save(photo_path, exif=exif, quality=90)
+        photos.append(photo_path)
+
+    return photos
+
+
+def run(name, function, photos):
+    """
+    Runs one of the extraction variants over all photos and prints the statistics per image
+    :param name: name of the variant
+    :param function: extraction function
+    :param photos: list of paths to photos
+    :return: dict with the counts per image
+    """
+    counter = dict(opens=0, bytes=0)
+    start = time.perf_counter()
+    with count_file_access(counter):
+        for photo in photos:
+            function(photo)
+    elapsed = time.perf_counter() - start
+
+    result = dict(
+        opens=counter["opens"] / len(photos),
+        bytes=counter["bytes"] / len(photos),
+        ms=elapsed * 1000 / len(photos),
+    )
+    print(
+        f'{name:<14}{result["opens"]:>10.1f}{result["bytes"]:>14.0f}{result["ms"]:>12.3f}'
+    )
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the MediaProbe")
+    parser.add_argument("-p", "--path", dest="path", default=None)
+    parser.add_argument("-n", "--count", dest="count", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        if args.path:
+            photos = sorted(glob.glob(os.path.join(args.path, "*.jp*g")))
+        else:
+            photos = generate_photos(tempdir, args.count)
+
+        print(f"{'Variant':<14}{'Opens/img':>10}{'Bytes/img':>14}{'ms/img':>12}")
+        legacy = run("legacy", extract_legacy, photos)
+        individual = run("individual", extract_individually, photos)
+        probe = run("MediaProbe", extract_with_probe, photos)
+
+        for name, result in [("legacy", legacy), ("individual", individual)]:
+            print(
+                f"Saved per image compared to {name}: "
+                f'{result["opens"] - probe["opens"]:.1f} opens, '
+                f'{result["bytes"] - probe["bytes"]:.0f} bytes'
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark comparing the fast thumbnail path (reduced-scale JPEG decoding and rotation after resizing) with the
+reference path (full decoding, rotation and resizing). It reports the time needed per thumbnail and the peak memory of each variant
+and checks the quality of the fast thumbnails against the reference ones. The script fails if the PSNR of any
+thumbnail is below the threshold.
+
+Usage (from the repository root, with the package installed or on the PYTHONPATH):
+    python benchmarks/bench_thumbnails.py [-p <path/to/photos>] [-n <number of generated photos>] [--min-psnr <dB>]
+
+If no path is provided, synthetic 24 megapixel JPEG photos are generated in a temporary folder.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import multiprocessing
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+import simplegallery.media as spg_media
+
+
+def generate_photos(path, count):
+    """
+    Generates synthetic JPEG photos with smooth gradients, edges and some noise
+    :param path: folder where the photos will be stored
+    :param count: number of photos
+    :return: list of paths to the generated photos
+    """
+    random = np.random.default_rng(0)
+    y, x = np.mgrid[0:4000, 0:6000].astype(np.float32)
+
+    photos = []
+    for index in range(count):
+        pixels = np.stack(
+            [
+                127 + 100 * np.sin(x / (50 + 10 * index)) * np.cos(y / 70),
+                255 * x / 6000,
+                255 * ((x // 400 + y // 400) % 2),
+            ],
+            axis=-1,
+        )
+        pixels += random.normal(0, 8, pixels.shape)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+        # Every second photo is stored in portrait orientation using the EXIF tag
+        exif = Image.Exif()
+        exif[spg_media.EXIF_TAG_MAP["Orientation"]] = 6 if index % 2 else 1
+
+        photo_path = os.path.join(path, f"photo{index}.jpg")
+        image.save(photo_path, exif=exif, quality=90)
+        photos.append(photo_path)
+
+    return photos
+
+
+def create_thumbnails(photos, output_path, height, fast):
+    """
+    Creates thumbnails for all photos with one of the thumbnail paths. It is executed in a separate process, so that
+    the peak memory of each variant can be measured independently.
+    :param photos: list of paths to photos
+    :param output_path: folder where the thumbnails will be stored
+    :param height: thumbnail height
+    :param fast: use the fast thumbnail path
+    :return: list of paths to the thumbnails, elapsed time in seconds and peak resident memory in bytes
+    """
+    os.makedirs(output_path, exist_ok=True)
+    thumbnails = []
+    start = time.perf_counter()
+    for photo in photos:
+        thumbnail_path = os.path.join(output_path, os.path.basename(photo))
+        spg_media.create_image_thumbnail(photo, thumbnail_path, height, fast)
+        thumbnails.append(thumbnail_path)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_memory *= 1024
+
+    return thumbnails, elapsed, peak_memory
+
+
+def run(name, photos, output_path, height, fast):
+    """
+    Runs one of the thumbnail paths in a fresh process and prints the statistics per thumbnail
+    :param name: name of the variant
+    :param photos: list of paths to photos
+    :param output_path: folder where the thumbnails will be stored
+    :param height: thumbnail height
+    :param fast: use the fast thumbnail path
+    :return: list of paths to the thumbnails
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        thumbnails, elapsed, peak_memory = executor.submit(
+            create_thumbnails, photos, output_path, height, fast
+        ).result()
+
+    print(
+        f"{name:<12}{elapsed * 1000 / len(photos):>12.1f}{peak_memory / 2 ** 20:>16.1f}"
+    )
+
+    return thumbnails
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the fast thumbnails")
+    parser.add_argument("-p", "--path", dest="path", default=None)
+    parser.add_argument("-n", "--count", dest="count", type=int, default=4)
+    parser.add_argument("--height", dest="height", type=int, default=320)
+    parser.add_argument(
+        "--min-psnr",
+        dest="min_psnr",
+        type=float,
+        default=spg_media.FAST_THUMBNAIL_MIN_PSNR,
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        if args.path:
+            photos = sorted(glob.glob(os.path.join(args.path, "*.jp*g")))
+        else:
+            # The photos are generated in a separate process, because the peak memory is inherited by child processes
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                photos = executor.submit(generate_photos, tempdir, args.count).result()
+
+        print(f"{'Variant':<12}{'ms/thumb':>12}{'Peak RSS MiB':>16}")
+        reference = run(
+            "reference", photos, os.path.join(tempdir, "reference"), args.height, False
+        )
+        fast = run("fast", photos, os.path.join(tempdir, "fast"), args.height, True)
+
+        # Quality gate
+        failed = False
+        for fast_path, reference_path in zip(fast, reference):
+            with Image.open(fast_path) as fast_image, Image.open(
+                reference_path
+            ) as reference_image:
+                if fast_image.size != reference_image.size:
+                    print(f"{os.path.basename(fast_path)}: size mismatch")
+                    failed = True
+                    continue
+                psnr = spg_media.compute_psnr(fast_image, reference_image)
+            print(f"{os.path.basename(fast_path)}: PSNR {psnr:.1f} dB")
+            failed = failed or psnr < args.min_psnr
+
+    if failed:
+        print(f"Quality gate failed: PSNR below {args.min_psnr} dB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -36,9 +36,13 @@ setup(
     },
     install_requires=[
         'opencv-python>=4.2.0.32',
+        'numpy',
         'pillow>=7.0.0',
         'jinja2>=2.10.3',
         'selenium>=3.141.0,<4.3',
         'requests>=2.22.0',
-    ]
+    ],
+    extras_require={
+        'brotli': ['brotli'],
+    }
 )
@@ -0,0 +1,428 @@
+import os
+import json
+import hashlib
+import sqlite3
+import time
+import simplegallery.media as spg_media
+
+# Name of the folder next to the gallery.json file in which the caches of the gallery are stored
+CACHE_FOLDER = ".spg-cache"
+
+# Size in bytes of the chunks in which files are read to compute their content hash
+CONTENT_HASH_CHUNK_SIZE = 1 << 20
+
+
+def get_cache_path(gallery_config):
+    """
+    Gets the path to the folder where the caches of the gallery are stored. It can be set with the cache_path option
+    in the gallery.json and defaults to the .spg-cache folder next to the gallery.json.
+    :param gallery_config: Gallery config dictionary as read from the gallery.json
+    :return: Path to the cache folder
+    """
+    if gallery_config.get("cache_path"):
+        return gallery_config["cache_path"]
+
+    return os.path.join(
+        os.path.dirname(gallery_config["images_data_file"]), CACHE_FOLDER
+    )
+
+
+def compute_content_hash(path):
+    """
+    Computes the hash of the content of a file, which doesn't depend on its name or modification time
+    :param path: Path to the file
+    :return: SHA-256 hash as hexadecimal string
+    """
+    content_hash = hashlib.sha256()
+    with open(path, "rb") as file_in:
+        for chunk in iter(lambda: file_in.read(CONTENT_HASH_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+
+    return content_hash.hexdigest()
+
+
+class MetadataCache:
+    """
+    Persistent cache of the metadata of media files, stored in an SQLite database. The entries are keyed by the path of
+    the file relative to the images folder and its stat signature (size, modification time and inode), so that
+    unchanged files don't need to be opened to get their metadata. The perceptual and content hashes of the files are
+    stored with their metadata.
+    """
+
+    # Name of the SQLite database file in the cache folder
+    DATABASE_NAME = "metadata.sqlite"
+
+    # Maximum number of entries kept for files that were not requested since the cache was opened (e.g. files that were
+    # deleted or moved). When there are more, the least recently used ones are evicted.
+    MAX_STALE_ENTRIES = 1000
+
+    def __init__(self, cache_path, images_path, max_stale_entries=MAX_STALE_ENTRIES):
+        """
+        Opens the cache and removes all entries created by a different version of the metadata extraction
+        :param cache_path: Path to the cache folder
+        :param images_path: Path to the folder containing the media files
+        :param max_stale_entries: Maximum number of entries kept for files that are not requested
+        """
+        self.images_path = images_path
+        self.max_stale_entries = max_stale_entries
+        self.requested_paths = set()
+        self.timestamp = time.time()
+
+        os.makedirs(cache_path, exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(cache_path, MetadataCache.DATABASE_NAME)
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "path TEXT PRIMARY KEY, st_size INTEGER, st_mtime_ns INTEGER, st_ino INTEGER, "
+            "version INTEGER, data TEXT, last_used REAL, perceptual_hash TEXT, content_hash TEXT)"
+        )
+
+        # Caches created by older versions don't have the hash columns
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(metadata)")
+        ]
+        for column in ["perceptual_hash", "content_hash"]:
+            if column not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE metadata ADD COLUMN {column} TEXT"
+                )
+        self.connection.execute(
+            "DELETE FROM metadata WHERE version != ?", (spg_media.MediaProbe.VERSION,)
+        )
+
+    def get_probe(self, path, refresh=False):
+        """
+        Gets the probed metadata of a media file from the cache or probes the file if it is not cached or has changed
+        :param path: Path to the media file
+        :param refresh: Probes the file and updates the cache even if the cached entry is up to date
+        :return: MediaProbe object
+        """
+        stat = os.stat(path)
+        key = os.path.relpath(path, self.images_path)
+        self.requested_paths.add(key)
+
+        row = None
+        if not refresh:
+            row = self.connection.execute(
+                "SELECT data FROM metadata WHERE path = ? AND st_size = ? AND st_mtime_ns = ? AND st_ino = ?",
+                (key, stat.st_size, stat.st_mtime_ns, stat.st_ino),
+            ).fetchone()
+
+        if row:
+            self.connection.execute(
+                "UPDATE metadata SET last_used = ? WHERE path = ?",
+                (self.timestamp, key),
+            )
+            return spg_media.MediaProbe.from_dict(path, json.loads(row[0]))
+
+        probe = spg_media.MediaProbe(path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO metadata "
+            "(path, st_size, st_mtime_ns, st_ino, version, data, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                spg_media.MediaProbe.VERSION,
+                json.dumps(probe.to_dict()),
+                self.timestamp,
+            ),
+        )
+
+        return probe
+
+    def get_value(self, path, column):
+        """
+        Gets a value stored with the metadata of the current version of a media file
+        :param path: Path to the media file
+        :param column: Name of the column in which the value is stored
+        :return: Value or None if it is not cached or the file has changed
+        """
+        stat = os.stat(path)
+        row = self.connection.execute(
+            f"SELECT {column} FROM metadata "
+            "WHERE path = ? AND st_size = ? AND st_mtime_ns = ? AND st_ino = ?",
+            (
+                os.path.relpath(path, self.images_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+            ),
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def set_value(self, path, column, value):
+        """
+        Stores a value with the metadata of a media file. It is only stored if the metadata of the current version of
+        the file is cached (see get_probe) and it is removed when the file changes.
+        :param path: Path to the media file
+        :param column: Name of the column in which the value is stored
+        :param value: Value to store
+        """
+        stat = os.stat(path)
+        self.connection.execute(
+            f"UPDATE metadata SET {column} = ? "
+            "WHERE path = ? AND st_size = ? AND st_mtime_ns = ? AND st_ino = ?",
+            (
+                value,
+                os.path.relpath(path, self.images_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+            ),
+        )
+
+    def get_perceptual_hash(self, path):
+        """
+        Gets the cached perceptual hash of a media file
+        :param path: Path to the media file
+        :return: Perceptual hash as integer or None if it is not cached or the file has changed
+        """
+        perceptual_hash = self.get_value(path, "perceptual_hash")
+
+        return int(perceptual_hash, 16) if perceptual_hash else None
+
+    def set_perceptual_hash(self, path, perceptual_hash):
+        """
+        Stores the perceptual hash of a media file (see set_value)
+        :param path: Path to the media file
+        :param perceptual_hash: Perceptual hash as integer
+        """
+        self.set_value(path, "perceptual_hash", f"{perceptual_hash:x}")
+
+    def get_content_hash(self, path):
+        """
+        Gets the hash of the content of a media file, which is only computed if it is not cached or the file has changed
+        :param path: Path to the media file
+        :return: Content hash as hexadecimal string (see compute_content_hash)
+        """
+        content_hash = self.get_value(path, "content_hash")
+        if not content_hash:
+            content_hash = compute_content_hash(path)
+            self.set_value(path, "content_hash", content_hash)
+
+        return content_hash
+
+    def evict_stale_entries(self):
+        """
+        Evicts the least recently used entries of files that were not requested, if there are more than allowed
+        """
+        stale_paths = [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT path FROM metadata ORDER BY last_used DESC"
+            )
+            if row[0] not in self.requested_paths
+        ]
+
+        self.connection.executemany(
+            "DELETE FROM metadata WHERE path = ?",
+            [(path,) for path in stale_paths[self.max_stale_entries :]],
+        )
+
+    def close(self):
+        """
+        Evicts stale entries, stores all changes and closes the cache
+        """
+        self.evict_stale_entries()
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ThumbnailManifest:
+    """
+    Persistent manifest of the generated thumbnails, stored in an SQLite database. For each thumbnail it records the
+    stat signature of the source file, the settings used to generate the thumbnail and the stat signature and size of
+    the thumbnail itself, so that stale thumbnails can be detected without decoding any files. The placeholder of the
+    source file computed while generating the thumbnail is recorded as well.
+    """
+
+    # Name of the SQLite database file in the cache folder
+    DATABASE_NAME = "thumbnails.sqlite"
+
+    def __init__(self, cache_path, thumbnails_path):
+        """
+        Opens the manifest
+        :param cache_path: Path to the cache folder
+        :param thumbnails_path: Path to the folder containing the thumbnails
+        """
+        self.thumbnails_path = thumbnails_path
+
+        os.makedirs(cache_path, exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(cache_path, ThumbnailManifest.DATABASE_NAME)
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            "path TEXT PRIMARY KEY, source_signature TEXT, settings TEXT, "
+            "thumbnail_signature TEXT, width INTEGER, height INTEGER, placeholder TEXT)"
+        )
+
+        # Manifests created by older versions don't have the placeholder column
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(thumbnails)")
+        ]
+        if "placeholder" not in columns:
+            self.connection.execute(
+                "ALTER TABLE thumbnails ADD COLUMN placeholder TEXT"
+            )
+
+    @staticmethod
+    def get_source_signature(path):
+        """
+        Gets the stat signature of a source file
+        :param path: Path to the source file
+        :return: Signature string
+        """
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}"
+
+    @staticmethod
+    def get_thumbnail_signature(path):
+        """
+        Gets the stat signature of a thumbnail file
+        :param path: Path to the thumbnail file
+        :return: Signature string or None if the thumbnail doesn't exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    @staticmethod
+    def get_settings_key(settings):
+        """
+        Converts the settings used to generate a thumbnail to a string that can be compared
+        :param settings: JSON serializable dictionary containing the settings
+        :return: Settings string
+        """
+        return json.dumps(settings, sort_keys=True)
+
+    def get_entry(self, thumbnail_path):
+        """
+        Gets the manifest entry of a thumbnail
+        :param thumbnail_path: Path to the thumbnail file
+        :return: Tuple of the source signature, the settings string, the thumbnail signature and the thumbnail size or
+        None if the thumbnail is not in the manifest
+        """
+        row = self.connection.execute(
+            "SELECT source_signature, settings, thumbnail_signature, width, height FROM thumbnails WHERE path = ?",
+            (os.path.relpath(thumbnail_path, self.thumbnails_path),),
+        ).fetchone()
+
+        if not row:
+            return None
+
+        return row[0], row[1], row[2], (row[3], row[4])
+
+    def is_fresh(self, source_path, thumbnail_path, settings):
+        """
+        Checks if a thumbnail was generated from the current version of the source file with the specified settings
+        and wasn't changed afterwards
+        :param source_path: Path to the source file
+        :param thumbnail_path: Path to the thumbnail file
+        :param settings: Settings used to generate the thumbnail
+        :return: True if the thumbnail is up to date, False if it is stale or not in the manifest
+        """
+        entry = self.get_entry(thumbnail_path)
+
+        return bool(entry) and entry[:3] == (
+            ThumbnailManifest.get_source_signature(source_path),
+            ThumbnailManifest.get_settings_key(settings),
+            ThumbnailManifest.get_thumbnail_signature(thumbnail_path),
+        )
+
+    def get_thumbnail_size(self, thumbnail_path):
+        """
+        Gets the size of a thumbnail, if it didn't change since it was recorded in the manifest
+        :param thumbnail_path: Path to the thumbnail file
+        :return: Thumbnail size or None if it is unknown
+        """
+        entry = self.get_entry(thumbnail_path)
+
+        if entry and entry[2] == ThumbnailManifest.get_thumbnail_signature(
+            thumbnail_path
+        ):
+            return entry[3]
+
+        return None
+
+    def get_placeholder(self, thumbnail_path):
+        """
+        Gets the placeholder recorded with a thumbnail, if the thumbnail didn't change since it was recorded
+        :param thumbnail_path: Path to the thumbnail file
+        :return: Placeholder dictionary (see spg_media.get_placeholder) or None if it is unknown
+        """
+        row = self.connection.execute(
+            "SELECT thumbnail_signature, placeholder FROM thumbnails WHERE path = ?",
+            (os.path.relpath(thumbnail_path, self.thumbnails_path),),
+        ).fetchone()
+
+        if (
+            row
+            and row[1]
+            and row[0] == ThumbnailManifest.get_thumbnail_signature(thumbnail_path)
+        ):
+            return json.loads(row[1])
+
+        return None
+
+    def record(
+        self, source_path, thumbnail_path, settings, thumbnail_size, placeholder=None
+    ):
+        """
+        Records a thumbnail in the manifest
+        :param source_path: Path to the source file
+        :param thumbnail_path: Path to the thumbnail file
+        :param settings: Settings used to generate the thumbnail
+        :param thumbnail_size: Size of the thumbnail
+        :param placeholder: Optional placeholder of the source file
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO thumbnails "
+            "(path, source_signature, settings, thumbnail_signature, width, height, placeholder) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                os.path.relpath(thumbnail_path, self.thumbnails_path),
+                ThumbnailManifest.get_source_signature(source_path),
+                ThumbnailManifest.get_settings_key(settings),
+                ThumbnailManifest.get_thumbnail_signature(thumbnail_path),
+                thumbnail_size[0],
+                thumbnail_size[1],
+                json.dumps(placeholder) if placeholder else None,
+            ),
+        )
+
+    def remove(self, thumbnail_path):
+        """
+        Removes a thumbnail from the manifest
+        :param thumbnail_path: Path to the thumbnail file
+        """
+        self.connection.execute(
+            "DELETE FROM thumbnails WHERE path = ?",
+            (os.path.relpath(thumbnail_path, self.thumbnails_path),),
+        )
+
+    def close(self):
+        """
+        Stores all changes and closes the manifest
+        """
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,4 +1,6 @@
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 class SPGException(Exception):
@@ -9,7 +11,7 @@ class SPGException(Exception):
     """
 
     def __init__(self, message):
-        super().__init__()
+        super().__init__(message)
         self.message = message
 
 
@@ -32,3 +34,51 @@ def read_gallery_config(gallery_path):
             return json.load(gallery_in)
     except OSError:
         return []
+
+
+def get_error_message(exception):
+    """
+    Get a message describing an exception that can be shown to the user
+    :param exception: exception object
+    :return: message string
+    """
+    if isinstance(exception, SPGException):
+        return exception.message
+    return str(exception)
+
+
+def run_parallel(function, tasks, jobs=1, use_threads=False):
+    """
+    Calls a function for each task, using a pool of workers if more than one job is requested. At most twice as many
+    tasks as jobs are in flight at the same time and the results are returned in the order of the tasks.
+    Exceptions raised by a task are returned together with the task instead of being raised.
+    :param function: function to call for each task (it has to be picklable when using processes)
+    :param tasks: iterable of argument tuples, one for each call of the function
+    :param jobs: number of parallel workers (the tasks are executed in the current process if jobs <= 1)
+    :param use_threads: use a pool of threads instead of a pool of processes
+    :return: generator of (task, result, exception) tuples, where exception is None if the task succeeded
+    """
+    if not jobs or jobs <= 1:
+        for task in tasks:
+            try:
+                yield task, function(*task), None
+            except Exception as exception:
+                yield task, None, exception
+        return
+
+    def collect(task, future):
+        try:
+            return task, future.result(), None
+        except Exception as exception:
+            return task, None, exception
+
+    executor_class = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    with executor_class(max_workers=jobs) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append((task, executor.submit(function, *task)))
+            if len(pending) >= 2 * jobs:
+                yield collect(*pending.popleft())
+
+        while pending:
+            yield collect(*pending.popleft())
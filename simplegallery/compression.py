@@ -0,0 +1,157 @@
+import io
+import os
+import gzip
+import simplegallery.common as spg_common
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Extensions of the text files which are compressed. Photos, videos and thumbnails are already compressed.
+COMPRESSIBLE_EXTENSIONS = [".html", ".css", ".js", ".svg", ".json"]
+
+# Extensions of the compressed copies written next to the files for each supported encoding
+SIDECAR_EXTENSIONS = {"gzip": ".gz", "br": ".br"}
+
+
+def get_encodings():
+    """
+    Gets the encodings in which the files are compressed. Brotli is only supported if the brotli package is installed.
+    :return: List of encodings
+    """
+    return ["gzip", "br"] if brotli else ["gzip"]
+
+
+def compress(data, encoding):
+    """
+    Compresses data with the maximum compression level of an encoding
+    :param data: Bytes to compress
+    :param encoding: Encoding, one of SIDECAR_EXTENSIONS
+    :return: Compressed bytes
+    """
+    if encoding == "br":
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+
+    # The modification time is not stored, so that the same file is always compressed to the same bytes. The mtime
+    # argument of gzip.compress requires Python 3.8, so the data is written through a GzipFile.
+    compressed = io.BytesIO()
+    with gzip.GzipFile(
+        fileobj=compressed, mode="wb", compresslevel=9, mtime=0
+    ) as gz_out:
+        gz_out.write(data)
+    return compressed.getvalue()
+
+
+def is_sidecar_fresh(path, sidecar_path):
+    """
+    Checks if the compressed copy of a file is up to date. The copy gets the modification time of the file when it is
+    written, so that it is outdated as soon as the file is modified or replaced.
+    :param path: Path to the file
+    :param sidecar_path: Path to the compressed copy
+    :return: True if the compressed copy exists and was written from the current version of the file
+    """
+    try:
+        return os.stat(sidecar_path).st_mtime_ns == os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def compress_file(path, encodings):
+    """
+    Writes the compressed copies of a file which are not up to date
+    :param path: Path to the file
+    :param encodings: List of encodings
+    :return: Number of compressed copies written
+    """
+    outdated = [
+        encoding
+        for encoding in encodings
+        if not is_sidecar_fresh(path, path + SIDECAR_EXTENSIONS[encoding])
+    ]
+    if not outdated:
+        return 0
+
+    with open(path, "rb") as file_in:
+        data = file_in.read()
+    stat = os.stat(path)
+
+    count = 0
+    for encoding in outdated:
+        sidecar_path = path + SIDECAR_EXTENSIONS[encoding]
+        compressed = compress(data, encoding)
+
+        # A copy with the same content only gets the modification time of the file
+        if os.path.exists(sidecar_path):
+            with open(sidecar_path, "rb") as sidecar_in:
+                if sidecar_in.read() == compressed:
+                    os.utime(sidecar_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    continue
+
+        # Write to a temporary file first, so that a server never sees a partially written copy
+        with open(sidecar_path + ".tmp", "wb") as sidecar_out:
+            sidecar_out.write(compressed)
+        os.utime(sidecar_path + ".tmp", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(sidecar_path + ".tmp", sidecar_path)
+        count += 1
+
+    return count
+
+
+def remove_stale_sidecars(public_path, encodings):
+    """
+    Removes the compressed copies of the text files which were removed and the copies in encodings which are not used
+    anymore (e.g. because the precompression was disabled or the brotli package was uninstalled), so that a server
+    doesn't serve an outdated version of a file
+    :param public_path: Path to the public folder
+    :param encodings: List of the encodings in which the files are compressed
+    :return: Number of compressed copies removed
+    """
+    extensions = [SIDECAR_EXTENSIONS[encoding] for encoding in encodings]
+
+    count = 0
+    for folder, _, file_names in os.walk(public_path):
+        for file_name in file_names:
+            path = os.path.join(folder, file_name)
+            name, extension = os.path.splitext(path)
+            if (
+                extension in SIDECAR_EXTENSIONS.values()
+                and os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS
+                and (extension not in extensions or not os.path.exists(name))
+            ):
+                os.remove(path)
+                count += 1
+
+    return count
+
+
+def compress_public_files(public_path, jobs=1):
+    """
+    Writes compressed copies next to all text files of the public folder of the gallery (e.g. index.html.gz and
+    index.html.br), for hosts which can serve precompressed files but cannot compress them on the fly. Only the copies
+    which are not up to date are written and the stale copies are removed (see remove_stale_sidecars).
+    :param public_path: Path to the public folder
+    :param jobs: Number of files compressed in parallel
+    :return: Number of compressed copies written
+    """
+    encodings = get_encodings()
+    remove_stale_sidecars(public_path, encodings)
+
+    paths = []
+    for folder, _, file_names in os.walk(public_path):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                paths.append(os.path.join(folder, file_name))
+
+    # Compression releases the GIL, so the files are compressed by threads
+    count = 0
+    for (path, _), result, exception in spg_common.run_parallel(
+        compress_file, [(path, encodings) for path in paths], jobs, use_threads=True
+    ):
+        if exception:
+            raise spg_common.SPGException(
+                f"Cannot compress {path}: {spg_common.get_error_message(exception)}"
+            )
+        count += result
+
+    return count
@@ -1,31 +1,162 @@
+var slideImages = null
 var slides = {}
+var galleries = null
+var pageSlides = {previous: [], next: []}
+var virtualGallery = null
 
-function createSlides() {
-  $("a.gallery-photo").each(function (photo_id, photo) {
-    var slide = {
-      w:     photo.getAttribute('data-width'),
-      h:     photo.getAttribute('data-height'),
-      msrc:  photo.getElementsByTagName('img')[0].getAttribute('src'),
-      title: photo.getElementsByTagName('img')[0].getAttribute('alt'),
-      date:  photo.getAttribute('data-date'),
-    };
-
-    if (photo.getAttribute('data-type') == 'image')
-      slide['src'] = photo.getAttribute('href');
-    else
-      slide['html'] = '<video style="margin: 0px auto; height: 100%; max-width: 100%; max-height: 100%; display: block" data-index="' + photo.getAttribute('data-index') +
-                      '" controls><source src="' + photo.getAttribute('href') + '" type="video/mp4"></video>';
+// Space in pixels between the photos of a virtualized gallery, the same as the margins of the regular gallery
+var VIRTUAL_GALLERY_MARGIN = 8
+
+function getRendition(renditions) {
+  // Select the smallest rendition filling the viewport or the largest one if none is large enough
+  var pixelRatio = window.devicePixelRatio || 1;
+  for (var i=0; i<renditions.length; ++i) {
+    if (renditions[i].size[0] >= window.innerWidth * pixelRatio || renditions[i].size[1] >= window.innerHeight * pixelRatio)
+      return renditions[i];
+  }
+  return renditions.length > 0 ? renditions[renditions.length - 1] : null;
+}
+
+function createSlide(image) {
+  // The image has the same keys as in the slide manifests of the pages (src, type, size, thumbnail, description, date and renditions)
+  var slide = {
+    w:     image.size[0],
+    h:     image.size[1],
+    msrc:  image.thumbnail,
+    title: image.description,
+    date:  image.date,
+  };
+
+  if (image.type == 'image') {
+    // The original photo is only loaded by the download button
+    slide['src'] = image.src;
+    slide['original'] = image.src;
+
+    var rendition = getRendition(image.renditions || []);
+    if (rendition) {
+      slide['src'] = rendition.src;
+      slide['w'] = rendition.size[0];
+      slide['h'] = rendition.size[1];
+    }
+  }
+  else
+    slide['html'] = '<video style="margin: 0px auto; height: 100%; max-width: 100%; max-height: 100%; display: block" ' +
+                    'controls><source src="' + image.src + '" type="video/mp4"></video>';
+
+  return slide;
+}
 
-    var gallery_id = photo.getAttribute('data-gallery');
-    if (!(gallery_id in slides))
-      slides[gallery_id] = [];
+function createThumbnailSlide(photo) {
+  // Templates without a slide manifest store the slide in the attributes of the thumbnail. The current templates only
+  // store the type and the size of the photo, so that the slide can still be displayed if the separate manifest cannot
+  // be loaded. Thumbnails packed into a sprite atlas are displayed by a span referencing the separate thumbnail file.
+  var thumbnail = photo.querySelector('img, .sprite');
+  return createSlide({
+    src:         photo.getAttribute('href'),
+    type:        photo.getAttribute('data-type'),
+    size:        [photo.getAttribute('data-width'), photo.getAttribute('data-height')],
+    thumbnail:   thumbnail.getAttribute('data-src') || thumbnail.getAttribute('src'),
+    description: thumbnail.getAttribute('alt') || thumbnail.getAttribute('aria-label'),
+    date:        photo.getAttribute('data-date'),
+    renditions:  JSON.parse(photo.getAttribute('data-renditions') || '[]'),
+  });
+}
+
+function loadSlides() {
+  // The slide manifest of the page is either inline or a separate file, the slides are created when they are opened
+  var manifest = document.getElementById('gallery-slides');
+  if (!manifest)
+    return;
+
+  var url = manifest.getAttribute('data-src');
+  if (url)
+    slideImages = fetch(url).then(function (response) { return response.json(); })
+                            .then(function (images) { slideImages = images; })
+                            .catch(function () { slideImages = null; });
+  else
+    slideImages = JSON.parse(manifest.textContent);
+}
+
+function getSlide(photo) {
+  var position = photo.getAttribute('data-slide');
+  if (!Array.isArray(slideImages) || position === null)
+    return createThumbnailSlide(photo);
 
-    slides[gallery_id].push(slide);
+  if (!(position in slides))
+    slides[position] = createSlide(slideImages[position]);
+  return slides[position];
+}
+
+function getGalleryThumbnails(gallery) {
+  // The thumbnails of each gallery are collected once, the lightbox looks them up by their index
+  if (!gallery.thumbnails)
+    gallery.thumbnails = $(gallery).children('a.gallery-photo').toArray();
+  return gallery.thumbnails;
+}
+
+// Transparent image displayed instead of a lazy thumbnail until it gets close to the visible part of the page
+var EMPTY_IMAGE = 'data:image/gif;base64,R0lGODlhAQABAAAAACH5BAEKAAEALAAAAAABAAEAAAICTAEAOw==';
+
+function moveThumbnailSources(thumbnail, from, to) {
+  // Move the sources of the thumbnail and of the alternative formats of its picture between two sets of attributes
+  $(thumbnail).siblings('source').addBack().each(function (i, element) {
+    ['src', 'srcset'].forEach(function (attribute) {
+      var value = element.getAttribute(from + attribute);
+      if (value !== null) {
+        element.setAttribute(to + attribute, value);
+        element.removeAttribute(from + attribute);
+      }
+    });
   });
 }
 
-function getThumbBounds(gallery, index) {
-  var thumbnail = $('div.gallery a[data-gallery="'+gallery+'"][data-index="'+index+'"]')[0];
+function initLazyThumbnails() {
+  // Browsers with native lazy loading defer the thumbnails themselves. The others already started to load them, so
+  // the sources of the thumbnails which are not loaded yet are moved to data attributes, which cancels the downloads,
+  // and are restored when the thumbnails get close to the visible part of the page.
+  if ('loading' in HTMLImageElement.prototype || !('IntersectionObserver' in window))
+    return;
+
+  var thumbnails = $('img.thumbnail[loading="lazy"]').toArray().filter(function (thumbnail) {
+    return !thumbnail.complete;
+  });
+  if (thumbnails.length == 0)
+    return;
+
+  var observer = new IntersectionObserver(function (entries) {
+    entries.forEach(function (entry) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target);
+        moveThumbnailSources(entry.target, 'data-', '');
+      }
+    });
+  }, {rootMargin: '200px'});
+
+  thumbnails.forEach(function (thumbnail) {
+    moveThumbnailSources(thumbnail, '', 'data-');
+    thumbnail.setAttribute('src', EMPTY_IMAGE);
+    observer.observe(thumbnail);
+  });
+}
+
+function loadPageSlides() {
+  // Load the slides of the neighbouring pages, so that the lightbox can step across the page boundaries
+  var pagination = $('.gallery-pagination')[0];
+  if (!pagination || !window.fetch)
+    return;
+
+  ['previous', 'next'].forEach(function (page) {
+    var url = pagination.getAttribute('data-' + page + '-slides');
+    if (url)
+      fetch(url).then(function (response) { return response.json(); })
+                .then(function (images) { pageSlides[page] = images.map(createSlide); })
+                .catch(function () {});
+  });
+}
+
+function getThumbBounds(thumbnail) {
+  if (!thumbnail)
+    return;
   var pageYScroll = window.pageYOffset || document.documentElement.scrollTop;
   var rect = thumbnail.getBoundingClientRect();
   return {x: rect.left, y: rect.top + pageYScroll, w: rect.width};
@@ -43,13 +174,10 @@ function addCaptionHTML(item, captionEl, isFake) {
   return true;
 }
 
-function openPhotoSwipe() {
-  var index = parseInt($(this).attr('data-index'))
-  var gallery_id = $(this).attr('data-gallery')
-
+function createPhotoSwipe(items, index, getThumbBoundsFn) {
   var options = {
     index: index,
-    getThumbBoundsFn: function (id) { return getThumbBounds(gallery_id, id) },
+    getThumbBoundsFn: getThumbBoundsFn,
     addCaptionHTMLFn: addCaptionHTML,
     preload: [2,5],
     zoomEl: false,
@@ -61,13 +189,14 @@ function openPhotoSwipe() {
     shareButtons: [
         {id:'download', label:'Download image', url:'{{raw_image_url}}', download:true}
     ],
+    getImageURLForShare: function() { return gallery.currItem.original || gallery.currItem.src || ''; },
   };
 
-  var gallery = new PhotoSwipe( $('.pswp')[0], PhotoSwipeUI_Default, slides[gallery_id], options);
+  var gallery = new PhotoSwipe( $('.pswp')[0], PhotoSwipeUI_Default, items, options);
 
   gallery.listen('initialZoomOut', function() {
     if (this.currItem.html) {
-      var videos = $('div.pswp__item video[data-index='+this.getCurrentIndex()+']')
+      var videos = $(this.currItem.container).find('video')
       if (videos.length > 0)
         videos[0].pause()
     }
@@ -79,19 +208,243 @@ function openPhotoSwipe() {
       videos[i].pause()
 
     if (this.currItem.html) {
-      var videos = $('div.pswp__item video[data-index='+this.getCurrentIndex()+']')
+      var videos = $(this.currItem.container).find('video')
       if (videos.length > 0)
         videos[0].play()
     }
   });
 
+  return gallery;
+}
+
+function openPhotoSwipe() {
+  // Wait for a separate slide manifest which is still loading
+  var photo = this;
+  if (slideImages && !Array.isArray(slideImages)) {
+    slideImages.then(function () { openPhotoSwipe.call(photo); });
+    return false;
+  }
+
+  var thumbnails = getGalleryThumbnails(photo.parentNode);
+  var index = thumbnails.indexOf(photo);
+
+  // The first and the last gallery of a page continue with the slides of the previous and the next page
+  if (!galleries)
+    galleries = $('div.gallery').has('a.gallery-photo').toArray();
+  var previous = photo.parentNode == galleries[0] ? pageSlides.previous : [];
+  var next = photo.parentNode == galleries[galleries.length - 1] ? pageSlides.next : [];
+
+  var gallery = createPhotoSwipe(previous.concat(thumbnails.map(getSlide), next), index + previous.length, function (id) {
+    return getThumbBounds(thumbnails[id - previous.length]);
+  });
+
   gallery.init();
 
   return false;
 }
 
+function loadVirtualChunk(chunk) {
+  // Load the images of a chunk once and update the slides of its photos in place, so that an open lightbox shows them
+  var gallery = virtualGallery;
+  if (!gallery.chunks[chunk])
+    gallery.chunks[chunk] = fetch(gallery.manifest.chunks[chunk])
+      .then(function (response) {
+        if (!response.ok)
+          throw new Error(response.statusText);
+        return response.json();
+      })
+      .then(function (images) {
+        images.forEach(function (image, i) {
+          $.extend(gallery.items[chunk * gallery.manifest.chunk_size + i], createSlide(image));
+        });
+        gallery.chunks[chunk] = images;
+
+        // Render all photos of the chunk close to the visible part of the page at once
+        scheduleVirtualGalleryUpdate(false);
+        return images;
+      })
+      .catch(function (error) {
+        // Forget the failed request, so that the chunk is requested again when it is needed
+        delete gallery.chunks[chunk];
+        throw error;
+      });
+
+  return Promise.resolve(gallery.chunks[chunk]);
+}
+
+function getVirtualImage(index) {
+  var images = virtualGallery.chunks[Math.floor(index / virtualGallery.manifest.chunk_size)];
+  return Array.isArray(images) ? images[index % virtualGallery.manifest.chunk_size] : null;
+}
+
+function createVirtualPhoto(image, index, left, top, width, height) {
+  var photo = document.createElement('a');
+  photo.href = image.src;
+  photo.setAttribute('data-index', index);
+  photo.style.cssText = 'left: ' + left + 'px; top: ' + top + 'px; width: ' + width + 'px; height: ' + height + 'px';
+  if (image.placeholder)
+    photo.style.backgroundColor = image.placeholder.color;
+
+  var thumbnail = document.createElement('img');
+  thumbnail.src = image.thumbnail;
+  if (image.thumbnails) {
+    thumbnail.srcset = image.thumbnails.map(function (t) { return t.src + ' ' + t.size[0] + 'w'; }).join(', ');
+    thumbnail.sizes = Math.round(width) + 'px';
+  }
+  thumbnail.className = 'thumbnail rounded';
+  thumbnail.alt = image.description;
+  photo.appendChild(thumbnail);
+
+  return photo;
+}
+
+function layoutVirtualGallery() {
+  // Arrange the photos in justified rows, like the flexbox layout of the regular gallery. Only the thumbnail sizes are
+  // needed, so the whole gallery is laid out before the chunks are loaded.
+  var gallery = virtualGallery;
+  var sizes = gallery.manifest.sizes;
+  var width = gallery.element.clientWidth;
+
+  gallery.rows = [];
+  var top = 0, start = 0, rowWidth = 0;
+  for (var i=0; i<sizes.length; ++i) {
+    rowWidth += sizes[i][0];
+    var margins = (i - start + 1) * VIRTUAL_GALLERY_MARGIN;
+    if (rowWidth + margins >= width || i == sizes.length - 1) {
+      var scale = rowWidth + margins >= width ? (width - margins) / rowWidth : 1;
+      var height = Math.max.apply(null, sizes.slice(start, i + 1).map(function (size) { return size[1]; })) * scale;
+      gallery.rows.push({start: start, end: i + 1, top: top, height: height, scale: scale});
+      top += height + VIRTUAL_GALLERY_MARGIN;
+      start = i + 1;
+      rowWidth = 0;
+    }
+  }
+  gallery.element.style.height = top + 'px';
+
+  for (var index in gallery.photos)
+    gallery.photos[index].remove();
+  gallery.photos = {};
+  updateVirtualGallery();
+}
+
+function updateVirtualGallery() {
+  // Render only the rows close to the visible part of the page and remove the others
+  var gallery = virtualGallery;
+  var sizes = gallery.manifest.sizes;
+  var rect = gallery.element.getBoundingClientRect();
+  var from = -rect.top - window.innerHeight, to = -rect.top + 2 * window.innerHeight;
+
+  // Find the first row ending below the rendered area by binary search on the sorted row positions
+  var low = 0, high = gallery.rows.length;
+  while (low < high) {
+    var middle = (low + high) >> 1;
+    if (gallery.rows[middle].top + gallery.rows[middle].height < from)
+      low = middle + 1;
+    else
+      high = middle;
+  }
+
+  var visible = {}, missingChunks = {};
+  for (var r=low; r<gallery.rows.length && gallery.rows[r].top <= to; ++r) {
+    var row = gallery.rows[r];
+    var left = VIRTUAL_GALLERY_MARGIN / 2;
+    for (var i=row.start; i<row.end; ++i) {
+      var width = sizes[i][0] * row.scale, height = sizes[i][1] * row.scale;
+      visible[i] = true;
+      if (!(i in gallery.photos)) {
+        var image = getVirtualImage(i);
+        if (image) {
+          gallery.photos[i] = createVirtualPhoto(image, i, left, row.top + VIRTUAL_GALLERY_MARGIN / 2, width, height);
+          gallery.element.appendChild(gallery.photos[i]);
+        }
+        else
+          missingChunks[Math.floor(i / gallery.manifest.chunk_size)] = true;
+      }
+      left += width + VIRTUAL_GALLERY_MARGIN;
+    }
+  }
+
+  // Each chunk is loaded only once and renders its photos when it arrives, failed chunks are loaded again by the next
+  // update
+  for (var chunk in missingChunks)
+    loadVirtualChunk(parseInt(chunk)).catch(function () {});
+
+  for (var index in gallery.photos) {
+    if (!visible[index]) {
+      gallery.photos[index].remove();
+      delete gallery.photos[index];
+    }
+  }
+}
+
+function scheduleVirtualGalleryUpdate(relayout) {
+  // Update the gallery at most once per frame while scrolling or resizing
+  virtualGallery.relayout = virtualGallery.relayout || relayout;
+  if (virtualGallery.frame)
+    return;
+
+  virtualGallery.frame = requestAnimationFrame(function () {
+    virtualGallery.frame = null;
+    if (virtualGallery.relayout) {
+      virtualGallery.relayout = false;
+      layoutVirtualGallery();
+    }
+    else
+      updateVirtualGallery();
+  });
+}
+
+function openVirtualPhotoSwipe() {
+  var gallery = virtualGallery;
+  var lightbox = createPhotoSwipe(gallery.items, parseInt($(this).attr('data-index')), function (index) {
+    return getThumbBounds(gallery.photos[index]);
+  });
+
+  // Slides of chunks which are not loaded yet only have their size, their images are loaded when they are needed
+  lightbox.listen('gettingData', function (index, item) {
+    if (!item.src && !item.html)
+      loadVirtualChunk(Math.floor(index / gallery.manifest.chunk_size)).then(function () {
+        lightbox.invalidateCurrItems();
+        lightbox.updateSize(true);
+      }).catch(function () {});
+  });
+
+  lightbox.init();
+
+  return false;
+}
+
+function initVirtualGallery() {
+  var element = $('div.gallery-virtual')[0];
+  if (!element)
+    return;
+
+  fetch(element.getAttribute('data-manifest'))
+    .then(function (response) { return response.json(); })
+    .then(function (manifest) {
+      virtualGallery = {
+        element: element,
+        manifest: manifest,
+        chunks: [],
+        items: manifest.sizes.map(function (size) { return {w: size[0], h: size[1]}; }),
+        rows: [],
+        photos: {},
+        frame: null,
+        relayout: false,
+      };
+
+      $(element).on('click', 'a', openVirtualPhotoSwipe);
+      $(window).on('scroll', function () { scheduleVirtualGalleryUpdate(false); });
+      $(window).on('resize', function () { scheduleVirtualGalleryUpdate(true); });
+      layoutVirtualGallery();
+    });
+}
+
 
 $( document ).ready(function() {
-  createSlides()
-  $('div.gallery a').on('click', openPhotoSwipe)
+  initLazyThumbnails()
+  loadSlides()
+  loadPageSlides()
+  initVirtualGallery()
+  $('div.gallery').on('click', 'a.gallery-photo', openPhotoSwipe)
 });
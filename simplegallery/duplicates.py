@@ -0,0 +1,156 @@
+import numpy as np
+from PIL import Image
+
+# Width and height of the grid of gradients of a difference hash. The hash has HASH_SIZE * HASH_SIZE bits.
+HASH_SIZE = 8
+
+# Default maximum number of different bits between the hashes of two images considered duplicates
+DEFAULT_MAX_DISTANCE = 4
+
+# Minimum number of set and of unset bits of a hash. Flat and low-contrast images (e.g. solid colors, dark video frames
+# or smooth gradients) have hashes with almost all bits equal, which don't tell the images apart.
+MIN_HASH_BITS = 8
+
+
+def compute_dhash(image, hash_size=HASH_SIZE):
+    """
+    Computes the difference hash (dHash) of an image. The image is reduced to a small grayscale image and each bit
+    of the hash tells if the brightness increases or decreases between two horizontally adjacent pixels.
+    :param image: Image, usually an already decoded thumbnail
+    :param hash_size: Width and height of the grid of gradients
+    :return: Hash as integer with hash_size * hash_size bits
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.BOX),
+        dtype=np.int16,
+    )
+    gradients = pixels[:, 1:] > pixels[:, :-1]
+
+    return int.from_bytes(np.packbits(gradients).tobytes(), "big")
+
+
+def compute_image_dhash(image_path, hash_size=HASH_SIZE):
+    """
+    Computes the difference hash of an image file (see compute_dhash)
+    :param image_path: Path to the image file
+    :param hash_size: Width and height of the grid of gradients
+    :return: Hash as integer
+    """
+    with Image.open(image_path) as image:
+        return compute_dhash(image, hash_size)
+
+
+def get_hamming_distance(hash1, hash2):
+    """
+    Computes the number of different bits between two hashes
+    :param hash1: First hash as integer
+    :param hash2: Second hash as integer
+    :return: Hamming distance
+    """
+    return bin(hash1 ^ hash2).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree indexing hashes by their Hamming distance. Searching for the hashes within a small distance of
+    a hash only visits the subtrees which can contain them, instead of comparing the hash to all others.
+    """
+
+    def __init__(self):
+        """
+        Creates an empty tree
+        """
+        self.root = None
+
+    def add(self, item_hash, item):
+        """
+        Adds an item to the tree
+        :param item_hash: Hash of the item as integer
+        :param item: Item stored with the hash
+        """
+        node = (item_hash, item, {})
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = get_hamming_distance(item_hash, current[0])
+            if distance not in current[2]:
+                current[2][distance] = node
+                return
+            current = current[2][distance]
+
+    def search(self, item_hash, max_distance):
+        """
+        Finds all items whose hash is within the specified distance of a hash
+        :param item_hash: Hash as integer
+        :param max_distance: Maximum Hamming distance
+        :return: List of tuples containing the distance and the item
+        """
+        results = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_hash, node_item, children = nodes.pop()
+            distance = get_hamming_distance(item_hash, node_hash)
+            if distance <= max_distance:
+                results.append((distance, node_item))
+
+            # By the triangle inequality, matches can only be in children at a distance close to this one
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+
+        return results
+
+
+def is_degenerate_hash(item_hash, hash_size=HASH_SIZE):
+    """
+    Checks if a hash has too few set or unset bits to be compared with other hashes (see MIN_HASH_BITS)
+    :param item_hash: Hash as integer
+    :param hash_size: Width and height of the grid of gradients of the hash
+    :return: True if the hash should be ignored when looking for duplicates
+    """
+    bits = bin(item_hash).count("1")
+    return bits < MIN_HASH_BITS or bits > hash_size * hash_size - MIN_HASH_BITS
+
+
+def find_duplicate_groups(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Groups items whose hashes are within the specified distance of the hash of the first item of the group, its
+    representative. The items are visited in the order of the dictionary and each item which is not in a group yet
+    becomes the representative of the items close to it, so items are never grouped through a chain of neighbours.
+    Items with degenerate hashes are never grouped.
+    :param hashes: Dictionary mapping the items to their hashes, ordered by the preference of the items as
+    representatives
+    :param max_distance: Maximum Hamming distance between the hashes of duplicates
+    :return: List of groups with more than one item, each one starting with its representative followed by the other
+    items in the order of the dictionary
+    """
+    positions = {item: position for position, item in enumerate(hashes)}
+
+    tree = BKTree()
+    for item, item_hash in hashes.items():
+        if not is_degenerate_hash(item_hash):
+            tree.add(item_hash, item)
+
+    groups = []
+    grouped = set()
+    for item, item_hash in hashes.items():
+        if item in grouped or is_degenerate_hash(item_hash):
+            continue
+
+        duplicates = sorted(
+            (
+                duplicate
+                for _, duplicate in tree.search(item_hash, max_distance)
+                if duplicate != item and duplicate not in grouped
+            ),
+            key=positions.get,
+        )
+        if duplicates:
+            group = [item] + duplicates
+            groups.append(group)
+            grouped.update(group)
+
+    return groups
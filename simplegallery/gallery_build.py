@@ -1,10 +1,18 @@
 import argparse
+import bisect
+import filecmp
+import functools
 import os
 import sys
 import json
 import jinja2
 from collections import OrderedDict
+from collections.abc import Sequence
+import simplegallery.cache as spg_cache
 import simplegallery.common as spg_common
+import simplegallery.compression as spg_compression
+import simplegallery.duplicates as spg_duplicates
+import simplegallery.optimization as spg_optimization
 from simplegallery.logic.gallery_logic import get_gallery_logic
 
 
@@ -36,12 +44,328 @@ def parse_args():
         help="Forces the generation of the thumbnails even if they already exist",
     )
 
+    parser.add_argument(
+        "-fr",
+        "--force-refresh",
+        dest="force_refresh",
+        action="store_true",
+        help="Forces the metadata of all photos to be read again instead of reusing the existing data (for online "
+        "albums all photos are requested again)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        action="store",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of thumbnails generated or files compressed in parallel (default is the number of CPUs)",
+    )
+
+    parser.add_argument(
+        "--find-duplicates",
+        dest="find_duplicates",
+        action="store_true",
+        help="Finds groups of near duplicate photos and lists them",
+    )
+
+    parser.add_argument(
+        "--exclude-duplicates",
+        dest="exclude_duplicates",
+        action="store_true",
+        help="Finds groups of near duplicate photos and keeps only the photo with the highest resolution of each "
+        "group in the gallery",
+    )
+
+    parser.add_argument(
+        "--duplicate-distance",
+        dest="duplicate_distance",
+        action="store",
+        type=int,
+        default=spg_duplicates.DEFAULT_MAX_DISTANCE,
+        help=f"Maximum number of different bits between the perceptual hashes of two near duplicate photos "
+        f"(default is {spg_duplicates.DEFAULT_MAX_DISTANCE})",
+    )
+
     return parser.parse_args()
 
 
+# Folder in the cache folder of the gallery in which the compiled templates are stored
+TEMPLATES_CACHE_FOLDER = "templates"
+
+# Folder in the public folder in which the slide manifests of the pages are stored
+SLIDES_FOLDER = "slides"
+
+# Keys of the images data copied to the slide manifests, from which the lightbox creates the slides of a page
+SLIDE_KEYS = ["src", "type", "size", "thumbnail", "description", "date", "renditions"]
+
+# Ways in which the slide manifest of a page is passed to the browser: inline in the HTML page or as a separate JSON
+# file in the slides folder
+SLIDES_MANIFEST_TYPES = ["inline", "external"]
+
+# Default number of thumbnails at the top of each page which are loaded immediately with a high priority when the
+# thumbnails are loaded lazily
+DEFAULT_ABOVE_THE_FOLD_THUMBNAILS = 20
+
+# Keys of the images data copied to the chunks of a virtualized gallery, from which the thumbnails and the slides are
+# created
+VIRTUAL_GALLERY_KEYS = SLIDE_KEYS + ["thumbnail_size", "thumbnails", "placeholder"]
+
+# Name of the manifest of a virtualized gallery in the slides folder, which lists its chunks
+VIRTUAL_GALLERY_MANIFEST = "gallery.json"
+
+# Name of the list of the pages and manifests generated by the last build in the slides folder. Only these files are
+# removed when they are not generated anymore.
+GENERATED_FILES_MANIFEST = "files.json"
+
+
+class ImagesView(Sequence):
+    """
+    Read-only sequence of the images data dictionaries of the gallery in display order. Indexing and slicing return the
+    dictionaries stored in the images data instead of copies, so that the template can be rendered without copying the
+    data of all images.
+    """
+
+    def __init__(self, images_data, names=None):
+        """
+        Creates a view of the images data
+        :param images_data: Images data dictionary, the name of each image has to be stored in its "name" key
+        :param names: Optional list of the names of the images in the view, all images by default
+        """
+        self.images_data = images_data
+        self.names = list(images_data) if names is None else names
+        self.sorted_names = None
+        self.sorted_positions = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ImagesView(self.images_data, self.names[index])
+        return self.images_data[self.names[index]]
+
+    def get_section(self, first_name, last_name):
+        """
+        Gets the images of a section specified by the names of its first and last image. The names are sorted once,
+        so that each section is found with a binary search instead of comparing the names of all images.
+        :param first_name: Name of the first image of the section
+        :param last_name: Name of the last image of the section
+        :return: tuple containing the position of the first image of the section in the view starting from 1 (-1 if
+        the section is empty) and the view of the images of the section in display order
+        """
+        if self.sorted_names is None:
+            sorted_images = sorted(
+                (name, position) for position, name in enumerate(self.names)
+            )
+            self.sorted_names = [name for name, _ in sorted_images]
+            self.sorted_positions = [position for _, position in sorted_images]
+
+        start = bisect.bisect_left(self.sorted_names, first_name)
+        end = bisect.bisect_right(self.sorted_names, last_name)
+        positions = sorted(self.sorted_positions[start:end])
+
+        return (
+            positions[0] + 1 if positions else -1,
+            ImagesView(
+                self.images_data, [self.names[position] for position in positions]
+            ),
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_jinja_environment(templates_path, bytecode_cache_path=None):
+    """
+    Gets the Jinja environment loading the templates from a folder. The environment is created only once for each
+    folder, so that a process building several galleries compiles each template only once. Templates which were
+    modified are reloaded automatically.
+    :param templates_path: Path to the folder containing the templates
+    :param bytecode_cache_path: Optional path to the folder in which the compiled templates are stored, so that the
+    templates are not compiled again by the next build as long as they are not modified
+    :return: Jinja environment
+    """
+    bytecode_cache = None
+    if bytecode_cache_path:
+        os.makedirs(bytecode_cache_path, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_path)
+
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(templates_path), bytecode_cache=bytecode_cache
+    )
+
+    # Data passed to the browser with the tojson filter is written without whitespace
+    env.policies["json.dumps_kwargs"] = dict(sort_keys=True, separators=(",", ":"))
+
+    return env
+
+
+def get_page_name(page_number):
+    """
+    Gets the name of the HTML file of a page of the gallery
+    :param page_number: Number of the page, starting at 1
+    :return: index.html for the first page and page-<number>.html for the others
+    """
+    return "index.html" if page_number == 1 else f"page-{page_number}.html"
+
+
+def get_pages(images_data_list, gallery_config):
+    """
+    Splits the images into the pages of the gallery. Each date gets its own page if paginate_by_date is enabled and
+    pages are split further into pages of at most page_size images.
+    :param images_data_list: Sequence of images data dictionaries in the order in which they are displayed
+    :param gallery_config: Gallery configuration dictionary
+    :return: list of tuples containing the title (the date or an empty string) and the sequence of images of each page
+    """
+    page_size = gallery_config.get("page_size", 0)
+    if not isinstance(page_size, int) or page_size < 0:
+        raise spg_common.SPGException(
+            f"Invalid page_size {page_size}: a positive integer is expected (e.g. 500)"
+        )
+
+    pages = [("", images_data_list)]
+    if gallery_config.get("paginate_by_date", False):
+        # Each run of consecutive images with the same date is a slice of the images
+        pages = []
+        start = 0
+        dates = [image.get("date", "").strip() for image in images_data_list]
+        for end in range(1, len(dates) + 1):
+            if end == len(dates) or dates[end] != dates[start]:
+                pages.append((dates[start], images_data_list[start:end]))
+                start = end
+
+    if page_size:
+        pages = [
+            (title, images[start : start + page_size])
+            for title, images in pages
+            for start in range(0, len(images), page_size)
+        ]
+
+    return pages or [("", [])]
+
+
+def get_virtual_gallery_chunk_size(gallery_config):
+    """
+    Gets the number of images in each chunk of a virtualized gallery from the gallery config
+    :param gallery_config: Gallery configuration dictionary
+    :return: Number of images or 0 if the gallery is not virtualized
+    """
+    chunk_size = gallery_config.get("virtual_gallery_chunk_size", 0)
+    if not isinstance(chunk_size, int) or chunk_size < 0:
+        raise spg_common.SPGException(
+            f"Invalid virtual_gallery_chunk_size {chunk_size}: a positive integer is expected (e.g. 500)"
+        )
+
+    if chunk_size and (
+        gallery_config.get("page_size") or gallery_config.get("paginate_by_date")
+    ):
+        raise spg_common.SPGException(
+            "A virtualized gallery (virtual_gallery_chunk_size) cannot be split into pages (page_size and "
+            "paginate_by_date)"
+        )
+
+    return chunk_size
+
+
+def get_slides_manifest_type(gallery_config):
+    """
+    Gets how the slide manifest of each page is passed to the browser from the gallery config
+    :param gallery_config: Gallery configuration dictionary
+    :return: One of SLIDES_MANIFEST_TYPES
+    """
+    slides_manifest = gallery_config.get("slides_manifest", "inline")
+    if slides_manifest not in SLIDES_MANIFEST_TYPES:
+        raise spg_common.SPGException(
+            f"Invalid slides_manifest {slides_manifest}: one of {', '.join(SLIDES_MANIFEST_TYPES)} is expected"
+        )
+
+    return slides_manifest
+
+
+def get_above_the_fold_count(gallery_config):
+    """
+    Gets the number of thumbnails at the top of each page which are not loaded lazily from the gallery config
+    :param gallery_config: Gallery configuration dictionary
+    :return: Number of thumbnails or None if the thumbnails are not loaded lazily
+    """
+    if not gallery_config.get("lazy_thumbnails", False):
+        return None
+
+    count = gallery_config.get(
+        "above_the_fold_thumbnails", DEFAULT_ABOVE_THE_FOLD_THUMBNAILS
+    )
+    if not isinstance(count, int) or count < 0:
+        raise spg_common.SPGException(
+            f"Invalid above_the_fold_thumbnails {count}: a positive integer is expected (e.g. 20)"
+        )
+
+    return count
+
+
+def replace_if_changed(temp_path, path):
+    """
+    Replaces a file by its new version written to a temporary file, unless both have the same content. Unchanged files
+    keep their modification time, so that their compressed copies stay up to date.
+    :param temp_path: Path to the temporary file, which is removed
+    :param path: Path to the file
+    """
+    if os.path.exists(path) and filecmp.cmp(temp_path, path, shallow=False):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+
+
+def write_json_manifest(path, data):
+    """
+    Writes a compact JSON file loaded by the gallery in the browser
+    :param path: Path to the JSON file
+    :param data: JSON serializable data
+    """
+    with open(path + ".tmp", "w", encoding="utf-8") as manifest_out:
+        json.dump(data, manifest_out, separators=(",", ":"))
+    replace_if_changed(path + ".tmp", path)
+
+
+def write_virtual_gallery(images_data_list, gallery_config, chunk_size):
+    """
+    Writes the manifests of a virtualized gallery, from which the browser renders only the photos close to the visible
+    part of the page. The manifest contains the thumbnail sizes of all photos, so that the whole gallery can be laid out
+    before the chunks with the data of the photos are loaded.
+    :param images_data_list: Sequence of images data dictionaries in the order in which they are displayed
+    :param gallery_config: Gallery configuration dictionary
+    :param chunk_size: Number of images in each chunk
+    :return: Dictionary containing the URL of the manifest and the URLs of all written files
+    """
+    slides_path = os.path.join(gallery_config["public_path"], SLIDES_FOLDER)
+    os.makedirs(slides_path, exist_ok=True)
+
+    chunks = []
+    for start in range(0, len(images_data_list), chunk_size):
+        chunks.append(f"{SLIDES_FOLDER}/chunk-{len(chunks) + 1}.json")
+        write_json_manifest(
+            os.path.join(gallery_config["public_path"], chunks[-1]),
+            [
+                {key: image.get(key) for key in VIRTUAL_GALLERY_KEYS}
+                for image in images_data_list[start : start + chunk_size]
+            ],
+        )
+
+    write_json_manifest(
+        os.path.join(slides_path, VIRTUAL_GALLERY_MANIFEST),
+        dict(
+            chunk_size=chunk_size,
+            chunks=chunks,
+            sizes=[image["thumbnail_size"] for image in images_data_list],
+        ),
+    )
+
+    manifest = f"{SLIDES_FOLDER}/{VIRTUAL_GALLERY_MANIFEST}"
+    return dict(manifest=manifest, files=chunks + [manifest])
+
+
 def build_html(gallery_config):
     """
-    Generates the HTML file (index.html) of the gallery
+    Generates the HTML files of the gallery (index.html and page-<number>.html if the gallery is split into pages)
     :param gallery_config: Gallery configuration dictionary
     """
 
@@ -54,7 +378,10 @@ def build_html(gallery_config):
         for image in images_data:
             images_data[image]['description'] = ''
 
-    images_data_list = [{**images_data[image], "name": image} for image in images_data.keys()]
+    # The images are passed to the template as a view, which doesn't copy their data
+    for image in images_data:
+        images_data[image]["name"] = image
+    images_data_list = ImagesView(images_data)
 
     # Find the first photo for the background if no background photo specified
     background_photo = gallery_config["background_photo"]
@@ -78,23 +405,150 @@ def build_html(gallery_config):
         else:
             remote_data["text"] = "shared album"
 
-    # Setup the jinja2 environment
-    file_loader = jinja2.FileSystemLoader(gallery_config["templates_path"])
-    env = jinja2.Environment(loader=file_loader)
+    # Get the jinja2 environment, the compiled templates are stored in the cache of the gallery
+    bytecode_cache_path = None
+    if not gallery_config.get("disable_cache", False):
+        bytecode_cache_path = os.path.join(
+            spg_cache.get_cache_path(gallery_config), TEMPLATES_CACHE_FOLDER
+        )
+    env = get_jinja_environment(gallery_config["templates_path"], bytecode_cache_path)
+
+    # A virtualized gallery is rendered in the browser from chunked manifests. Templates which don't support it render
+    # all images.
+    virtual_gallery = None
+    chunk_size = get_virtual_gallery_chunk_size(gallery_config)
+    if chunk_size:
+        virtual_gallery = write_virtual_gallery(
+            images_data_list, gallery_config, chunk_size
+        )
 
-    # Renter the HTML template
+    # Split the images into pages, which link to each other and to the slide manifests of the neighbouring pages
+    pages = [("", images_data_list)]
+    if not virtual_gallery:
+        pages = get_pages(images_data_list, gallery_config)
+    page_links = [
+        dict(
+            number=page_number,
+            title=title,
+            href=get_page_name(page_number),
+            slides=f"{SLIDES_FOLDER}/page-{page_number}.json",
+        )
+        for page_number, (title, _) in enumerate(pages, start=1)
+    ]
+
+    # The slides of a page are stored in a manifest, from which the lightbox creates them, instead of in the
+    # attributes of the thumbnails. Pages with neighbours always need a separate manifest, which the neighbouring
+    # pages load.
+    slides_manifest = get_slides_manifest_type(gallery_config)
+    write_slides = len(pages) > 1 or (
+        slides_manifest == "external" and not virtual_gallery
+    )
+
+    # The thumbnails below the first screenful are loaded lazily if enabled
+    above_the_fold = get_above_the_fold_count(gallery_config)
+
+    slides_path = os.path.join(gallery_config["public_path"], SLIDES_FOLDER)
+    if write_slides:
+        os.makedirs(slides_path, exist_ok=True)
+
+    # Render the HTML template and write the output while it is generated instead of keeping the whole page in memory
     template = env.get_template("index_template.jinja")
-    html = template.render(
-        images=images_data_list,
-        gallery_config=gallery_config,
-        background_photo=background_photo,
-        remote_data=remote_data,
+    for page_number, (_, page_images) in enumerate(pages, start=1):
+        pagination = None
+        if len(pages) > 1:
+            pagination = dict(
+                number=page_number,
+                pages=page_links,
+                previous=page_links[page_number - 2] if page_number > 1 else None,
+                next=page_links[page_number] if page_number < len(pages) else None,
+            )
+
+        # The thumbnails reference their slide by its position in the manifest of the page
+        slides = None
+        if not virtual_gallery:
+            for position, image in enumerate(page_images):
+                image["slide"] = position
+                if above_the_fold is not None:
+                    image["lazy"] = position >= above_the_fold
+            slides = dict(
+                images=[
+                    {key: image.get(key) for key in SLIDE_KEYS} for image in page_images
+                ]
+            )
+
+        if write_slides:
+            write_json_manifest(
+                os.path.join(slides_path, f"page-{page_number}.json"), slides["images"]
+            )
+            if slides_manifest == "external":
+                slides = dict(src=page_links[page_number - 1]["slides"])
+
+        # Write to a temporary file first and replace the page only when it is complete and changed, so that an error
+        # in the template doesn't leave a partially written page
+        page_path = os.path.join(
+            gallery_config["public_path"], get_page_name(page_number)
+        )
+        try:
+            with open(page_path + ".tmp", "w", encoding="utf-8") as out:
+                html = template.generate(
+                    images=page_images,
+                    gallery_config=gallery_config,
+                    background_photo=background_photo,
+                    remote_data=remote_data,
+                    pagination=pagination,
+                    virtual_gallery=virtual_gallery,
+                    slides=slides,
+                )
+
+                # Minify the HTML, inline the local stylesheets and defer the scripts if specified in the config
+                if gallery_config.get("optimize_html", False):
+                    html = spg_optimization.optimize_html(
+                        html, gallery_config["public_path"]
+                    )
+
+                out.writelines(html)
+            replace_if_changed(page_path + ".tmp", page_path)
+        finally:
+            if os.path.exists(page_path + ".tmp"):
+                os.remove(page_path + ".tmp")
+
+    generated_files = [page_link["href"] for page_link in page_links[1:]]
+    if write_slides:
+        generated_files += [page_link["slides"] for page_link in page_links]
+    if virtual_gallery:
+        generated_files += virtual_gallery["files"]
+    remove_stale_pages(gallery_config, generated_files)
+
+
+def remove_stale_pages(gallery_config, generated_files):
+    """
+    Removes the pages and manifests generated by the previous build which were not generated again (e.g. because the
+    gallery has fewer pages now). Only the files recorded by the previous build are removed, so that the files of the
+    user are never touched, and nothing is removed if the gallery was never split into pages or virtualized.
+    :param gallery_config: Gallery configuration dictionary
+    :param generated_files: List of the paths relative to the public folder of the pages (except index.html) and of the
+    manifests generated by this build
+    """
+    public_path = gallery_config["public_path"]
+    generated_files_path = os.path.join(
+        public_path, SLIDES_FOLDER, GENERATED_FILES_MANIFEST
     )
 
-    with open(
-        os.path.join(gallery_config["public_path"], "index.html"), "w", encoding="utf-8"
-    ) as out:
-        out.write(html)
+    previous_files = []
+    if os.path.exists(generated_files_path):
+        with open(generated_files_path, "r", encoding="utf-8") as generated_files_in:
+            previous_files = json.load(generated_files_in)
+
+    for previous_file in set(previous_files) - set(generated_files):
+        path = os.path.join(public_path, *previous_file.split("/"))
+        if os.path.exists(path):
+            os.remove(path)
+
+    if generated_files:
+        os.makedirs(os.path.dirname(generated_files_path), exist_ok=True)
+        write_json_manifest(generated_files_path, generated_files)
+    elif os.path.exists(generated_files_path):
+        os.remove(generated_files_path)
 
 
 def main():
@@ -121,7 +575,7 @@ def main():
     # Check if thumbnails exist and generate them if needed or if specified by the user
     try:
         spg_common.log("Generating thumbnails...")
-        gallery_logic.create_thumbnails(args.force_thumbnails)
+        gallery_logic.create_thumbnails(args.force_thumbnails, args.jobs)
     except spg_common.SPGException as exception:
         spg_common.log(exception.message)
         sys.exit(1)
@@ -131,10 +585,32 @@ def main():
         )
         sys.exit(1)
 
+    # Find near duplicate photos if specified by the user
+    excluded_photos = []
+    if args.find_duplicates or args.exclude_duplicates:
+        try:
+            spg_common.log("Finding near duplicate photos...")
+            duplicate_groups = gallery_logic.find_duplicates(args.duplicate_distance)
+            spg_common.log(
+                f"Groups of near duplicate photos found: {len(duplicate_groups)}"
+            )
+            for group in duplicate_groups:
+                spg_common.log(f"{group[0]}\t\tduplicates: {', '.join(group[1:])}")
+                if args.exclude_duplicates:
+                    excluded_photos += group[1:]
+        except spg_common.SPGException as exception:
+            spg_common.log(exception.message)
+            sys.exit(1)
+        except Exception as exception:
+            spg_common.log(
+                f"Something went wrong while finding near duplicate photos: {str(exception)}"
+            )
+            sys.exit(1)
+
     # Generate the images_data.json
     try:
         spg_common.log("Generating the images_data.json file...")
-        gallery_logic.create_images_data_file()
+        gallery_logic.create_images_data_file(args.force_refresh, excluded_photos)
         spg_common.log(
             "The image descriptions are stored in images_data.json. You can edit the file to add more "
             "descriptions and build the gallery again."
@@ -152,12 +628,41 @@ def main():
     try:
         spg_common.log("Creating the index.html...")
         build_html(gallery_config)
+    except spg_common.SPGException as exception:
+        spg_common.log(exception.message)
+        sys.exit(1)
     except Exception as exception:
         spg_common.log(
             f"Something went wrong while generating the gallery HTML: {str(exception)}"
         )
         sys.exit(1)
 
+    # Write compressed copies of the text files for hosts which serve precompressed files if specified in the config
+    if gallery_config.get("precompress", False):
+        try:
+            spg_common.log("Compressing the text files...")
+            if "br" not in spg_compression.get_encodings():
+                spg_common.log(
+                    "Install the brotli package to write Brotli compressed files as well."
+                )
+            count = spg_compression.compress_public_files(
+                gallery_config["public_path"], args.jobs
+            )
+            spg_common.log(f"Compressed files written: {count}")
+        except spg_common.SPGException as exception:
+            spg_common.log(exception.message)
+            sys.exit(1)
+        except Exception as exception:
+            spg_common.log(
+                f"Something went wrong while compressing the text files: {str(exception)}"
+            )
+            sys.exit(1)
+    else:
+        # Remove the compressed copies of a previous build, which would be served instead of the updated files
+        count = spg_compression.remove_stale_sidecars(gallery_config["public_path"], [])
+        if count:
+            spg_common.log(f"Compressed files removed: {count}")
+
     spg_common.log(
         "The gallery was built successfully. Open public/index.html to view it."
     )
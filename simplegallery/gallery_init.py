@@ -169,6 +169,7 @@ def create_gallery_json(gallery_root, remote_link, use_defaults=False):
         templates_path=os.path.join(gallery_root, "templates"),
         images_path=os.path.join(gallery_root, "public", "images", "photos"),
         thumbnails_path=os.path.join(gallery_root, "public", "images", "thumbnails"),
+        web_path=os.path.join(gallery_root, "public", "images", "web"),
         thumbnail_height=160,
         title="My Gallery",
         description="Default description of my gallery",
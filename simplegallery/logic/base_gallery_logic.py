@@ -1,6 +1,7 @@
 import os
 import json
 from collections import OrderedDict
+import simplegallery.common as spg_common
 
 
 class BaseGalleryLogic:
@@ -16,25 +17,40 @@ class BaseGalleryLogic:
         """
         self.gallery_config = gallery_config
 
-    def create_thumbnails(self, force=False):
+    def create_thumbnails(self, force=False, jobs=1):
         """
         Checks if every image has an existing thumbnail and generates it if needed (or if forced by the user)
         :param force: Forces generation of thumbnails if set to true
+        :param jobs: Number of thumbnails that can be generated in parallel
         """
         pass
 
-    def generate_images_data(self, images_data):
+    def generate_images_data(self, images_data, force=False, excluded_photos=None):
         """
         Generate the metadata for each image
         :param images_data: Images data dictionary containing the existing metadata of the images and which will be
         updated by this function
+        :param force: Forces the metadata of all images to be generated again instead of reusing existing data
+        :param excluded_photos: Optional list of names of photos that should not be part of the gallery
         :return updated images data dictionary
         """
         return images_data
 
-    def create_images_data_file(self):
+    def find_duplicates(self, max_distance):
+        """
+        Finds groups of near duplicate photos by comparing their perceptual hashes
+        :param max_distance: Maximum number of different bits between the hashes of two duplicates
+        :return: list of groups of photo names, the first photo of each group is the one that should be kept
+        """
+        raise spg_common.SPGException(
+            "Finding duplicates is only supported for galleries of local photos"
+        )
+
+    def create_images_data_file(self, force=False, excluded_photos=None):
         """
         Creates or updates the images_data.json file with metadata for each image (e.g. size, description and thumbnail)
+        :param force: Forces the metadata of all images to be generated again instead of reusing existing data
+        :param excluded_photos: Optional list of names of photos that should not be part of the gallery
         """
         images_data_path = self.gallery_config["images_data_file"]
 
@@ -46,7 +62,7 @@ class BaseGalleryLogic:
             images_data = {}
 
         # Generate the images data
-        self.generate_images_data(images_data)
+        self.generate_images_data(images_data, force, excluded_photos)
 
         # Write the data to the JSON file
         with open(images_data_path, "w", encoding="utf-8") as images_out:
@@ -0,0 +1,231 @@
+import time
+import requests
+import pkg_resources
+import simplegallery.common as spg_common
+import simplegallery.media as spg_media
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from simplegallery.logic.base_gallery_logic import BaseGalleryLogic
+
+
+class RemoteGalleryLogic(BaseGalleryLogic):
+    """
+    Base class for gallery logics of shared albums hosted by a remote provider. Derived classes define how the photos
+    are found on the album page and how the links to the photos are built. The sizes of the photos are fetched
+    concurrently, limited by the following options in the gallery config:
+    - remote_concurrency - maximum number of concurrent requests
+    - remote_timeout - timeout of each request in seconds
+    - remote_retries - number of times a failed request is retried
+    """
+
+    # Default values of the options limiting the requests to the remote provider
+    DEFAULT_CONCURRENCY = 8
+    DEFAULT_TIMEOUT = 30
+    DEFAULT_RETRIES = 3
+
+    # Delay in seconds before the first retry of a failed request. It is doubled with every following retry.
+    RETRY_BACKOFF = 1.0
+
+    def create_thumbnails(self, force=False, jobs=1):
+        """
+        This function doesn't do anything, because the thumbnails are links to the remote provider
+        :param force: Forces generation of thumbnails if set to true
+        :param jobs: Number of thumbnails that can be generated in parallel
+        """
+        pass
+
+    def find_photo_elements(self, driver):
+        """
+        Finds the elements representing the photos on the album page
+        :param driver: Selenium webdriver with the loaded album page
+        :return: list of web elements
+        """
+        pass
+
+    def get_photo_url(self, photo_element):
+        """
+        Gets the URL of a photo from its element on the album page
+        :param photo_element: web element representing the photo
+        :return: photo URL
+        """
+        pass
+
+    def parse_photo_link(self, photo_url):
+        """
+        Extracts the base URL (URL without query parameters) and the photo name from a photo URL
+        :param photo_url: photo URL
+        :return: base URL and photo name
+        """
+        pass
+
+    def get_photo_link(self, photo_base_url, size):
+        """
+        Builds the link to a photo scaled to the specified size
+        :param photo_base_url: base URL of the photo
+        :param size: tuple containing the width and the height of the photo
+        :return: photo URL
+        """
+        pass
+
+    def find_photo_urls(self):
+        """
+        Loads the album page with a headless Firefox and extracts the URLs of all photos
+        :return: list of photo URLs in the order of the album
+        """
+
+        # Get the path to the Firefox webdriver
+        webdriver_path = pkg_resources.resource_filename(
+            "simplegallery", "bin/geckodriver"
+        )
+
+        # Configure the driver in headless mode
+        options = Options()
+        options.headless = True
+        spg_common.log(f"Starting Firefox webdriver...")
+        driver = webdriver.Firefox(options=options, executable_path=webdriver_path)
+
+        try:
+            # Load the album page
+            spg_common.log(
+                f'Loading album from {self.gallery_config["remote_link"]}...'
+            )
+            driver.get(self.gallery_config["remote_link"])
+
+            # Wait until the page is fully loaded
+            loading_start = time.time()
+            last_image_count = 0
+            while True:
+                image_count = len(self.find_photo_elements(driver))
+                if image_count > 1 and image_count == last_image_count:
+                    break
+                last_image_count = image_count
+                if (time.time() - loading_start) > 30:
+                    raise spg_common.SPGException("Loading the page took too long.")
+                time.sleep(5)
+
+            # Parse all photos
+            spg_common.log("Finding photos...")
+            return [
+                self.get_photo_url(photo) for photo in self.find_photo_elements(driver)
+            ]
+        finally:
+            driver.quit()
+
+    def get_remote_image_size(self, photo_url):
+        """
+        Gets the size of a remote photo, retrying with an exponential backoff if the request fails because of a
+        network error or a temporary server error
+        :param photo_url: photo URL
+        :return: tuple containing the width and the height of the photo in pixels
+        """
+        photo_base_url, _ = self.parse_photo_link(photo_url)
+        retries = self.gallery_config.get(
+            "remote_retries", RemoteGalleryLogic.DEFAULT_RETRIES
+        )
+
+        for attempt in range(retries + 1):
+            try:
+                return spg_media.get_remote_image_size(
+                    self.get_photo_link(photo_base_url, None),
+                    timeout=self.gallery_config.get(
+                        "remote_timeout", RemoteGalleryLogic.DEFAULT_TIMEOUT
+                    ),
+                )
+            except requests.RequestException as exception:
+                response = getattr(exception, "response", None)
+                if attempt == retries or (
+                    response is not None
+                    and response.status_code < 500
+                    and response.status_code != 429
+                ):
+                    raise
+                time.sleep(RemoteGalleryLogic.RETRY_BACKOFF * 2**attempt)
+
+    def generate_images_data(self, images_data, force=False, excluded_photos=None):
+        """
+        Parse the remote link and extract link to the images and the thumbnails. Photos which are already in the images
+        data are not requested again, photos which were removed from the album are removed from the images data.
+        :param images_data: Images data dictionary containing the existing metadata of the images and which will be
+        updated by this function
+        :param force: Forces the sizes of all photos to be requested again instead of reusing the existing images data
+        :param excluded_photos: Optional list of names of photos that should not be part of the gallery
+        :return updated images data dictionary
+        """
+        photo_urls = self.find_photo_urls()
+        spg_common.log(f"Photos found: {len(photo_urls)}")
+
+        # Reuse the sizes of the photos which were already processed in a previous build
+        sizes = {}
+        new_photo_urls = []
+        for photo_url in photo_urls:
+            _, photo_name = self.parse_photo_link(photo_url)
+            if not force and images_data.get(photo_name, {}).get("size"):
+                sizes[photo_name] = images_data[photo_name]["size"]
+            else:
+                new_photo_urls.append(photo_url)
+        if sizes:
+            spg_common.log(f"Photos already processed: {len(sizes)}")
+
+        # Fetch the sizes of the new photos concurrently. The results are returned in the order of the album.
+        current_photo = 1
+        failed_photos = 0
+        for (photo_url,), size, exception in spg_common.run_parallel(
+            self.get_remote_image_size,
+            [(photo_url,) for photo_url in new_photo_urls],
+            self.gallery_config.get(
+                "remote_concurrency", RemoteGalleryLogic.DEFAULT_CONCURRENCY
+            ),
+            use_threads=True,
+        ):
+            _, photo_name = self.parse_photo_link(photo_url)
+            spg_common.log(
+                f"{current_photo}/{len(new_photo_urls)}\t\tProcessing photo {photo_name}: {photo_url}"
+            )
+            current_photo += 1
+
+            if exception:
+                spg_common.log(
+                    f"Cannot get the size of photo {photo_name}: {spg_common.get_error_message(exception)}"
+                )
+                failed_photos += 1
+
+                # Fall back to the size from a previous build if there is one
+                size = images_data.get(photo_name, {}).get("size")
+                if not size:
+                    continue
+
+            sizes[photo_name] = size
+
+        # Rebuild the images data in the order of the album, which also drops the photos removed from the album
+        previous_images_data = dict(images_data)
+        images_data.clear()
+        for photo_url in photo_urls:
+            photo_base_url, photo_name = self.parse_photo_link(photo_url)
+            if photo_name not in sizes or photo_name in (excluded_photos or []):
+                continue
+
+            # Compute the thumbnail size
+            size = sizes[photo_name]
+            thumbnail_size = spg_media.get_thumbnail_size(
+                size, self.gallery_config["thumbnail_height"]
+            )
+
+            # Keep the description and the modification time of photos from a previous build
+            previous_data = previous_images_data.get(photo_name, {})
+
+            # Add the photo to the images_data dict
+            images_data[photo_name] = dict(
+                description=previous_data.get("description", ""),
+                mtime=previous_data.get("mtime", time.time()),
+                size=size,
+                src=self.get_photo_link(photo_base_url, size),
+                thumbnail=self.get_photo_link(photo_base_url, thumbnail_size),
+                thumbnail_size=thumbnail_size,
+                type="image",
+            )
+
+        if failed_photos:
+            spg_common.log(f"Photos that could not be processed: {failed_photos}")
+        spg_common.log(f"All photos processed!")
+
+        return images_data
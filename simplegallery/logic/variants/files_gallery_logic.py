@@ -1,30 +1,81 @@
 import os
+import re
 import glob
+import json
+import hashlib
 from datetime import datetime
+import simplegallery.cache as spg_cache
 import simplegallery.common as spg_common
+import simplegallery.duplicates as spg_duplicates
 import simplegallery.media as spg_media
 from simplegallery.logic.base_gallery_logic import BaseGalleryLogic
 
 
-def check_correct_thumbnail_size(thumbnail_path, expected_height):
-    """
-    Check if a thumbnail has the correct height
-    :param thumbnail_path: Path to the thumbnail file
-    :param expected_height: Expected height of the thumbnail in pixels
-    :return: True if the height of the thumbnail equals the expected height, False otherwise
-    """
-    return expected_height == spg_media.get_image_size(thumbnail_path)[1]
-
-
-def get_thumbnail_name(thumbnails_path, photo_name):
+def get_thumbnail_name(thumbnails_path, photo_name, density=None, extension=".jpg"):
     """
     Generates the full path to a thumbnail file
     :param thumbnails_path: Path to the folders where the thumbnails will be stored
     :param photo_name: Name of the original photo
+    :param density: Pixel density of the thumbnail or None for the thumbnail with the highest density
+    :param extension: File extension of the thumbnail, which defines its format
     :return: Full path to the thumbnail file
     """
     photo_name_without_extension = os.path.splitext(os.path.basename(photo_name))[0]
-    return os.path.join(thumbnails_path, photo_name_without_extension + ".jpg")
+    if density is not None:
+        photo_name_without_extension += f"@{density:g}x"
+    return os.path.join(thumbnails_path, photo_name_without_extension + extension)
+
+
+def get_content_addressed_name(folder, content_hash, settings, extension=".jpg"):
+    """
+    Generates the full path to a file named by the content of its source file and the settings used to generate it.
+    Identical sources share the same file and the name changes whenever the source or the settings change.
+    :param folder: Path to the folder where the file will be stored
+    :param content_hash: Content hash of the source file
+    :param settings: JSON serializable dictionary containing the settings used to generate the file
+    :param extension: File extension, which defines the format of the file
+    :return: Full path to the file
+    """
+    key = content_hash + spg_cache.ThumbnailManifest.get_settings_key(settings)
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    name = name[: FilesGalleryLogic.CONTENT_ADDRESSED_NAME_LENGTH]
+    return os.path.join(folder, name + extension)
+
+
+def get_sprite_percentage(offset, sprite_length, tile_length):
+    """
+    Converts the offset of a tile in a sprite atlas to a CSS background position percentage, which aligns the same
+    point of the tile and of the background area
+    :param offset: Offset of the tile in the atlas in pixels
+    :param sprite_length: Width or height of the atlas in pixels
+    :param tile_length: Width or height of the tile in pixels
+    :return: Background position in percent
+    """
+    if sprite_length == tile_length:
+        return 0
+    return round(offset / (sprite_length - tile_length) * 100, 4)
+
+
+def get_sprite_groups(photo_names, sprite_size):
+    """
+    Splits the photos into the groups which are packed into the same sprite atlas. Consecutive photos are grouped and a
+    group ends after a photo selected by the hash of its name or when it is full. The ends of the groups don't depend on
+    the other photos, so adding or removing a photo only changes the group containing it.
+    :param photo_names: List of the names of the photos in the order in which they are displayed
+    :param sprite_size: Maximum number of photos in a group
+    :return: List of groups, each a list of photo names
+    """
+    # A group ends after every second photo of its maximum size on average
+    modulus = max(sprite_size // 2, 1)
+
+    groups = [[]]
+    for photo_name in photo_names:
+        groups[-1].append(photo_name)
+        name_hash = int(hashlib.sha256(photo_name.encode("utf-8")).hexdigest()[:8], 16)
+        if name_hash % modulus == 0 or len(groups[-1]) == sprite_size:
+            groups.append([])
+
+    return [group for group in groups if group]
 
 
 class FilesGalleryLogic(BaseGalleryLogic):
@@ -38,19 +89,393 @@ class FilesGalleryLogic(BaseGalleryLogic):
     """
     THUMBNAIL_SIZE_FACTOR = 2
 
-    def create_thumbnails(self, force=False):
+    # Pixel densities of the thumbnails generated for each photo if none are specified in the gallery config. The
+    # browser downloads only the thumbnail which is large enough for the display.
+    DEFAULT_THUMBNAIL_DENSITIES = [1, THUMBNAIL_SIZE_FACTOR]
+
+    # File extension and MIME type of the thumbnails for each format that can be specified in the gallery config. JPEG
+    # thumbnails are always generated, so that browsers which don't support the other formats can fall back to them.
+    THUMBNAIL_FORMATS = {
+        "jpeg": (".jpg", "image/jpeg"),
+        "webp": (".webp", "image/webp"),
+        "avif": (".avif", "image/avif"),
+    }
+
+    # Long edges in pixels of the renditions of the photos displayed in the lightbox if none are specified in the
+    # gallery config. No renditions are generated by default, so the lightbox displays the original photos.
+    DEFAULT_WEB_RENDITIONS = []
+
+    # JPEG quality of the renditions of the photos displayed in the lightbox
+    WEB_RENDITION_QUALITY = 85
+
+    # Number of hexadecimal digits of the names of content addressed thumbnails
+    CONTENT_ADDRESSED_NAME_LENGTH = 16
+
+    # Pattern matching the names of content addressed thumbnails, only such files are removed when they are orphaned
+    CONTENT_ADDRESSED_NAME_PATTERN = re.compile(
+        rf"^[0-9a-f]{{{CONTENT_ADDRESSED_NAME_LENGTH}}}\.(jpg|webp|avif)$"
+    )
+
+    # Pattern matching the names of the sprite atlases, only such files are removed when they are orphaned
+    SPRITE_NAME_PATTERN = re.compile(r"^sprite-[0-9a-f]{16}\.jpg$")
+
+    def __init__(self, gallery_config):
         """
-        Checks if every image has an existing thumbnail and generates it if not (or if forced by the user)
-        :param force: Forces generation of thumbnails if set to true
+        Initializes the gallery logic
+        :param gallery_config: Gallery config dictionary as read from the gallery.json
         """
+        super().__init__(gallery_config)
 
-        # Multiply the thumbnail size by the factor to generate larger thumbnails to improve quality on retina displays
-        thumbnail_height = (
-            self.gallery_config["thumbnail_height"]
-            * FilesGalleryLogic.THUMBNAIL_SIZE_FACTOR
+        # Content hashes computed during this build if the metadata cache is disabled, keyed by the path and the stat
+        # signature of the photo, so that each photo is read only once
+        self.content_hashes = {}
+
+    def get_thumbnail_densities(self):
+        """
+        Gets the pixel densities of the thumbnails generated for each photo from the gallery config
+        :return: sorted list of densities
+        """
+        densities = self.gallery_config.get(
+            "thumbnail_densities", FilesGalleryLogic.DEFAULT_THUMBNAIL_DENSITIES
         )
-        thumbnails_path = self.gallery_config["thumbnails_path"]
 
+        if (
+            not isinstance(densities, list)
+            or not densities
+            or not all(
+                isinstance(density, (int, float)) and density > 0
+                for density in densities
+            )
+        ):
+            raise spg_common.SPGException(
+                f"Invalid thumbnail_densities {densities}: a list of positive numbers is expected (e.g. [1, 2])"
+            )
+
+        return sorted(set(densities))
+
+    def get_thumbnail_encoder(self):
+        """
+        Gets the thumbnail formats and the encoder settings from the thumbnail_encoder option of the gallery config
+        :return: list of the thumbnail formats in the order of preference, ending with JPEG, and dictionary with the
+        encoder settings (see spg_media.save_thumbnail)
+        """
+        thumbnail_encoder = dict(self.gallery_config.get("thumbnail_encoder", {}))
+
+        thumbnail_formats = []
+        for thumbnail_format in thumbnail_encoder.pop("formats", []) + ["jpeg"]:
+            if thumbnail_format not in FilesGalleryLogic.THUMBNAIL_FORMATS:
+                raise spg_common.SPGException(
+                    f"Unknown thumbnail format {thumbnail_format}: the supported formats are "
+                    + ", ".join(FilesGalleryLogic.THUMBNAIL_FORMATS)
+                )
+            if not spg_media.is_thumbnail_format_supported(
+                FilesGalleryLogic.THUMBNAIL_FORMATS[thumbnail_format][0]
+            ):
+                raise spg_common.SPGException(
+                    f"The thumbnail format {thumbnail_format} is not supported by the installed Pillow version"
+                )
+            if thumbnail_format not in thumbnail_formats:
+                thumbnail_formats.append(thumbnail_format)
+
+        for setting, value in thumbnail_encoder.items():
+            if setting == "quality":
+                valid = isinstance(value, int) and 1 <= value <= 100
+            elif setting == "target_size":
+                valid = isinstance(value, int) and value > 0
+            elif setting == "target_ssim":
+                valid = isinstance(value, (int, float)) and 0 < value <= 1
+            else:
+                raise spg_common.SPGException(
+                    f"Unknown thumbnail_encoder setting {setting}"
+                )
+            if not valid:
+                raise spg_common.SPGException(
+                    f"Invalid thumbnail_encoder setting {setting}: {value}"
+                )
+
+        return thumbnail_formats, thumbnail_encoder
+
+    def get_thumbnail_settings(
+        self, density=THUMBNAIL_SIZE_FACTOR, thumbnail_format="jpeg", encoder=None
+    ):
+        """
+        Gets the settings used to generate the thumbnails. A thumbnail generated with different settings is stale.
+        :param density: Pixel density of the thumbnail
+        :param thumbnail_format: Format of the thumbnail
+        :param encoder: Dictionary with the encoder settings from the gallery config
+        :return: JSON serializable dictionary containing the settings
+        """
+        encoder = dict(encoder or {})
+
+        # The target size is specified for thumbnails with a density of 1 and grows with the number of pixels
+        if "target_size" in encoder:
+            encoder["target_size"] = round(encoder["target_size"] * density**2)
+
+        # Multiply the thumbnail size by the density to generate larger thumbnails to improve quality on retina displays
+        return dict(
+            height=round(self.gallery_config["thumbnail_height"] * density),
+            fast=self.gallery_config.get("fast_thumbnails", True),
+            format=thumbnail_format.upper(),
+            encoder=encoder,
+        )
+
+    def is_content_addressed(self):
+        """
+        Checks if the thumbnails are named by the content hash of the photo and their settings instead of the photo name
+        :return: True if the content_addressed_thumbnails option is enabled in the gallery config
+        """
+        return self.gallery_config.get("content_addressed_thumbnails", False)
+
+    def get_content_hash(self, photo, metadata_cache):
+        """
+        Gets the content hash of a photo, which names its content addressed thumbnails. It is stored in the metadata
+        cache so that unchanged photos are not read, or kept for the whole build if the cache is disabled.
+        :param photo: Path to the photo
+        :param metadata_cache: MetadataCache object or None if the cache is disabled
+        :return: Content hash as hexadecimal string or None if the thumbnails are not content addressed
+        """
+        if not self.is_content_addressed():
+            return None
+        if metadata_cache:
+            return metadata_cache.get_content_hash(photo)
+
+        key = (photo, spg_cache.ThumbnailManifest.get_source_signature(photo))
+        if key not in self.content_hashes:
+            self.content_hashes[key] = spg_cache.compute_content_hash(photo)
+        return self.content_hashes[key]
+
+    def get_thumbnail_renditions(self, photo, content_hash=None):
+        """
+        Gets the thumbnail files generated for a photo. The thumbnail with the highest density has the same name as the
+        photo, the others have the density appended to the name (e.g. photo@1x.jpg). Content addressed thumbnails are
+        named by the content hash of the photo and their settings instead.
+        :param photo: Path to the photo
+        :param content_hash: Content hash of the photo if the thumbnails are content addressed (see get_content_hash)
+        :return: list of tuples containing the format, the density, the path and the settings of each thumbnail,
+        sorted by the order of preference of the formats and by density
+        """
+        densities = self.get_thumbnail_densities()
+        thumbnail_formats, encoder = self.get_thumbnail_encoder()
+
+        renditions = []
+        for thumbnail_format in thumbnail_formats:
+            extension = FilesGalleryLogic.THUMBNAIL_FORMATS[thumbnail_format][0]
+            for density in densities:
+                settings = self.get_thumbnail_settings(
+                    density, thumbnail_format, encoder
+                )
+                if content_hash:
+                    thumbnail_path = get_content_addressed_name(
+                        self.gallery_config["thumbnails_path"],
+                        content_hash,
+                        settings,
+                        extension,
+                    )
+                else:
+                    thumbnail_path = get_thumbnail_name(
+                        self.gallery_config["thumbnails_path"],
+                        photo,
+                        None if density == densities[-1] else density,
+                        extension,
+                    )
+                renditions.append((thumbnail_format, density, thumbnail_path, settings))
+
+        return renditions
+
+    def get_web_path(self):
+        """
+        Gets the path to the folder where the renditions of the photos displayed in the lightbox are stored
+        :return: Path to the folder (web_path from the gallery config or a web folder next to the thumbnails)
+        """
+        return self.gallery_config.get(
+            "web_path",
+            os.path.join(
+                os.path.dirname(self.gallery_config["thumbnails_path"]), "web"
+            ),
+        )
+
+    def get_web_long_edges(self, photo):
+        """
+        Gets the long edges of the renditions of a photo displayed in the lightbox from the gallery config. Videos and
+        GIFs (which can be animated) are always displayed in their original form.
+        :param photo: Path to the photo
+        :return: Sorted list of long edges in pixels, empty if the photo doesn't get renditions
+        """
+        long_edges = self.gallery_config.get(
+            "web_renditions", FilesGalleryLogic.DEFAULT_WEB_RENDITIONS
+        )
+
+        if not isinstance(long_edges, list) or not all(
+            isinstance(long_edge, int) and long_edge > 0 for long_edge in long_edges
+        ):
+            raise spg_common.SPGException(
+                f"Invalid web_renditions {long_edges}: a list of positive integers is expected (e.g. [2048])"
+            )
+
+        if not photo.lower().endswith((".jpg", ".jpeg", ".png")):
+            return []
+
+        return sorted(set(long_edges))
+
+    def get_web_rendition_path(self, photo, long_edge, content_hash=None):
+        """
+        Gets the path to a rendition of a photo displayed in the lightbox. Content addressed renditions are named by
+        the content hash of the photo and the long edge, which define the size of the rendition, so that the path is
+        known without reading the size of the photo.
+        :param photo: Path to the photo
+        :param long_edge: Long edge of the rendition in pixels
+        :param content_hash: Content hash of the photo if the renditions are content addressed (see get_content_hash)
+        :return: Path to the rendition
+        """
+        if content_hash:
+            return get_content_addressed_name(
+                self.get_web_path(),
+                content_hash,
+                dict(
+                    long_edge=long_edge,
+                    fast=self.gallery_config.get("fast_thumbnails", True),
+                    format="JPEG",
+                    encoder=dict(quality=FilesGalleryLogic.WEB_RENDITION_QUALITY),
+                ),
+            )
+
+        photo_name_without_extension = os.path.splitext(os.path.basename(photo))[0]
+        return os.path.join(
+            self.get_web_path(), f"{photo_name_without_extension}@{long_edge}.jpg"
+        )
+
+    def get_web_renditions(self, photo, size, content_hash=None):
+        """
+        Gets the renditions of a photo displayed in the lightbox. Only renditions smaller than the photo are generated.
+        :param photo: Path to the photo
+        :param size: Size of the photo after applying its orientation
+        :param content_hash: Content hash of the photo if the renditions are content addressed (see get_content_hash)
+        :return: list of tuples containing the long edge, the path and the settings of each rendition, sorted by size
+        """
+        renditions = []
+        for long_edge in self.get_web_long_edges(photo):
+            if long_edge >= max(size):
+                break
+
+            settings = dict(
+                height=round(long_edge * size[1] / max(size)),
+                fast=self.gallery_config.get("fast_thumbnails", True),
+                format="JPEG",
+                encoder=dict(quality=FilesGalleryLogic.WEB_RENDITION_QUALITY),
+            )
+            web_path = self.get_web_rendition_path(photo, long_edge, content_hash)
+            renditions.append((long_edge, web_path, settings))
+
+        return renditions
+
+    def get_sprites_path(self):
+        """
+        Gets the path to the folder where the sprite atlases of the thumbnails are stored
+        :return: Path to the folder (sprites_path from the gallery config or a sprites folder next to the thumbnails)
+        """
+        return self.gallery_config.get(
+            "sprites_path",
+            os.path.join(
+                os.path.dirname(self.gallery_config["thumbnails_path"]), "sprites"
+            ),
+        )
+
+    def get_sprite_size(self):
+        """
+        Gets the number of thumbnails packed into each sprite atlas from the gallery config
+        :return: Number of thumbnails or 0 if the thumbnails are not packed into atlases
+        """
+        sprite_size = self.gallery_config.get("thumbnail_sprite_size", 0)
+
+        if not isinstance(sprite_size, int) or sprite_size < 0:
+            raise spg_common.SPGException(
+                f"Invalid thumbnail_sprite_size {sprite_size}: a positive integer is expected (e.g. 100)"
+            )
+
+        return sprite_size
+
+    def get_probe(self, media_path, metadata_cache):
+        """
+        Gets the probed metadata of a media file
+        :param media_path: Path to the media file
+        :param metadata_cache: MetadataCache object or None if the cache is disabled
+        :return: MediaProbe object
+        """
+        if metadata_cache:
+            return metadata_cache.get_probe(media_path)
+        return spg_media.MediaProbe(media_path)
+
+    def open_metadata_cache(self):
+        """
+        Opens the persistent cache of the media files metadata
+        :return: MetadataCache object or None if the cache is disabled
+        """
+        if self.gallery_config.get("disable_cache", False):
+            return None
+
+        return spg_cache.MetadataCache(
+            spg_cache.get_cache_path(self.gallery_config),
+            self.gallery_config["images_path"],
+        )
+
+    def open_thumbnail_manifest(self):
+        """
+        Opens the manifest of the generated thumbnails
+        :return: ThumbnailManifest object or None if the cache is disabled
+        """
+        if self.gallery_config.get("disable_cache", False):
+            return None
+
+        return spg_cache.ThumbnailManifest(
+            spg_cache.get_cache_path(self.gallery_config),
+            self.gallery_config["thumbnails_path"],
+        )
+
+    def is_thumbnail_fresh(self, photo, thumbnail_path, settings, thumbnail_manifest):
+        """
+        Checks if the thumbnail of a photo exists and is up to date
+        :param photo: Path to the photo
+        :param thumbnail_path: Path to the thumbnail file
+        :param settings: Settings used to generate the thumbnails
+        :param thumbnail_manifest: ThumbnailManifest object or None if the cache is disabled
+        :return: True if the thumbnail doesn't need to be generated
+        """
+        if not os.path.exists(thumbnail_path):
+            return False
+
+        # The name of a content addressed thumbnail changes whenever the photo or the settings change
+        if self.is_content_addressed():
+            return True
+
+        if thumbnail_manifest:
+            if thumbnail_manifest.is_fresh(photo, thumbnail_path, settings):
+                return True
+
+            # Thumbnails that are not in the manifest yet (e.g. generated by an older version) or were modified after
+            # they were generated from the current photo are kept if they have the correct size
+            entry = thumbnail_manifest.get_entry(thumbnail_path)
+            if entry and entry[:2] != (
+                spg_cache.ThumbnailManifest.get_source_signature(photo),
+                spg_cache.ThumbnailManifest.get_settings_key(settings),
+            ):
+                return False
+
+        # Check if the thumbnail image size corresponds to the specified size
+        thumbnail_size = spg_media.get_image_size(thumbnail_path)
+        if thumbnail_size[1] != settings["height"]:
+            return False
+
+        if thumbnail_manifest:
+            thumbnail_manifest.record(photo, thumbnail_path, settings, thumbnail_size)
+
+        return True
+
+    def create_thumbnails(self, force=False, jobs=1):
+        """
+        Checks if every image has an existing thumbnail and generates it if not (or if forced by the user)
+        :param force: Forces generation of thumbnails if set to true
+        :param jobs: Number of thumbnails that can be generated in parallel
+        """
         photos = glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
 
         if not photos:
@@ -58,24 +483,205 @@ class FilesGalleryLogic(BaseGalleryLogic):
                 f'No photos could be found under {self.gallery_config["images_path"]}'
             )
 
-        count_thumbnails_created = 0
+        os.makedirs(self.get_web_path(), exist_ok=True)
+
+        metadata_cache = self.open_metadata_cache()
+        thumbnail_manifest = self.open_thumbnail_manifest()
+        try:
+            self.generate_thumbnails(
+                photos, metadata_cache, thumbnail_manifest, force, jobs
+            )
+        finally:
+            if metadata_cache:
+                metadata_cache.close()
+            if thumbnail_manifest:
+                thumbnail_manifest.close()
+
+    def generate_thumbnails(
+        self, photos, metadata_cache, thumbnail_manifest, force, jobs
+    ):
+        """
+        Generates the thumbnails and the lightbox renditions of the specified photos if they are missing or stale
+        :param photos: List of paths to the photos
+        :param metadata_cache: MetadataCache object or None if the cache is disabled
+        :param thumbnail_manifest: ThumbnailManifest object or None if the cache is disabled
+        :param force: Forces generation of thumbnails if set to true
+        :param jobs: Number of photos for which thumbnails can be generated in parallel
+        """
+        thumbnail_tasks = []
+        thumbnail_settings = {}
+        referenced_paths = set()
         for photo in photos:
-            thumbnail_path = get_thumbnail_name(thumbnails_path, photo)
+            # Files which cannot be probed don't get new lightbox renditions, the error is reported by the thumbnail
+            # task. Their existing renditions are still referenced, so that they are not removed as orphans.
+            try:
+                size = self.get_probe(photo, metadata_cache).size
+            except Exception:
+                size = None
 
-            # Check if the thumbnail should be generated. This happens if one of the following applies:
+            content_hash = self.get_content_hash(photo, metadata_cache)
+            candidates = [
+                (thumbnail_path, settings)
+                for _, _, thumbnail_path, settings in self.get_thumbnail_renditions(
+                    photo, content_hash
+                )
+            ]
+            if size:
+                candidates += [
+                    (web_path, settings)
+                    for _, web_path, settings in self.get_web_renditions(
+                        photo, size, content_hash
+                    )
+                ]
+            else:
+                referenced_paths.update(
+                    self.get_web_rendition_path(photo, long_edge, content_hash)
+                    for long_edge in self.get_web_long_edges(photo)
+                )
+            referenced_paths.update(path for path, _ in candidates)
+
+            # Check if a thumbnail should be generated. This happens if one of the following applies:
             # - Forced by the user with -f
             # - No thumbnail for this image
+            # - The photo or the thumbnail settings changed since the thumbnail was generated
             # - The thumbnail image size doesn't correspond to the specified size
-            if (
-                force
-                or not os.path.exists(thumbnail_path)
-                or not check_correct_thumbnail_size(thumbnail_path, thumbnail_height)
-            ):
-                spg_media.create_thumbnail(photo, thumbnail_path, thumbnail_height)
+            # - Identical photos share content addressed thumbnails, which are generated only once
+            renditions = []
+            for thumbnail_path, settings in candidates:
+                if thumbnail_path in thumbnail_settings:
+                    continue
+                if force or not self.is_thumbnail_fresh(
+                    photo, thumbnail_path, settings, thumbnail_manifest
+                ):
+                    renditions.append(
+                        (thumbnail_path, settings["height"], settings["encoder"])
+                    )
+                    thumbnail_settings[thumbnail_path] = settings
+
+            # All missing thumbnails of a photo are generated together, so that the photo is decoded only once
+            if renditions:
+                thumbnail_tasks.append(
+                    (
+                        photo,
+                        renditions,
+                        self.gallery_config.get("fast_thumbnails", True),
+                    )
+                )
+
+        # Generate the thumbnails and collect the errors, so that one broken file doesn't stop the whole gallery
+        count_thumbnails_created = 0
+        errors = []
+        for task, result, exception in spg_common.run_parallel(
+            spg_media.create_thumbnails, thumbnail_tasks, jobs
+        ):
+            if exception:
+                errors.append(
+                    f"{os.path.basename(task[0])}: {spg_common.get_error_message(exception)}"
+                )
+            else:
                 count_thumbnails_created += 1
+                if thumbnail_manifest:
+                    thumbnail_sizes, placeholder = result
+                    for (thumbnail_path, _, _), thumbnail_size in zip(
+                        task[1], thumbnail_sizes
+                    ):
+                        thumbnail_manifest.record(
+                            task[0],
+                            thumbnail_path,
+                            thumbnail_settings[thumbnail_path],
+                            thumbnail_size,
+                            placeholder,
+                        )
 
         spg_common.log(f"New thumbnails generated: {count_thumbnails_created}")
 
+        if self.is_content_addressed():
+            self.remove_orphaned_thumbnails(referenced_paths, thumbnail_manifest)
+
+        if errors:
+            raise spg_common.SPGException(
+                "The thumbnails of the following files could not be generated:\n"
+                + "\n".join(errors)
+            )
+
+    def remove_orphaned_thumbnails(self, referenced_paths, thumbnail_manifest):
+        """
+        Removes the content addressed thumbnails and lightbox renditions which don't belong to any photo anymore (e.g.
+        because the photo was changed or deleted or the thumbnail settings changed). The deleted photos are removed from
+        the images data by generate_images_data.
+        :param referenced_paths: Set of paths to the thumbnails of all photos
+        :param thumbnail_manifest: ThumbnailManifest object or None if the cache is disabled
+        """
+        count_thumbnails_removed = 0
+        for folder in [self.gallery_config["thumbnails_path"], self.get_web_path()]:
+            for file_name in os.listdir(folder):
+                path = os.path.join(folder, file_name)
+                if path in referenced_paths or not (
+                    FilesGalleryLogic.CONTENT_ADDRESSED_NAME_PATTERN.match(file_name)
+                ):
+                    continue
+
+                os.remove(path)
+                if thumbnail_manifest:
+                    thumbnail_manifest.remove(path)
+                count_thumbnails_removed += 1
+
+        spg_common.log(f"Orphaned thumbnails removed: {count_thumbnails_removed}")
+
+    def find_duplicates(self, max_distance=spg_duplicates.DEFAULT_MAX_DISTANCE):
+        """
+        Finds groups of near duplicate photos by comparing the difference hashes of their thumbnails. Videos are not
+        compared, because their thumbnails only show one frame. The hashes are stored in the metadata cache, so that
+        only new and changed photos are hashed.
+        :param max_distance: Maximum number of different bits between the hashes of a photo and of the first photo of
+        its group
+        :return: list of groups of photo names, the photo with the highest resolution is the first of each group
+        """
+        images = sorted(
+            glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
+        )
+
+        hashes = {}
+        metadata_cache = self.open_metadata_cache()
+        try:
+            # The photos with the highest resolution are the preferred representatives of the groups
+            photos = []
+            for image in images:
+                probe = self.get_probe(image, metadata_cache)
+                if probe.type == "image":
+                    photos.append((-probe.size[0] * probe.size[1], image))
+
+            for _, image in sorted(photos):
+                perceptual_hash = None
+                if metadata_cache:
+                    perceptual_hash = metadata_cache.get_perceptual_hash(image)
+
+                # Hash the smallest JPEG thumbnail, which is much faster to decode than the photo
+                if perceptual_hash is None:
+                    thumbnail_path = [
+                        thumbnail_path
+                        for thumbnail_format, _, thumbnail_path, _ in (
+                            self.get_thumbnail_renditions(
+                                image, self.get_content_hash(image, metadata_cache)
+                            )
+                        )
+                        if thumbnail_format == "jpeg"
+                    ][0]
+                    if not os.path.exists(thumbnail_path):
+                        raise spg_common.SPGException(
+                            f"The thumbnail of {os.path.basename(image)} is missing"
+                        )
+                    perceptual_hash = spg_duplicates.compute_image_dhash(thumbnail_path)
+                    if metadata_cache:
+                        metadata_cache.set_perceptual_hash(image, perceptual_hash)
+
+                hashes[os.path.basename(image)] = perceptual_hash
+        finally:
+            if metadata_cache:
+                metadata_cache.close()
+
+        return spg_duplicates.find_duplicate_groups(hashes, max_distance)
+
     def format_image_date(self, timestamp):
         """
         Formats an image date according to the format specified in the gallery config.
@@ -95,40 +701,240 @@ class FilesGalleryLogic(BaseGalleryLogic):
 
         return image_date_string
 
-    def generate_images_data(self, images_data):
+    def generate_images_data(self, images_data, force=False, excluded_photos=None):
         """
         Generates the metadata of each image file
         :param images_data: Images data dictionary containing the existing metadata of the images and which will be
         updated by this function
+        :param force: Forces all image files to be probed again instead of using the cached metadata
+        :param excluded_photos: Optional list of names of photos that should not be part of the gallery
         :return updated images data dictionary
         """
 
-        # Get all images sorted by name
-        images = sorted(
-            glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
-        )
+        # Get all images sorted by name. Excluded photos are removed before the sprites are packed, so that the
+        # sprites don't contain their thumbnails.
+        excluded_photos = set(excluded_photos or [])
+        images = [
+            image
+            for image in sorted(
+                glob.glob(os.path.join(self.gallery_config["images_path"], "*.*"))
+            )
+            if os.path.basename(image) not in excluded_photos
+        ]
 
-        # Get the required metadata for each image
+        # Remove the deleted and the excluded photos, their thumbnails are removed when the thumbnails are generated
+        photo_names = set(os.path.basename(image) for image in images)
+        for photo_name in list(images_data):
+            if photo_name not in photo_names:
+                del images_data[photo_name]
+
+        # Unchanged files don't need to be opened again if their metadata and their thumbnail sizes are cached
+        metadata_cache = self.open_metadata_cache()
+        thumbnail_manifest = self.open_thumbnail_manifest()
+
+        try:
+            self.update_images_data(
+                images_data, images, metadata_cache, thumbnail_manifest, force
+            )
+        finally:
+            if metadata_cache:
+                metadata_cache.close()
+            if thumbnail_manifest:
+                thumbnail_manifest.close()
+
+        # The images data keeps the order of the existing photos, in which they are displayed
+        if self.get_sprite_size():
+            self.update_sprites(images_data, list(images_data))
+
+        return images_data
+
+    def update_sprites(self, images_data, photo_names):
+        """
+        Packs the thumbnails of consecutive photos into sprite atlases (see get_sprite_groups) and records the position
+        of each thumbnail in its atlas in the images data. An atlas is named by the thumbnails it contains, so only the
+        atlases containing a changed, added or removed photo are generated again and the atlases which are not used
+        anymore are removed.
+        :param images_data: Images data dictionary which will be updated by this function
+        :param photo_names: List of the names of the photos in the order in which they are displayed
+        """
+        sprite_size = self.get_sprite_size()
+        sprites_path = self.get_sprites_path()
+        public_path = self.gallery_config["public_path"]
+        _, thumbnail_encoder = self.get_thumbnail_encoder()
+        os.makedirs(sprites_path, exist_ok=True)
+
+        sprite_paths = set()
+        count_sprites_created = 0
+        for group in get_sprite_groups(photo_names, sprite_size):
+            tiles = [images_data[photo_name]["thumbnails"][-1] for photo_name in group]
+            thumbnail_paths = [os.path.join(public_path, tile["src"]) for tile in tiles]
+            positions, size = spg_media.get_sprite_layout(
+                [tile["size"] for tile in tiles]
+            )
+
+            # The atlas is encoded like the thumbnails, the target size applies to each of its thumbnails
+            encoder = dict(thumbnail_encoder)
+            if "target_size" in encoder:
+                encoder["target_size"] *= len(tiles)
+
+            # Name the atlas by its layout, its encoder settings and the current version of its thumbnails
+            signatures = [
+                spg_cache.ThumbnailManifest.get_thumbnail_signature(thumbnail_path)
+                for thumbnail_path in thumbnail_paths
+            ]
+            key = json.dumps(
+                [
+                    spg_media.SPRITE_MAX_WIDTH,
+                    spg_media.SPRITE_PADDING,
+                    [tile["src"] for tile in tiles],
+                    signatures,
+                    encoder,
+                ]
+            )
+            key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+            sprite_path = os.path.join(sprites_path, f"sprite-{key[:16]}.jpg")
+            sprite_paths.add(sprite_path)
+
+            if not os.path.exists(sprite_path):
+                spg_media.create_sprite(
+                    thumbnail_paths, positions, size, sprite_path, encoder
+                )
+                count_sprites_created += 1
+
+            # The position and the size of the atlas are relative to the tile, so that the tile can be scaled by CSS
+            for photo_name, tile, position in zip(group, tiles, positions):
+                images_data[photo_name]["sprite"] = dict(
+                    src=os.path.relpath(sprite_path, public_path),
+                    position=[
+                        get_sprite_percentage(
+                            position[axis], size[axis], tile["size"][axis]
+                        )
+                        for axis in range(2)
+                    ],
+                    size=[
+                        round(size[axis] / tile["size"][axis] * 100, 4)
+                        for axis in range(2)
+                    ],
+                )
+
+        for file_name in os.listdir(sprites_path):
+            sprite_path = os.path.join(sprites_path, file_name)
+            if sprite_path not in sprite_paths and (
+                FilesGalleryLogic.SPRITE_NAME_PATTERN.match(file_name)
+            ):
+                os.remove(sprite_path)
+
+        spg_common.log(f"New sprites generated: {count_sprites_created}")
+
+    def update_images_data(
+        self, images_data, images, metadata_cache, thumbnail_manifest, force=False
+    ):
+        """
+        Updates the metadata of the specified image files
+        :param images_data: Images data dictionary which will be updated by this function
+        :param images: List of paths to the image files
+        :param metadata_cache: MetadataCache object or None if the cache is disabled
+        :param thumbnail_manifest: ThumbnailManifest object or None if the cache is disabled
+        :param force: Forces all image files to be probed again instead of using the cached metadata
+        """
         for image in images:
             photo_name = os.path.basename(image)
 
-            thumbnail_path = get_thumbnail_name(
-                self.gallery_config["thumbnails_path"], image
+            if metadata_cache:
+                probe = metadata_cache.get_probe(image, refresh=force)
+            else:
+                probe = spg_media.MediaProbe(image)
+
+            # Collect all thumbnails of the image grouped by format. The JPEG thumbnail with the highest density is
+            # used as the default thumbnail.
+            thumbnails = {}
+            content_hash = self.get_content_hash(image, metadata_cache)
+            renditions = self.get_thumbnail_renditions(image, content_hash)
+            for thumbnail_format, density, thumbnail_path, _ in renditions:
+                thumbnail_size = None
+                if thumbnail_manifest:
+                    thumbnail_size = thumbnail_manifest.get_thumbnail_size(
+                        thumbnail_path
+                    )
+                thumbnail_data = spg_media.get_metadata(
+                    image,
+                    thumbnail_path,
+                    self.gallery_config["public_path"],
+                    probe,
+                    thumbnail_size,
+                )
+                thumbnails.setdefault(thumbnail_format, []).append(
+                    dict(
+                        src=thumbnail_data["thumbnail"],
+                        size=thumbnail_data["thumbnail_size"],
+                    )
+                )
+            image_data = thumbnail_data
+            image_data["thumbnails"] = thumbnails.pop("jpeg")
+
+            # The other formats are offered to the browser as alternative sources in the order of preference
+            image_data["thumbnail_sources"] = [
+                dict(
+                    type=FilesGalleryLogic.THUMBNAIL_FORMATS[thumbnail_format][1],
+                    thumbnails=format_thumbnails,
+                )
+                for thumbnail_format, format_thumbnails in thumbnails.items()
+            ]
+
+            # Placeholder displayed until the thumbnail is loaded. It is computed when the thumbnails are generated and
+            # only needs to be computed from the smallest thumbnail if it is not in the manifest. The signature of the
+            # smallest thumbnail is kept in the images data, so that the placeholder is reused until it changes.
+            image_data["placeholder"] = None
+            if thumbnail_manifest:
+                image_data["placeholder"] = thumbnail_manifest.get_placeholder(
+                    renditions[-1][2]
+                )
+            smallest_thumbnail_path = os.path.join(
+                self.gallery_config["public_path"], image_data["thumbnails"][0]["src"]
             )
-            image_data = spg_media.get_metadata(
-                image, thumbnail_path, self.gallery_config["public_path"]
+            placeholder_thumbnail = dict(
+                src=image_data["thumbnails"][0]["src"],
+                signature=spg_cache.ThumbnailManifest.get_thumbnail_signature(
+                    smallest_thumbnail_path
+                ),
             )
+            previous_data = images_data.get(photo_name, {})
+            if (
+                not image_data["placeholder"]
+                and previous_data.get("placeholder")
+                and previous_data.get("placeholder_thumbnail") == placeholder_thumbnail
+            ):
+                image_data["placeholder"] = previous_data["placeholder"]
+            if not image_data["placeholder"] and placeholder_thumbnail["signature"]:
+                image_data["placeholder"] = spg_media.get_thumbnail_placeholder(
+                    smallest_thumbnail_path
+                )
+            if image_data["placeholder"] and placeholder_thumbnail["signature"]:
+                image_data["placeholder_thumbnail"] = placeholder_thumbnail
+
+            # Renditions of the photo displayed in the lightbox instead of the original
+            image_data["renditions"] = []
+            for _, web_path, _ in self.get_web_renditions(
+                image, probe.size, content_hash
+            ):
+                if not os.path.exists(web_path):
+                    continue
+                web_size = None
+                if thumbnail_manifest:
+                    web_size = thumbnail_manifest.get_thumbnail_size(web_path)
+                image_data["renditions"].append(
+                    dict(
+                        src=os.path.relpath(
+                            web_path, self.gallery_config["public_path"]
+                        ),
+                        size=web_size or spg_media.get_image_size(web_path),
+                    )
+                )
 
             # Scale down the thumbnail size to the display size
             image_data["thumbnail_size"] = (
-                round(
-                    image_data["thumbnail_size"][0]
-                    / FilesGalleryLogic.THUMBNAIL_SIZE_FACTOR
-                ),
-                round(
-                    image_data["thumbnail_size"][1]
-                    / FilesGalleryLogic.THUMBNAIL_SIZE_FACTOR
-                ),
+                round(image_data["thumbnail_size"][0] / density),
+                round(image_data["thumbnail_size"][1] / density),
             )
 
             # Format the image date
@@ -147,5 +953,3 @@ class FilesGalleryLogic(BaseGalleryLogic):
                 image_data["description"] = images_data[photo_name]["description"]
 
             images_data[photo_name] = image_data
-
-        return images_data
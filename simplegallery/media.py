@@ -1,8 +1,13 @@
+import io
 import os
+import base64
+import math
+import struct
 import cv2
+import numpy as np
 import requests
-from io import BytesIO
-from PIL import Image, ExifTags, ImageFile
+import requests.adapters
+from PIL import Image, ExifTags, ImageFile, features
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 from datetime import datetime
 import simplegallery.common as spg_common
@@ -11,6 +16,73 @@ import simplegallery.common as spg_common
 # Mapping of the string representation if an Exif tag to its id
 EXIF_TAG_MAP = {ExifTags.TAGS[tag]: tag for tag in ExifTags.TAGS}
 
+# Images are reduced in steps (DCT scaling for JPEGs) only down to this factor times the thumbnail size, before the
+# final resampling with the antialiasing filter
+THUMBNAIL_REDUCING_GAP = 2.0
+
+# Minimum PSNR (in dB) of a thumbnail created with the fast path compared to one created with the reference path
+FAST_THUMBNAIL_MIN_PSNR = 35.0
+
+# Pillow format and encoder options of the thumbnails for each supported thumbnail file extension
+THUMBNAIL_FORMATS = {
+    ".jpg": ("JPEG", dict(optimize=True, progressive=True)),
+    ".webp": ("WEBP", dict(method=6)),
+    ".avif": ("AVIF", dict()),
+}
+
+# Range of the quality setting searched when encoding a thumbnail for a target size or SSIM
+MIN_THUMBNAIL_QUALITY = 20
+MAX_THUMBNAIL_QUALITY = 95
+
+# Maximum width and height in pixels of the preview used as placeholder until a thumbnail is loaded
+PLACEHOLDER_SIZE = 8
+
+# Size of the sliding window used to compute the SSIM of two images
+SSIM_WINDOW_SIZE = 7
+
+# Maximum width in pixels of a sprite atlas packing several thumbnails
+SPRITE_MAX_WIDTH = 4096
+
+# Gap in pixels between the thumbnails in a sprite atlas, so that scaled tiles don't bleed into each other
+SPRITE_PADDING = 2
+
+# Number of bytes requested at once when reading the header of a remote image
+REMOTE_IMAGE_CHUNK_SIZE = 16384
+
+# Maximum number of open connections kept per server by the shared HTTP session
+HTTP_POOL_SIZE = 16
+
+# HTTP session shared by all requests to remote images (see get_http_session)
+_http_session = None
+
+
+def get_exif_orientation(exif):
+    """
+    Gets the value of the Orientation EXIF tag
+    :param exif: EXIF data dictionary (may be None)
+    :return: Orientation value (1 if not specified)
+    """
+    if exif and EXIF_TAG_MAP["Orientation"] in exif:
+        return exif[EXIF_TAG_MAP["Orientation"]]
+
+    return 1
+
+
+def get_orientation_angle(orientation):
+    """
+    Gets the counter-clockwise angle by which an image should be rotated to be displayed correctly
+    :param orientation: Value of the Orientation EXIF tag
+    :return: Rotation angle in degrees
+    """
+    if orientation == 3:
+        return 180
+    elif orientation == 6:
+        return 270
+    elif orientation == 8:
+        return 90
+    else:
+        return 0
+
 
 def rotate_image_by_orientation(image):
     """
@@ -20,21 +92,9 @@ def rotate_image_by_orientation(image):
     """
 
     try:
-        exif = image._getexif()
-        if exif and EXIF_TAG_MAP["Orientation"] in exif:
-            orientation = exif[EXIF_TAG_MAP["Orientation"]]
-
-            if orientation == 3:
-                rotation_angle = 180
-            elif orientation == 6:
-                rotation_angle = 270
-            elif orientation == 8:
-                rotation_angle = 90
-            else:
-                rotation_angle = 0
-
-            if rotation_angle != 0:
-                return image.rotate(rotation_angle, expand=True)
+        rotation_angle = get_orientation_angle(get_exif_orientation(image._getexif()))
+        if rotation_angle != 0:
+            return image.rotate(rotation_angle, expand=True)
     except:
         pass
 
@@ -52,33 +112,426 @@ def get_thumbnail_size(image_size, thumbnail_height):
     return width, thumbnail_height
 
 
-def create_image_thumbnail(image_path, thumbnail_path, height):
+def get_antialias_filter():
     """
-    Creates a thumbnail for an image
-    :param image_path: input image path
+    Gets the resampling filter used to resize images
+    :return: Pillow resampling filter
+    """
+    if hasattr(Image, "ANTIALIAS"):
+        return Image.ANTIALIAS  # PIL < 10.0.0
+    else:
+        return Image.LANCZOS  # PIL >= 10.0.0
+
+
+def resize_image_fast(image, height, orientation):
+    """
+    Resizes an image to the specified height and rotates it according to its orientation. JPEGs are decoded directly
+    at a reduced scale (1/2, 1/4 or 1/8) and the image is only rotated after it has been resized.
+    :param image: Image, which is not loaded yet
+    :param height: height of the resized image in pixels
+    :param orientation: value of the Orientation EXIF tag of the image
+    :return: Resized image
+    """
+    rotation_angle = get_orientation_angle(orientation)
+    swap_dimensions = rotation_angle in (90, 270)
+
+    # Compute the thumbnail size of the rotated image and the corresponding size before the rotation
+    image_size = image.size[::-1] if swap_dimensions else image.size
+    thumbnail_size = get_thumbnail_size(image_size, height)
+    resize_size = thumbnail_size[::-1] if swap_dimensions else thumbnail_size
+
+    # Let the JPEG decoder scale the image down, keeping at least twice the target size for the final resampling
+    draft_size = (
+        round(resize_size[0] * THUMBNAIL_REDUCING_GAP),
+        round(resize_size[1] * THUMBNAIL_REDUCING_GAP),
+    )
+    draft = image.draft(None, draft_size)
+    box = draft[1] if draft else None
+
+    image = image.resize(
+        resize_size,
+        get_antialias_filter(),
+        box=box,
+        reducing_gap=THUMBNAIL_REDUCING_GAP,
+    )
+
+    # Rotating the small image by a multiple of 90 degrees is lossless
+    if rotation_angle == 180:
+        image = image.transpose(Image.ROTATE_180)
+    elif rotation_angle == 270:
+        image = image.transpose(Image.ROTATE_270)
+    elif rotation_angle == 90:
+        image = image.transpose(Image.ROTATE_90)
+
+    return image
+
+
+def get_placeholder(image):
+    """
+    Computes a placeholder for an image, which is displayed until its thumbnail is loaded. It consists of a tiny
+    preview of the image, keeping its aspect ratio, and of its dominant color.
+    :param image: Image, usually an already decoded thumbnail
+    :return: dictionary with the dominant color as CSS hex color ("color") and the preview as data URI ("preview")
+    """
+    pixels = np.asarray(image.convert("RGB"))
+    height, width = pixels.shape[:2]
+
+    # Average the pixels in blocks of (almost) equal size to get the preview
+    scale = PLACEHOLDER_SIZE / max(width, height)
+    rows = np.linspace(0, height, min(height, max(1, round(height * scale))) + 1)
+    columns = np.linspace(0, width, min(width, max(1, round(width * scale))) + 1)
+    rows, columns = rows.astype(int), columns.astype(int)
+    block_sums = np.add.reduceat(
+        np.add.reduceat(pixels.astype(np.float64), rows[:-1], axis=0),
+        columns[:-1],
+        axis=1,
+    )
+    block_sizes = np.outer(np.diff(rows), np.diff(columns))[..., np.newaxis]
+    preview = Image.fromarray(np.round(block_sums / block_sizes).astype(np.uint8))
+
+    preview_data = io.BytesIO()
+    preview.save(preview_data, "PNG", optimize=True)
+
+    # The dominant color is the average color of the most frequent bin, with 16 bins per channel
+    flat_pixels = pixels.reshape(-1, 3)
+    bins = (flat_pixels.astype(np.int64) >> 4) @ np.array([256, 16, 1])
+    dominant_bin = np.bincount(bins, minlength=4096).argmax()
+    color = np.round(flat_pixels[bins == dominant_bin].mean(axis=0)).astype(int)
+
+    return dict(
+        color="#{:02x}{:02x}{:02x}".format(*color),
+        preview="data:image/png;base64,"
+        + base64.b64encode(preview_data.getvalue()).decode("ascii"),
+    )
+
+
+def get_thumbnail_placeholder(thumbnail_path):
+    """
+    Computes the placeholder of an image from its thumbnail file (see get_placeholder)
     :param thumbnail_path: path to the thumbnail file
-    :param height: height of the thumbnail in pixels
+    :return: placeholder dictionary
+    """
+    with Image.open(thumbnail_path) as thumbnail:
+        return get_placeholder(thumbnail)
+
+
+def is_thumbnail_format_supported(thumbnail_extension):
+    """
+    Checks if thumbnails can be encoded in the format of the specified file extension
+    :param thumbnail_extension: file extension of the thumbnail (e.g. ".webp")
+    :return: True if the installed Pillow version can encode the format
+    """
+    if thumbnail_extension not in THUMBNAIL_FORMATS:
+        return False
+
+    thumbnail_format = THUMBNAIL_FORMATS[thumbnail_extension][0]
+    if thumbnail_format == "JPEG":
+        return True
+
+    return features.check(thumbnail_format.lower())
+
+
+def encode_image(image, image_format, options, quality=None):
+    """
+    Encodes an image in memory
+    :param image: Image to encode
+    :param image_format: Pillow format name
+    :param options: Pillow encoder options
+    :param quality: quality setting of the encoder or None to use the default of the format
+    :return: encoded image bytes
+    """
+    if quality is not None:
+        options = dict(options, quality=quality)
+
+    output = io.BytesIO()
+    image.save(output, image_format, **options)
+
+    return output.getvalue()
+
+
+def search_thumbnail_quality(
+    image, image_format, options, target_size=None, target_ssim=None
+):
+    """
+    Binary searches the quality setting of the encoder. The lowest quality reaching the target SSIM is selected and if
+    the result is larger than the target size, the highest quality fitting in the target size is selected instead.
+    :param image: Image to encode
+    :param image_format: Pillow format name
+    :param options: Pillow encoder options
+    :param target_size: optional maximum size of the encoded image in bytes
+    :param target_ssim: optional minimum SSIM of the encoded image compared to the original image
+    :return: encoded image bytes
+    """
+    encoded_images = {}
+
+    def encode(quality):
+        if quality not in encoded_images:
+            encoded_images[quality] = encode_image(
+                image, image_format, options, quality
+            )
+        return encoded_images[quality]
+
+    quality = MAX_THUMBNAIL_QUALITY
+
+    if target_ssim:
+        low, high = MIN_THUMBNAIL_QUALITY, MAX_THUMBNAIL_QUALITY
+        while low < high:
+            middle = (low + high) // 2
+            with Image.open(io.BytesIO(encode(middle))) as encoded_image:
+                if compute_ssim(encoded_image, image) >= target_ssim:
+                    high = middle
+                else:
+                    low = middle + 1
+        quality = low
+
+    if target_size and len(encode(quality)) > target_size:
+        low, high = MIN_THUMBNAIL_QUALITY, quality
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(encode(middle)) <= target_size:
+                low = middle
+            else:
+                high = middle - 1
+        quality = low
+
+    return encode(quality)
+
+
+def save_thumbnail(image, thumbnail_path, encoder=None):
+    """
+    Saves a thumbnail in the format given by the extension of the thumbnail path
+    :param image: RGB image of the thumbnail
+    :param thumbnail_path: path to the thumbnail file
+    :param encoder: optional dictionary with the quality setting of the encoder ("quality") or the target size in bytes
+    ("target_size") and the target SSIM ("target_ssim") for which the quality is searched
+    """
+    extension = os.path.splitext(thumbnail_path)[1].lower()
+    if not is_thumbnail_format_supported(extension):
+        raise spg_common.SPGException(
+            f"Thumbnails cannot be saved as {extension} with the installed Pillow version"
+        )
+    image_format, options = THUMBNAIL_FORMATS[extension]
+    encoder = encoder or {}
+
+    if encoder.get("target_size") or encoder.get("target_ssim"):
+        data = search_thumbnail_quality(
+            image,
+            image_format,
+            options,
+            encoder.get("target_size"),
+            encoder.get("target_ssim"),
+        )
+    else:
+        data = encode_image(image, image_format, options, encoder.get("quality"))
+
+    with open(thumbnail_path, "wb") as thumbnail_file:
+        thumbnail_file.write(data)
+
+
+def get_sprite_layout(tile_sizes, max_width=SPRITE_MAX_WIDTH, padding=SPRITE_PADDING):
+    """
+    Arranges tiles in rows from left to right in a sprite atlas
+    :param tile_sizes: list of the sizes of the tiles
+    :param max_width: maximum width of the atlas in pixels, a tile that doesn't fit in a row starts a new one
+    :param padding: gap between the tiles in pixels
+    :return: list of the positions of the tiles and the size of the atlas
+    """
+    positions = []
+    x, y, row_height, width = 0, 0, 0, 0
+    for tile_width, tile_height in tile_sizes:
+        if x > 0 and x + tile_width > max_width:
+            x, y, row_height = 0, y + row_height + padding, 0
+        positions.append((x, y))
+        width = max(width, x + tile_width)
+        row_height = max(row_height, tile_height)
+        x += tile_width + padding
+
+    return positions, (width, y + row_height)
+
+
+def create_sprite(thumbnail_paths, positions, sprite_size, sprite_path, encoder=None):
+    """
+    Creates a sprite atlas containing several thumbnails
+    :param thumbnail_paths: list of paths to the thumbnail files
+    :param positions: list of the positions of the thumbnails in the atlas (see get_sprite_layout)
+    :param sprite_size: size of the atlas
+    :param sprite_path: path to the atlas file
+    :param encoder: optional dictionary with the encoder settings (see save_thumbnail)
+    """
+    sprite = Image.new("RGB", sprite_size, "white")
+    for thumbnail_path, position in zip(thumbnail_paths, positions):
+        with Image.open(thumbnail_path) as thumbnail:
+            sprite.paste(thumbnail.convert("RGB"), position)
+
+    save_thumbnail(sprite, sprite_path, encoder)
+
+
+def create_image_thumbnails(image_path, renditions, fast=True):
+    """
+    Creates thumbnails of several heights and formats for an image, decoding the image only once
+    :param image_path: input image path
+    :param renditions: list of tuples containing the path to a thumbnail file, the height of the thumbnail in pixels
+    and the encoder settings (see save_thumbnail)
+    :param fast: use the fast path, decoding JPEGs at a reduced scale and rotating after resizing
+    :return: list of the sizes of the thumbnails in the order of the renditions and the placeholder of the image
+    computed from the smallest thumbnail (see get_placeholder)
     """
     image = Image.open(image_path)
 
     # Only rotate JPEGs, because they have the orientation in their metadata
-    if image_path.lower().endswith(".jpg") or image_path.lower().endswith(".jpeg"):
-        image = rotate_image_by_orientation(image)
+    is_jpeg = image_path.lower().endswith(".jpg") or image_path.lower().endswith(
+        ".jpeg"
+    )
 
-    thumbnail_size = get_thumbnail_size(image.size, height)
-    if hasattr(Image, "ANTIALIAS"):
-        antialias = Image.ANTIALIAS            # PIL < 10.0.0
+    if fast:
+        orientation = 1
+        if is_jpeg:
+            try:
+                orientation = get_exif_orientation(image._getexif())
+            except:
+                pass
+        image_size = image.size
+        if get_orientation_angle(orientation) in (90, 270):
+            image_size = image_size[::-1]
+
+        # Decode the image for the largest thumbnail and scale this one down to the smaller thumbnails
+        image = resize_image_fast(
+            image, max(height for _, height, _ in renditions), orientation
+        )
     else:
-        antialias = Image.LANCZOS              # PIL >= 10.0.0
-    image = image.resize(thumbnail_size, antialias)
+        if is_jpeg:
+            image = rotate_image_by_orientation(image)
+        image_size = image.size
 
     # Convert to RGB if needed
     if image.mode != "RGB":
         image = image.convert("RGB")
 
-    image.save(thumbnail_path)
+    # Thumbnails of the same height in different formats share the resized image
+    thumbnails = {image.size: image}
+    thumbnail_sizes = []
+    for thumbnail_path, height, encoder in renditions:
+        thumbnail_size = get_thumbnail_size(image_size, height)
+        if thumbnail_size not in thumbnails:
+            thumbnails[thumbnail_size] = image.resize(
+                thumbnail_size, get_antialias_filter()
+            )
+
+        save_thumbnail(thumbnails[thumbnail_size], thumbnail_path, encoder)
+        thumbnail_sizes.append(thumbnail_size)
+
+    placeholder = get_placeholder(thumbnails[min(thumbnail_sizes)])
     image.close()
 
+    return thumbnail_sizes, placeholder
+
+
+def create_image_thumbnail(image_path, thumbnail_path, height, fast=True):
+    """
+    Creates a thumbnail for an image
+    :param image_path: input image path
+    :param thumbnail_path: path to the thumbnail file
+    :param height: height of the thumbnail in pixels
+    :param fast: use the fast path, decoding JPEGs at a reduced scale and rotating after resizing
+    :return: size of the thumbnail
+    """
+    thumbnail_sizes, _ = create_image_thumbnails(
+        image_path, [(thumbnail_path, height, None)], fast
+    )
+    return thumbnail_sizes[0]
+
+
+def compute_ssim(image, reference_image):
+    """
+    Computes the mean structural similarity index (SSIM) between the luminance of two images of the same size
+    :param image: Image to compare
+    :param reference_image: Reference image
+    :return: SSIM between -1 and 1 (1 if the images are identical)
+    """
+    pixels = np.asarray(image.convert("L"), dtype=np.float64)
+    reference_pixels = np.asarray(reference_image.convert("L"), dtype=np.float64)
+
+    # Local means, variances and covariance over a sliding window computed with integral images
+    window_size = min(SSIM_WINDOW_SIZE, *pixels.shape)
+
+    def window_mean(values):
+        integral = np.pad(values.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+        window_sum = (
+            integral[window_size:, window_size:]
+            - integral[:-window_size, window_size:]
+            - integral[window_size:, :-window_size]
+            + integral[:-window_size, :-window_size]
+        )
+        return window_sum / window_size**2
+
+    mean = window_mean(pixels)
+    reference_mean = window_mean(reference_pixels)
+    variance = window_mean(pixels**2) - mean**2
+    reference_variance = window_mean(reference_pixels**2) - reference_mean**2
+    covariance = window_mean(pixels * reference_pixels) - mean * reference_mean
+
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    ssim = ((2 * mean * reference_mean + c1) * (2 * covariance + c2)) / (
+        (mean**2 + reference_mean**2 + c1) * (variance + reference_variance + c2)
+    )
+
+    return float(ssim.mean())
+
+
+def compute_psnr(image, reference_image):
+    """
+    Computes the peak signal-to-noise ratio (PSNR) between two images of the same size
+    :param image: Image to compare
+    :param reference_image: Reference image
+    :return: PSNR in dB (infinity if the images are identical)
+    """
+    pixels = np.asarray(image.convert("RGB"), dtype=np.float64)
+    reference_pixels = np.asarray(reference_image.convert("RGB"), dtype=np.float64)
+
+    mse = np.mean((pixels - reference_pixels) ** 2)
+    if mse == 0:
+        return float("inf")
+
+    return 10 * np.log10(255.0**2 / mse)
+
+
+def create_video_thumbnails(video_path, renditions):
+    """
+    Creates thumbnails of several heights and formats for a video out of the first video frame
+    :param video_path: input video path
+    :param renditions: list of tuples containing the path to a thumbnail file, the height of the thumbnail in pixels
+    and the encoder settings (see save_thumbnail)
+    :return: list of the sizes of the thumbnails in the order of the renditions and the placeholder of the video
+    computed from the smallest thumbnail (see get_placeholder)
+    """
+    # Decode only the first frame and release the video right away
+    video_capture = cv2.VideoCapture(video_path)
+    try:
+        success, image = video_capture.read()
+    finally:
+        video_capture.release()
+
+    if not success:
+        raise spg_common.SPGException(
+            f"Cannot read the first frame of {os.path.basename(video_path)}"
+        )
+
+    thumbnails = {}
+    thumbnail_sizes = []
+    for thumbnail_path, height, encoder in renditions:
+        thumbnail = cv2.resize(
+            image, (round(image.shape[1] * float(height) / image.shape[0]), height)
+        )
+        thumbnail_size = (thumbnail.shape[1], thumbnail.shape[0])
+        thumbnails[thumbnail_size] = Image.fromarray(
+            cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)
+        )
+        save_thumbnail(thumbnails[thumbnail_size], thumbnail_path, encoder)
+        thumbnail_sizes.append(thumbnail_size)
+
+    return thumbnail_sizes, get_placeholder(thumbnails[min(thumbnail_sizes)])
+
 
 def create_video_thumbnail(video_path, thumbnail_path, height):
     """
@@ -86,21 +539,24 @@ def create_video_thumbnail(video_path, thumbnail_path, height):
     :param video_path: input video path
     :param thumbnail_path: path to the thumbnail file
     :param height: height of the thumbnail in pixels
+    :return: size of the thumbnail
     """
-    video_capture = cv2.VideoCapture(video_path)
-    _, image = video_capture.read()
-    thumbnail = cv2.resize(
-        image, (round(image.shape[1] * float(height) / image.shape[0]), height)
+    thumbnail_sizes, _ = create_video_thumbnails(
+        video_path, [(thumbnail_path, height, None)]
     )
-    cv2.imwrite(thumbnail_path, thumbnail)
+    return thumbnail_sizes[0]
 
 
-def create_thumbnail(input_path, thumbnail_path, height):
+def create_thumbnails(input_path, renditions, fast=True):
     """
-    Creates a thumbnail for a media file (image or video)
+    Creates thumbnails of several heights and formats for a media file (image or video), decoding the media file only
+    once
     :param input_path: input media path (image or video)
-    :param thumbnail_path: path to the thumbnail file to be created
-    :param height: height of the thumbnail in pixels
+    :param renditions: list of tuples containing the path to a thumbnail file, the height of the thumbnail in pixels
+    and the encoder settings (see save_thumbnail)
+    :param fast: use the fast path for resizing images (see create_image_thumbnail)
+    :return: list of the sizes of the thumbnails in the order of the renditions and the placeholder of the media file
+    (see get_placeholder)
     """
     # Handle JPGs and GIFs
     if (
@@ -109,28 +565,98 @@ def create_thumbnail(input_path, thumbnail_path, height):
         or input_path.lower().endswith(".gif")
         or input_path.lower().endswith(".png")
     ):
-        create_image_thumbnail(input_path, thumbnail_path, height)
+        return create_image_thumbnails(input_path, renditions, fast)
     # Handle MP4s
     elif input_path.lower().endswith(".mp4"):
-        create_video_thumbnail(input_path, thumbnail_path, height)
+        return create_video_thumbnails(input_path, renditions)
     else:
         raise spg_common.SPGException(
             f"Unsupported file type ({os.path.basename(input_path)})"
         )
 
 
-def get_remote_image_size(image_url):
+def create_thumbnail(input_path, thumbnail_path, height, fast=True):
+    """
+    Creates a thumbnail for a media file (image or video)
+    :param input_path: input media path (image or video)
+    :param thumbnail_path: path to the thumbnail file to be created
+    :param height: height of the thumbnail in pixels
+    :param fast: use the fast path for resizing images (see create_image_thumbnail)
+    :return: size of the thumbnail
+    """
+    thumbnail_sizes, _ = create_thumbnails(
+        input_path, [(thumbnail_path, height, None)], fast
+    )
+    return thumbnail_sizes[0]
+
+
+def get_http_session():
+    """
+    Gets the HTTP session shared by all requests to remote images. It keeps a pool of open connections, so that
+    subsequent requests to the same server don't need to connect again.
+    :return: requests.Session object
+    """
+    global _http_session
+
+    if _http_session is None:
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+        )
+        _http_session.mount("http://", adapter)
+        _http_session.mount("https://", adapter)
+
+    return _http_session
+
+
+def get_remote_image_size(image_url, session=None, timeout=None):
     """
-    Get the size of a remote image in pixels
-    :param
+    Get the size of a remote image in pixels. Only the beginning of the image is downloaded until its header can be
+    parsed. HTTP Range requests are used if the server supports them, otherwise the response is streamed and closed as
+    soon as the header was received.
+    :param image_url: URL of the image
+    :param session: requests.Session used for the requests (default is the shared session)
+    :param timeout: timeout of each request in seconds
     :return: tuple containing the width and the height of the image in pixels
     """
-    response = requests.get(image_url)
-    image = Image.open(BytesIO(response.content))
-    size = image.size
-    image.close()
+    session = session or get_http_session()
+    parser = ImageFile.Parser()
+    offset = 0
 
-    return size
+    while True:
+        byte_range = f"bytes={offset}-{offset + REMOTE_IMAGE_CHUNK_SIZE - 1}"
+        response = session.get(
+            image_url,
+            headers={"Range": byte_range},
+            stream=True,
+            timeout=timeout,
+        )
+
+        try:
+            # The requested range starts after the end of the image
+            if response.status_code == 416:
+                break
+            response.raise_for_status()
+
+            for chunk in response.iter_content(REMOTE_IMAGE_CHUNK_SIZE):
+                parser.feed(chunk)
+                offset += len(chunk)
+                if parser.image:
+                    return parser.image.size
+
+            # The server ignored the range and the whole image was received
+            if response.status_code != 206:
+                break
+
+            # The last range was received
+            content_range = response.headers.get("Content-Range", "")
+            total_size = content_range.rpartition("/")[2]
+            if total_size.isdigit() and offset >= int(total_size):
+                break
+        finally:
+            response.close()
+
+    raise spg_common.SPGException(f"Cannot read the size of the image {image_url}")
 
 
 def get_image_size(image_path):
@@ -139,43 +665,230 @@ def get_image_size(image_path):
     :param image_path: Path to the image
     :return: tuple containing the width and the height of the image in pixels
     """
-    image = Image.open(image_path)
-    image = rotate_image_by_orientation(image)
-    size = image.size
-    image.close()
+    with Image.open(image_path) as image:
+        size = image.size
+        try:
+            orientation = get_exif_orientation(image._getexif())
+        except:
+            orientation = 1
+
+    # Swap the dimensions instead of rotating the image, so that the pixel data doesn't need to be decoded
+    if orientation in (6, 8):
+        return size[1], size[0]
 
     return size
 
 
+def read_mp4_boxes(mp4_file, start, end):
+    """
+    Iterates over the boxes (atoms) of an MP4 file between two offsets without reading their content
+    :param mp4_file: MP4 file opened in binary mode
+    :param start: offset of the first box
+    :param end: offset at which the iteration stops
+    :return: generator of (box type, payload offset, box end offset) tuples
+    """
+    offset = start
+    while offset + 8 <= end:
+        mp4_file.seek(offset)
+        header = mp4_file.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        payload_offset = offset + 8
+
+        # The size can be stored as 64-bit number or can be 0 for a box extending to the end of the file
+        if size == 1:
+            size = struct.unpack(">Q", mp4_file.read(8))[0]
+            payload_offset += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload_offset - offset:
+            return
+
+        yield box_type.decode("latin-1"), payload_offset, min(offset + size, end)
+        offset += size
+
+
+def find_mp4_box(mp4_file, start, end, box_type):
+    """
+    Finds the first box of a given type between two offsets of an MP4 file
+    :param mp4_file: MP4 file opened in binary mode
+    :param start: offset of the first box
+    :param end: offset at which the search stops
+    :param box_type: type of the box (e.g. "moov")
+    :return: tuple containing the payload offset and the end offset of the box or None if not found
+    """
+    for current_type, payload_offset, box_end in read_mp4_boxes(mp4_file, start, end):
+        if current_type == box_type:
+            return payload_offset, box_end
+
+    return None
+
+
+def parse_mp4_track(mp4_file, track_start, track_end):
+    """
+    Parses the header of a track of an MP4 file
+    :param mp4_file: MP4 file opened in binary mode
+    :param track_start: payload offset of the trak box
+    :param track_end: end offset of the trak box
+    :return: dict containing the handler type, width, height, rotation, duration and codec of the track
+    """
+    track = dict(handler="", width=0, height=0, rotation=0, duration=None, codec="")
+
+    # The track header contains the display dimensions and the transformation matrix
+    tkhd = find_mp4_box(mp4_file, track_start, track_end, "tkhd")
+    if tkhd:
+        mp4_file.seek(tkhd[0])
+        version = mp4_file.read(1)[0]
+        mp4_file.seek(tkhd[0] + (52 if version == 1 else 40))
+        matrix = struct.unpack(">9i", mp4_file.read(36))
+        width, height = struct.unpack(">II", mp4_file.read(8))
+        track["width"] = width >> 16
+        track["height"] = height >> 16
+        track["rotation"] = round(math.degrees(math.atan2(matrix[1], matrix[0]))) % 360
+
+    mdia = find_mp4_box(mp4_file, track_start, track_end, "mdia")
+    if not mdia:
+        return track
+
+    hdlr = find_mp4_box(mp4_file, mdia[0], mdia[1], "hdlr")
+    if hdlr:
+        mp4_file.seek(hdlr[0] + 8)
+        track["handler"] = mp4_file.read(4).decode("latin-1")
+
+    mdhd = find_mp4_box(mp4_file, mdia[0], mdia[1], "mdhd")
+    if mdhd:
+        mp4_file.seek(mdhd[0])
+        version = mp4_file.read(1)[0]
+        if version == 1:
+            mp4_file.seek(mdhd[0] + 20)
+            timescale, duration = struct.unpack(">IQ", mp4_file.read(12))
+        else:
+            mp4_file.seek(mdhd[0] + 12)
+            timescale, duration = struct.unpack(">II", mp4_file.read(8))
+        if timescale:
+            track["duration"] = duration / timescale
+
+    # The codec is the format of the first sample description
+    minf = find_mp4_box(mp4_file, mdia[0], mdia[1], "minf")
+    stbl = minf and find_mp4_box(mp4_file, minf[0], minf[1], "stbl")
+    stsd = stbl and find_mp4_box(mp4_file, stbl[0], stbl[1], "stsd")
+    if stsd:
+        mp4_file.seek(stsd[0] + 12)
+        track["codec"] = mp4_file.read(4).decode("latin-1")
+
+    return track
+
+
+def parse_mp4_video_info(video_path):
+    """
+    Reads the information about the first video track directly from the boxes of an MP4 container, without decoding
+    any frames
+    :param video_path: Path to the video
+    :return: dict containing the width and height (before rotation), the rotation in degrees, the duration in seconds
+    and the codec of the video or None if no video track could be found
+    """
+    with open(video_path, "rb") as mp4_file:
+        file_size = os.fstat(mp4_file.fileno()).st_size
+
+        moov = find_mp4_box(mp4_file, 0, file_size, "moov")
+        if not moov:
+            return None
+
+        for box_type, payload_offset, box_end in read_mp4_boxes(
+            mp4_file, moov[0], moov[1]
+        ):
+            if box_type == "trak":
+                track = parse_mp4_track(mp4_file, payload_offset, box_end)
+                if track["handler"] == "vide" and track["width"] and track["height"]:
+                    del track["handler"]
+                    return track
+
+    return None
+
+
+def get_video_info(video_path):
+    """
+    Gets the dimensions, rotation, duration and codec of a video. The information is read from the MP4 container if
+    possible and otherwise from the video properties reported by OpenCV, without decoding any frames.
+    :param video_path: Path to the video
+    :return: dict containing the width and height (before rotation), the rotation in degrees, the duration in seconds
+    and the codec of the video
+    """
+    try:
+        video_info = parse_mp4_video_info(video_path)
+    except (OSError, struct.error, IndexError):
+        video_info = None
+
+    if video_info:
+        return video_info
+
+    video_capture = cv2.VideoCapture(video_path)
+    try:
+        if not video_capture.isOpened():
+            raise spg_common.SPGException(
+                f"Cannot open video {os.path.basename(video_path)}"
+            )
+
+        fps = video_capture.get(cv2.CAP_PROP_FPS)
+        frame_count = video_capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        fourcc = int(video_capture.get(cv2.CAP_PROP_FOURCC))
+
+        # The orientation metadata is only available in newer OpenCV versions
+        rotation = 0
+        if hasattr(cv2, "CAP_PROP_ORIENTATION_META"):
+            rotation = int(video_capture.get(cv2.CAP_PROP_ORIENTATION_META)) % 360
+
+        return dict(
+            width=int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            height=int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            rotation=rotation,
+            duration=frame_count / fps if fps else None,
+            codec="".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)),
+        )
+    finally:
+        video_capture.release()
+
+
 def get_video_size(video):
     """
-    Gets the size of a frame of a video in pixels
+    Gets the display size of a video in pixels (after applying its rotation)
     :param video: Path to the video
     :return: tuple containing the width and the height of the frame in pixels
     """
-    video_capture = cv2.VideoCapture(video)
-    _, image = video_capture.read()
-    return image.shape[1], image.shape[0]
+    video_info = get_video_info(video)
 
+    if video_info["rotation"] in (90, 270):
+        return video_info["height"], video_info["width"]
 
-def get_image_description(image_path):
+    return video_info["width"], video_info["height"]
+
+
+def parse_exif_description(exif):
     """
-    Gets the description of an image from the ImageDescription tag as a utf-8 string
-    :param image_path: Path to the image
+    Extracts the description of an image from the ImageDescription tag of its EXIF data as a utf-8 string
+    :param exif: EXIF data dictionary (may be None)
     :return: String (utf-8) containing the image description
     """
-    image = Image.open(image_path)
-    exif = image._getexif()
     if exif and EXIF_TAG_MAP["ImageDescription"] in exif:
         description = (
             exif[EXIF_TAG_MAP["ImageDescription"]]
             .encode(encoding="utf-16")[2::2]
             .decode("utf-8")
         )
-        description = description.replace("'", "&apos;").replace('"', "&quot;")
-    else:
-        description = ""
+        return description.replace("'", "&apos;").replace('"', "&quot;")
+
+    return ""
 
+
+def get_image_description(image_path):
+    """
+    Gets the description of an image from the ImageDescription tag as a utf-8 string
+    :param image_path: Path to the image
+    :return: String (utf-8) containing the image description
+    """
+    image = Image.open(image_path)
+    description = parse_exif_description(image._getexif())
     image.close()
 
     return description
@@ -196,6 +909,23 @@ def parse_exif_datetime(timestamp_string):
     return timestamp
 
 
+def parse_exif_date(exif):
+    """
+    Gets the date at which an image was taken from its EXIF data
+    :param exif: EXIF data dictionary (may be None)
+    :return: The date the image was taken or None if the EXIF data doesn't contain it
+    """
+    if exif:
+        if EXIF_TAG_MAP["DateTimeOriginal"] in exif:
+            return parse_exif_datetime(exif[EXIF_TAG_MAP["DateTimeOriginal"]])
+        elif EXIF_TAG_MAP["DateTimeDigitized"] in exif:
+            return parse_exif_datetime(exif[EXIF_TAG_MAP["DateTimeDigitized"]])
+        elif EXIF_TAG_MAP["DateTime"] in exif:
+            return parse_exif_datetime(exif[EXIF_TAG_MAP["DateTime"]])
+
+    return None
+
+
 def get_image_date(image_path):
     """
     Gets the date at which the image was taken from the EXIF data or from the creation date of the file
@@ -209,15 +939,7 @@ def get_image_date(image_path):
         exif = image._getexif()
         image.close()
 
-        if exif:
-            if EXIF_TAG_MAP["DateTimeOriginal"] in exif:
-                image_date = parse_exif_datetime(exif[EXIF_TAG_MAP["DateTimeOriginal"]])
-            elif EXIF_TAG_MAP["DateTimeDigitized"] in exif:
-                image_date = parse_exif_datetime(
-                    exif[EXIF_TAG_MAP["DateTimeDigitized"]]
-                )
-            elif EXIF_TAG_MAP["DateTime"] in exif:
-                image_date = parse_exif_datetime(exif[EXIF_TAG_MAP["DateTime"]])
+        image_date = parse_exif_date(exif)
 
     if not image_date:
         image_date = datetime.fromtimestamp(os.path.getctime(image_path))
@@ -225,40 +947,138 @@ def get_image_date(image_path):
     return image_date
 
 
-def get_metadata(image, thumbnail_path, public_path):
+class MediaProbe:
+    """
+    Collects all metadata of a media file (image or video) needed by the gallery. Images are opened only once and only
+    their header and EXIF data are read, instead of opening the file separately for each property.
+    """
+
+    # Version of the metadata extraction. It has to be increased whenever the extracted metadata changes, so that
+    # persistently cached metadata gets invalidated.
+    VERSION = 2
+
+    # Format of the date in the stored metadata, which can be parsed on all supported Python versions
+    DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+    def __init__(self, path):
+        """
+        Probes a media file
+        :param path: Path to the media file
+        """
+        self.path = path
+
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime
+        self.ctime = stat.st_ctime
+
+        path_lower = path.lower()
+        exif = None
+        if (
+            path_lower.endswith(".jpg")
+            or path_lower.endswith(".jpeg")
+            or path_lower.endswith(".gif")
+            or path_lower.endswith(".png")
+        ):
+            self.type = "image"
+            with Image.open(path) as image:
+                self.raw_size = image.size
+                try:
+                    exif = image._getexif()
+                except:
+                    exif = None
+            self.orientation = get_exif_orientation(exif)
+        elif path_lower.endswith(".mp4"):
+            self.type = "video"
+            self.raw_size = get_video_size(path)
+            self.orientation = 1
+        else:
+            raise spg_common.SPGException(
+                f"Unsupported file type {os.path.basename(path)}"
+            )
+
+        # The date and the description are only read from the EXIF data of JPEGs
+        is_jpeg = path_lower.endswith(".jpg") or path_lower.endswith(".jpeg")
+        self.date = None
+        self.description = ""
+        if is_jpeg:
+            self.date = parse_exif_date(exif)
+            self.description = parse_exif_description(exif)
+        if not self.date:
+            self.date = datetime.fromtimestamp(self.ctime)
+
+    @classmethod
+    def from_dict(cls, path, data):
+        """
+        Creates a probe from metadata previously stored with to_dict, without opening the media file
+        :param path: Path to the media file
+        :param data: Dictionary created by to_dict
+        :return: MediaProbe object
+        """
+        probe = cls.__new__(cls)
+        probe.path = path
+        probe.mtime = data["mtime"]
+        probe.ctime = data["ctime"]
+        probe.type = data["type"]
+        probe.raw_size = tuple(data["raw_size"])
+        probe.orientation = data["orientation"]
+        probe.date = datetime.strptime(data["date"], MediaProbe.DATE_FORMAT)
+        probe.description = data["description"]
+
+        return probe
+
+    def to_dict(self):
+        """
+        Converts the probed metadata to a JSON serializable dictionary
+        :return: Dictionary containing the metadata
+        """
+        return dict(
+            mtime=self.mtime,
+            ctime=self.ctime,
+            type=self.type,
+            raw_size=list(self.raw_size),
+            orientation=self.orientation,
+            date=self.date.strftime(MediaProbe.DATE_FORMAT),
+            description=self.description,
+        )
+
+    @property
+    def size(self):
+        """
+        Size of the media file after applying the rotation specified by its Orientation EXIF tag
+        :return: tuple containing the width and the height in pixels
+        """
+        if self.orientation in (6, 8):
+            return self.raw_size[1], self.raw_size[0]
+        return self.raw_size
+
+
+def get_metadata(image, thumbnail_path, public_path, probe=None, thumbnail_size=None):
     """
     Gets the metadata of a media file (image or video)
     :param image: Path to the media file
     :param thumbnail_path: Path to the thumbnail image of the media file
     :param public_path: Path to the public folder of the gallery
+    :param probe: Optional MediaProbe of the media file, if it was already probed
+    :param thumbnail_size: Optional size of the thumbnail, if it is already known
     :return:
     """
+    if probe is None:
+        probe = MediaProbe(image)
+
     # Paths should be relative to the public folder, because they will directly be used in the HTML
     image_data = dict(
         src=os.path.relpath(image, public_path),
-        mtime=os.path.getmtime(image),
-        date=get_image_date(image),
+        mtime=probe.mtime,
+        date=probe.date,
+        size=probe.size,
+        type=probe.type,
+        description=probe.description,
     )
 
-    if image.lower().endswith(".jpg") or image.lower().endswith(".jpeg"):
-        image_data["size"] = get_image_size(image)
-        image_data["type"] = "image"
-        image_data["description"] = get_image_description(image)
-    elif image.lower().endswith(".gif") or image.lower().endswith(".png"):
-        image_data["size"] = get_image_size(image)
-        image_data["type"] = "image"
-        image_data["description"] = ""
-    elif image.lower().endswith(".mp4"):
-        image_data["size"] = get_video_size(image)
-        image_data["type"] = "video"
-        image_data["description"] = ""
+    if probe.type == "video":
         thumbnail_path = thumbnail_path.replace(".mp4", ".jpg")
-    else:
-        raise spg_common.SPGException(
-            f"Unsupported file type {os.path.basename(image)}"
-        )
 
     image_data["thumbnail"] = os.path.relpath(thumbnail_path, public_path)
-    image_data["thumbnail_size"] = get_image_size(thumbnail_path)
+    image_data["thumbnail_size"] = thumbnail_size or get_image_size(thumbnail_path)
 
     return image_data
@@ -0,0 +1,226 @@
+import os
+import re
+import html
+import posixpath
+from html.parser import HTMLParser
+
+# Maximum size in bytes of a local stylesheet which is inlined in the HTML page
+INLINE_CSS_MAX_SIZE = 16 * 1024
+
+# Elements whose whitespace is significant
+PRESERVED_ELEMENTS = ["pre", "textarea", "script", "style"]
+
+# Elements whose content is not HTML, so it is written unchanged
+RAW_TEXT_ELEMENTS = ["script", "style"]
+
+# Elements which have no end tag
+VOID_ELEMENTS = [
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+]
+
+# Runs of HTML whitespace characters (non-breaking spaces are not whitespace in HTML)
+WHITESPACE_PATTERN = re.compile(r"[ \t\n\r\f]+")
+
+# Quoted attribute values, which are kept unchanged, or runs of whitespace in a tag
+TAG_WHITESPACE_PATTERN = re.compile(r"(\"[^\"]*\"|'[^']*')|[ \t\n\r\f]+")
+
+# Relative URLs in a stylesheet, which need to be rebased when the stylesheet is inlined
+CSS_URL_PATTERN = re.compile(
+    r"url\(\s*(['\"]?)(?![a-zA-Z][a-zA-Z0-9+.-]*:|/|#)([^'\")]+)\1\s*\)"
+)
+
+
+def is_local_url(url):
+    """
+    Checks if a URL references a file of the gallery
+    :param url: URL as written in the HTML page
+    :return: True if the URL is relative to the HTML page
+    """
+    return not re.match(r"^([a-zA-Z][a-zA-Z0-9+.-]*:|/|#)", url) and "?" not in url
+
+
+def get_inline_css(public_path, href):
+    """
+    Gets the content of a local stylesheet which can be inlined in the HTML page. Relative URLs in the stylesheet are
+    rebased on the folder of the HTML page.
+    :param public_path: Path to the public folder containing the HTML page
+    :param href: URL of the stylesheet relative to the HTML page
+    :return: Content of the stylesheet or None if it cannot be inlined
+    """
+    path = os.path.join(public_path, *href.split("/"))
+    if not os.path.isfile(path) or os.path.getsize(path) > INLINE_CSS_MAX_SIZE:
+        return None
+
+    with open(path, "r", encoding="utf-8") as css_in:
+        css = css_in.read()
+    if "@import" in css or "</style" in css.lower():
+        return None
+
+    folder = posixpath.dirname(href)
+    return CSS_URL_PATTERN.sub(
+        lambda match: f"url({match.group(1)}"
+        f"{posixpath.normpath(posixpath.join(folder, match.group(2)))}{match.group(1)})",
+        css,
+    )
+
+
+def minify_tag(tag_text):
+    """
+    Removes the unnecessary whitespace from a start tag. Attribute values are not changed.
+    :param tag_text: Start tag as written in the HTML page
+    :return: Minified start tag
+    """
+    tag_text = TAG_WHITESPACE_PATTERN.sub(lambda match: match.group(1) or " ", tag_text)
+    return re.sub(r" (/?>)$", r"\1", tag_text)
+
+
+class HTMLOptimizer(HTMLParser):
+    """
+    Streaming optimizer of the HTML pages of the gallery, which keeps the rendered document the same. Whitespace is
+    collapsed and comments are removed outside of preformatted elements, small local stylesheets are inlined so that
+    the page can be rendered without loading them and external scripts are deferred, so that they don't block the
+    parsing of the page.
+    """
+
+    def __init__(self, public_path=None):
+        """
+        Creates an optimizer
+        :param public_path: Path to the public folder containing the HTML page, the stylesheets are not inlined if
+        it is not specified
+        """
+        super().__init__()
+        self.public_path = public_path
+        self.output = []
+        self.preserved_depth = 0
+        self.raw_text_depth = 0
+
+        # Whitespace at the beginning of the document is not rendered
+        self.trailing_space = True
+
+    def optimize(self, chunks):
+        """
+        Optimizes an HTML page while it is generated
+        :param chunks: Iterable of strings forming the HTML page
+        :return: Generator of strings forming the optimized HTML page
+        """
+        for chunk in chunks:
+            self.feed(chunk)
+            yield self.flush()
+
+        self.close()
+        yield self.flush()
+
+    def flush(self):
+        """
+        Gets the optimized HTML generated since the last call
+        :return: Optimized HTML string
+        """
+        output = "".join(self.output)
+        self.output = []
+        return output
+
+    def emit(self, text):
+        self.output.append(text)
+        self.trailing_space = False
+
+    def emit_start_tag(self, tag, attrs, self_closing):
+        attributes = dict(attrs)
+        tag_text = minify_tag(self.get_starttag_text())
+
+        # Inline small local stylesheets
+        if (
+            tag == "link"
+            and self.public_path
+            and "stylesheet" in (attributes.get("rel") or "").lower().split()
+            and not attributes.get("media")
+            and is_local_url(attributes.get("href") or "")
+        ):
+            css = get_inline_css(self.public_path, attributes["href"])
+            if css is not None:
+                self.emit(f"<style>{css}</style>")
+                return
+
+        # Defer the external scripts, they are executed in the same order after the page is parsed
+        if (
+            tag == "script"
+            and attributes.get("src")
+            and "defer" not in attributes
+            and "async" not in attributes
+            and attributes.get("type") != "module"
+        ):
+            tag_text = tag_text[:-1] + " defer>"
+
+        self.emit(tag_text)
+
+        if not self_closing:
+            self.preserved_depth += tag in PRESERVED_ELEMENTS
+            self.raw_text_depth += tag in RAW_TEXT_ELEMENTS
+
+    def handle_starttag(self, tag, attrs):
+        self.emit_start_tag(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self.emit_start_tag(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if tag in PRESERVED_ELEMENTS and self.preserved_depth:
+            self.preserved_depth -= 1
+        if tag in RAW_TEXT_ELEMENTS and self.raw_text_depth:
+            self.raw_text_depth -= 1
+        if tag not in VOID_ELEMENTS:
+            self.emit(f"</{tag}>")
+
+    def handle_data(self, data):
+        # The character references of the text are converted by the parser, so the text is escaped again
+        if self.raw_text_depth:
+            self.emit(data)
+            return
+        data = html.escape(data, quote=False)
+        if self.preserved_depth:
+            self.emit(data)
+            return
+
+        # Collapse the whitespace, also across several chunks of text
+        data = WHITESPACE_PATTERN.sub(" ", data)
+        if self.trailing_space and data.startswith(" "):
+            data = data[1:]
+        if data:
+            self.emit(data)
+            self.trailing_space = data.endswith(" ")
+
+    def handle_comment(self, data):
+        # Conditional comments are interpreted by old browsers
+        if self.preserved_depth or data.startswith("[if") or data.endswith("endif]"):
+            self.emit(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.emit(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        self.emit(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        self.emit(f"<![{data}]>")
+
+
+def optimize_html(chunks, public_path=None):
+    """
+    Optimizes an HTML page while it is generated (see HTMLOptimizer)
+    :param chunks: Iterable of strings forming the HTML page
+    :param public_path: Path to the public folder containing the HTML page, the stylesheets are not inlined if it is
+    not specified
+    :return: Generator of strings forming the optimized HTML page
+    """
+    return HTMLOptimizer(public_path).optimize(chunks)
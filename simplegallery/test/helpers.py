@@ -1,6 +1,12 @@
 import os
+import re
 import sys
 import json
+import threading
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
 from PIL import Image
 import simplegallery.gallery_init as gallery_init
 
@@ -73,3 +79,172 @@ def create_mock_image(path, width, height):
 
     img.save(path)
     img.close()
+
+
+def create_mock_video(path, width, height, frames=10, fps=10):
+    """
+    Creates a mock MP4 video with gray frames
+    :param path: path where the video should be stored
+    :param width: width of the video
+    :param height: height of the video
+    :param frames: number of frames
+    :param fps: frames per second
+    """
+    video_writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+    )
+    for frame in range(frames):
+        video_writer.write(np.full((height, width, 3), 20 * frame, dtype=np.uint8))
+    video_writer.release()
+
+
+class DOMBuilder(HTMLParser):
+    """
+    Builds a simplified DOM tree of an HTML document, in which the whitespace of the text is collapsed as rendered by
+    the browser and comments are ignored
+    """
+
+    VOID_ELEMENTS = ["br", "hr", "img", "input", "link", "meta", "source", "wbr"]
+
+    def __init__(self, ignored_attributes):
+        super().__init__()
+        self.ignored_attributes = ignored_attributes
+        self.root = ("#document", [], [])
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        attributes = sorted(
+            (name, value)
+            for name, value in attrs
+            if name not in self.ignored_attributes
+        )
+        element = (tag, attributes, [])
+        self.stack[-1][2].append(element)
+        if tag not in self.VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.stack[-1][2].append((tag, sorted(attrs), []))
+
+    def handle_endtag(self, tag):
+        if tag not in self.VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_data(self, data):
+        children = self.stack[-1][2]
+        if children and isinstance(children[-1], str):
+            data = children.pop() + data
+        if self.stack[-1][0] not in ["pre", "textarea", "script", "style"]:
+            data = re.sub(r"[ \t\n\r\f]+", " ", data)
+        children.append(data)
+
+
+def parse_dom(html, ignored_attributes=()):
+    """
+    Parses an HTML document into a tree for comparing the rendered documents
+    :param html: HTML string
+    :param ignored_attributes: names of the attributes which are not added to the tree
+    :return: tree of (tag, attributes, children) tuples, text nodes are strings
+    """
+    builder = DOMBuilder(ignored_attributes)
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+class MockImageRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the MockImageServer
+    """
+
+    def do_GET(self):
+        """
+        Serves a file of the server, optionally only the requested byte range
+        """
+        self.server.requests.append(self.path)
+
+        # Remote providers encode the requested size after a "?" or a "=" in the URL
+        path = self.path.split("?")[0].split("=")[0]
+        content = self.server.files.get(path)
+
+        if self.server.failures.get(path):
+            self.server.failures[path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        start, end = 0, len(content) - 1
+        byte_range = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if byte_range and self.server.supports_range:
+            start = int(byte_range.group(1))
+            if byte_range.group(2):
+                end = min(end, int(byte_range.group(2)))
+            if start >= len(content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        try:
+            for offset in range(start, end + 1, 4096):
+                chunk = content[offset : min(offset + 4096, end + 1)]
+                self.wfile.write(chunk)
+                self.server.bytes_sent += len(chunk)
+        except ConnectionError:
+            pass
+
+    def log_message(self, format, *args):
+        """
+        Suppresses the logging of the HTTP server
+        """
+        return
+
+
+class MockImageServer(ThreadingHTTPServer):
+    """
+    Local HTTP server standing in for a remote image host in the tests
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files, supports_range=True):
+        """
+        Starts the server in a background thread
+        :param files: dict mapping URL paths to the content of the files
+        :param supports_range: if False, the Range header is ignored and the whole file is always sent
+        """
+        super().__init__(("127.0.0.1", 0), MockImageRequestHandler)
+        self.files = files
+        self.supports_range = supports_range
+        self.requests = []
+        self.bytes_sent = 0
+
+        # Maps URL paths to the number of the following requests that should fail with a server error
+        self.failures = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        """
+        Gets the URL of a file of the server
+        :param path: URL path of the file
+        :return: full URL
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
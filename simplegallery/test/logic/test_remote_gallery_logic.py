@@ -0,0 +1,147 @@
+import io
+import unittest
+from unittest import mock
+from PIL import Image
+import simplegallery.test.helpers as helpers
+from simplegallery.logic.remote_gallery_logic import RemoteGalleryLogic
+from simplegallery.logic.variants.google_gallery_logic import GoogleGalleryLogic
+from simplegallery.logic.variants.onedrive_gallery_logic import OnedriveGalleryLogic
+
+
+def create_mock_album(sizes):
+    """
+    Creates the files of a mock remote album
+    :param sizes: list of photo sizes
+    :return: dict mapping the URL paths to the content of the photos
+    """
+    files = {}
+    for index, size in enumerate(sizes):
+        content = io.BytesIO()
+        Image.new("RGB", size, color="red").save(content, "JPEG")
+        files[f"/photo{index}"] = content.getvalue()
+
+    return files
+
+
+class RemoteGalleryLogicTestCase(unittest.TestCase):
+    sizes = [(800, 600), (600, 800), (1000, 1000), (320, 160), (160, 320), (640, 480)]
+
+    def test_generate_images_data(self):
+        with helpers.MockImageServer(create_mock_album(self.sizes)) as server:
+            for logic_class, photo_url_suffix in [
+                (GoogleGalleryLogic, "=w100-h100"),
+                (OnedriveGalleryLogic, "?width=100&height=100"),
+            ]:
+                photo_urls = [
+                    server.url(f"/photo{index}") + photo_url_suffix
+                    for index in range(len(self.sizes))
+                ]
+                gallery_logic = logic_class(
+                    dict(thumbnail_height=160, remote_concurrency=3)
+                )
+
+                with mock.patch.object(
+                    logic_class, "find_photo_urls", return_value=photo_urls
+                ), mock.patch("simplegallery.common.log") as log:
+                    images_data = gallery_logic.generate_images_data({})
+
+                # The photos are in the order of the album and the progress is logged in the same order
+                self.assertEqual(
+                    [f"photo{index}" for index in range(len(self.sizes))],
+                    list(images_data.keys()),
+                )
+                self.assertEqual(
+                    [
+                        f"{index + 1}/{len(self.sizes)}\t\tProcessing photo photo{index}: {photo_url}"
+                        for index, photo_url in enumerate(photo_urls)
+                    ],
+                    [
+                        call.args[0]
+                        for call in log.call_args_list
+                        if "Processing photo" in call.args[0]
+                    ],
+                )
+
+                for index, size in enumerate(self.sizes):
+                    helpers.check_image_data(
+                        self,
+                        images_data,
+                        f"photo{index}",
+                        "",
+                        size,
+                        (round(160 * size[0] / size[1]), 160),
+                    )
+
+    def test_incremental_update(self):
+        with helpers.MockImageServer(create_mock_album(self.sizes)) as server:
+            photo_urls = [
+                server.url(f"/photo{index}") for index in range(len(self.sizes))
+            ]
+            gallery_logic = GoogleGalleryLogic(dict(thumbnail_height=160))
+
+            with mock.patch.object(
+                GoogleGalleryLogic, "find_photo_urls", return_value=photo_urls[:4]
+            ):
+                images_data = gallery_logic.generate_images_data({})
+            self.assertEqual(4, len(server.requests))
+            images_data["photo1"]["description"] = "Test description"
+
+            # Only the new photos are requested, the removed photo is dropped and the order of the album is kept
+            server.requests.clear()
+            album_urls = [photo_urls[5], photo_urls[1], photo_urls[0], photo_urls[4]]
+            with mock.patch.object(
+                GoogleGalleryLogic, "find_photo_urls", return_value=album_urls
+            ):
+                images_data = gallery_logic.generate_images_data(images_data)
+            self.assertEqual(
+                ["/photo4", "/photo5"],
+                sorted(request.split("=")[0] for request in server.requests),
+            )
+            self.assertEqual(
+                ["photo5", "photo1", "photo0", "photo4"], list(images_data.keys())
+            )
+            for index in [5, 1, 0, 4]:
+                size = self.sizes[index]
+                helpers.check_image_data(
+                    self,
+                    images_data,
+                    f"photo{index}",
+                    "Test description" if index == 1 else "",
+                    size,
+                    (round(160 * size[0] / size[1]), 160),
+                )
+
+            # All photos are requested again when forced
+            server.requests.clear()
+            with mock.patch.object(
+                GoogleGalleryLogic, "find_photo_urls", return_value=album_urls
+            ):
+                images_data = gallery_logic.generate_images_data(
+                    images_data, force=True
+                )
+            self.assertEqual(4, len(server.requests))
+            self.assertEqual("Test description", images_data["photo1"]["description"])
+
+    @mock.patch.object(RemoteGalleryLogic, "RETRY_BACKOFF", 0.01)
+    def test_retries(self):
+        with helpers.MockImageServer(create_mock_album(self.sizes[:2])) as server:
+            photo_urls = [server.url("/photo0"), server.url("/photo1")]
+            gallery_logic = GoogleGalleryLogic(
+                dict(thumbnail_height=160, remote_retries=2)
+            )
+
+            # Temporary server errors are retried
+            server.failures = {"/photo0": 2, "/photo1": 3}
+            with mock.patch.object(
+                GoogleGalleryLogic, "find_photo_urls", return_value=photo_urls
+            ), mock.patch("simplegallery.common.log") as log:
+                images_data = gallery_logic.generate_images_data({})
+
+            # The photo that still fails after all retries is skipped
+            self.assertEqual(["photo0"], list(images_data.keys()))
+            log.assert_any_call("Photos that could not be processed: 1")
+            self.assertEqual(6, len(server.requests))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,18 @@
 import unittest
 from unittest import mock
 import os
+import json
+import shutil
+from PIL import Image
 from testfixtures import TempDirectory
+import simplegallery.common as spg_common
 import simplegallery.test.helpers as helpers
 import simplegallery.media as spg_media
-from simplegallery.logic.variants.files_gallery_logic import FilesGalleryLogic
+import simplegallery.cache as spg_cache
+from simplegallery.logic.variants.files_gallery_logic import (
+    FilesGalleryLogic,
+    get_sprite_groups,
+)
 
 
 class FileGalleryLogicTestCase(unittest.TestCase):
@@ -41,7 +49,15 @@ class FileGalleryLogicTestCase(unittest.TestCase):
             # Check thumbnail created
             file_gallery_logic.create_thumbnails()
             tempdir.compare(
-                [".empty", "photo.jpg", "photo2.jpg", "photo3.jpg"],
+                [
+                    ".empty",
+                    "photo.jpg",
+                    "photo2.jpg",
+                    "photo3.jpg",
+                    "photo@1x.jpg",
+                    "photo2@1x.jpg",
+                    "photo3@1x.jpg",
+                ],
                 path="public/images/thumbnails",
             )
             # The thumbnails are generated twice as big in order to improve the quality on retina displays
@@ -49,17 +65,27 @@ class FileGalleryLogicTestCase(unittest.TestCase):
             self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_gif_path))
             self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_png_path))
 
-            # Check thumbnail not regenerated without force
+            # Check thumbnails not regenerated and not opened if nothing changed
+            with mock.patch("simplegallery.common.log") as log:
+                with mock.patch(
+                    "simplegallery.media.get_image_size", side_effect=RuntimeError
+                ):
+                    file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 0")
+
+            # Check thumbnail regenerated after the photo changed
             helpers.create_mock_image(
                 os.path.join(tempdir.path, "public", "images", "photos", "photo.jpg"),
                 500,
                 500,
             )
             file_gallery_logic.create_thumbnails()
-            self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_path))
+            self.assertEqual((320, 320), spg_media.get_image_size(thumbnail_path))
 
             # Check thumbnail regenerated with force
-            file_gallery_logic.create_thumbnails(force=True)
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails(force=True)
+                log.assert_called_with("New thumbnails generated: 3")
             self.assertEqual((320, 320), spg_media.get_image_size(thumbnail_path))
 
             # Check thumbnail regenerated after size changed
@@ -69,6 +95,608 @@ class FileGalleryLogicTestCase(unittest.TestCase):
             file_gallery_logic.create_thumbnails()
             self.assertEqual((640, 640), spg_media.get_image_size(thumbnail_path))
 
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_manifest(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 1000, 500
+            )
+            thumbnail_path = os.path.join(
+                tempdir.path, "public", "images", "thumbnails", "photo.jpg"
+            )
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # Thumbnails generated without the manifest are kept if they have the correct size
+            gallery_config["disable_cache"] = True
+            file_gallery_logic.create_thumbnails()
+            gallery_config["disable_cache"] = False
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 0")
+
+            # Modified thumbnails are kept if they have the correct size
+            helpers.create_mock_image(thumbnail_path, 600, 320)
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 0")
+            self.assertEqual((600, 320), spg_media.get_image_size(thumbnail_path))
+
+            # Thumbnails are regenerated if the encoding settings change
+            gallery_config["fast_thumbnails"] = False
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 1")
+            self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_path))
+
+            # The thumbnail sizes and the placeholder are taken from the manifest without opening the thumbnails
+            with mock.patch(
+                "simplegallery.media.get_image_size", side_effect=RuntimeError
+            ), mock.patch(
+                "simplegallery.media.get_thumbnail_placeholder",
+                side_effect=RuntimeError,
+            ):
+                images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual((320, 160), images_data["photo.jpg"]["thumbnail_size"])
+            self.assertEqual(
+                "#fe0000", images_data["photo.jpg"]["placeholder"]["color"]
+            )
+
+            # Without the manifest the placeholder is computed from the smallest thumbnail
+            gallery_config["disable_cache"] = True
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                "#fe0000", images_data["photo.jpg"]["placeholder"]["color"]
+            )
+
+            # The placeholder is reused from the images data until the thumbnail changes
+            placeholder = images_data["photo.jpg"]["placeholder"]
+            with mock.patch(
+                "simplegallery.media.get_thumbnail_placeholder",
+                side_effect=RuntimeError,
+            ):
+                images_data = file_gallery_logic.generate_images_data(images_data)
+            self.assertEqual(placeholder, images_data["photo.jpg"]["placeholder"])
+            helpers.create_mock_image(
+                os.path.join(
+                    tempdir.path, "public", "images", "thumbnails", "photo@1x.jpg"
+                ),
+                320,
+                160,
+            )
+            with mock.patch(
+                "simplegallery.media.get_thumbnail_placeholder",
+                wraps=spg_media.get_thumbnail_placeholder,
+            ) as get_thumbnail_placeholder:
+                file_gallery_logic.generate_images_data(images_data)
+            get_thumbnail_placeholder.assert_called_once()
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_parallel(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(6):
+                helpers.create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"),
+                    1000 + 100 * index,
+                    500,
+                )
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+            thumbnails_path = gallery_config["thumbnails_path"]
+
+            # Generate the thumbnails serially and store their content
+            file_gallery_logic.create_thumbnails()
+            serial_thumbnails = {
+                name: tempdir.read(os.path.join(thumbnails_path, name))
+                for name in os.listdir(thumbnails_path)
+            }
+
+            # Generate the thumbnails in parallel and check that they are identical
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails(force=True, jobs=3)
+                log.assert_called_with("New thumbnails generated: 6")
+
+            self.assertEqual(13, len(serial_thumbnails))
+            for name, content in serial_thumbnails.items():
+                self.assertEqual(
+                    content, tempdir.read(os.path.join(thumbnails_path, name))
+                )
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_errors(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 1000, 500
+            )
+            tempdir.write("broken.jpg", b"Not an image")
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # The valid photo gets a thumbnail even though the broken one fails
+            with mock.patch("simplegallery.common.log") as log:
+                with self.assertRaises(spg_common.SPGException) as cm:
+                    file_gallery_logic.create_thumbnails(jobs=2)
+                log.assert_called_with("New thumbnails generated: 1")
+
+            self.assertIn("broken.jpg", cm.exception.message)
+            tempdir.compare(
+                [".empty", "photo.jpg", "photo@1x.jpg"], path="public/images/thumbnails"
+            )
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_densities(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 1000, 500
+            )
+            thumbnails_path = os.path.join(
+                tempdir.path, "public", "images", "thumbnails"
+            )
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            gallery_config["thumbnail_densities"] = [3, 1, 1.5]
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # All thumbnails of a photo are generated together from a single decoded image
+            with mock.patch(
+                "simplegallery.media.create_thumbnails",
+                wraps=spg_media.create_thumbnails,
+            ) as create:
+                file_gallery_logic.create_thumbnails()
+            create.assert_called_once()
+            self.assertEqual(3, len(create.call_args.args[1]))
+            tempdir.compare(
+                [".empty", "photo.jpg", "photo@1.5x.jpg", "photo@1x.jpg"],
+                path="public/images/thumbnails",
+            )
+            self.assertEqual(
+                (960, 480),
+                spg_media.get_image_size(os.path.join(thumbnails_path, "photo.jpg")),
+            )
+            self.assertEqual(
+                (480, 240),
+                spg_media.get_image_size(
+                    os.path.join(thumbnails_path, "photo@1.5x.jpg")
+                ),
+            )
+
+            # Each thumbnail is recorded in the images data, the default thumbnail has the highest density
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                [
+                    dict(src="images/thumbnails/photo@1x.jpg", size=(320, 160)),
+                    dict(src="images/thumbnails/photo@1.5x.jpg", size=(480, 240)),
+                    dict(src="images/thumbnails/photo.jpg", size=(960, 480)),
+                ],
+                images_data["photo.jpg"]["thumbnails"],
+            )
+            self.assertEqual(
+                "images/thumbnails/photo.jpg", images_data["photo.jpg"]["thumbnail"]
+            )
+            self.assertEqual((320, 160), images_data["photo.jpg"]["thumbnail_size"])
+
+            # Only the missing thumbnail is generated when a density is added
+            gallery_config["thumbnail_densities"] = [1, 1.5, 2, 3]
+            with mock.patch("simplegallery.media.create_thumbnails") as create:
+                create.return_value = ([(640, 320)], None)
+                file_gallery_logic.create_thumbnails()
+            create.assert_called_once_with(
+                os.path.join(tempdir.path, "public", "images", "photos", "photo.jpg"),
+                [(os.path.join(thumbnails_path, "photo@2x.jpg"), 320, {})],
+                True,
+            )
+
+            # Invalid densities are reported
+            gallery_config["thumbnail_densities"] = [0, 1]
+            with self.assertRaises(spg_common.SPGException):
+                file_gallery_logic.create_thumbnails()
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_formats(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 1000, 500
+            )
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            gallery_config["thumbnail_densities"] = [1, 2]
+            gallery_config["thumbnail_encoder"] = dict(
+                formats=["webp"], target_size=5000
+            )
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # The thumbnails are generated in the additional formats and as JPEG
+            file_gallery_logic.create_thumbnails()
+            tempdir.compare(
+                [".empty", "photo.jpg", "photo.webp", "photo@1x.jpg", "photo@1x.webp"],
+                path="public/images/thumbnails",
+            )
+
+            # The other formats are stored as alternative sources of the JPEG thumbnails
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                "images/thumbnails/photo.jpg", images_data["photo.jpg"]["thumbnail"]
+            )
+            self.assertEqual(
+                [
+                    dict(
+                        type="image/webp",
+                        thumbnails=[
+                            dict(
+                                src="images/thumbnails/photo@1x.webp", size=(320, 160)
+                            ),
+                            dict(src="images/thumbnails/photo.webp", size=(640, 320)),
+                        ],
+                    )
+                ],
+                images_data["photo.jpg"]["thumbnail_sources"],
+            )
+
+            # Changing the encoder settings regenerates the thumbnails
+            gallery_config["thumbnail_encoder"]["quality"] = 50
+            del gallery_config["thumbnail_encoder"]["target_size"]
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 1")
+
+            # Unknown formats and invalid settings are reported
+            for thumbnail_encoder in [
+                dict(formats=["bmp"]),
+                dict(quality=101),
+                dict(target_ssim=2),
+                dict(speed=1),
+            ]:
+                gallery_config["thumbnail_encoder"] = thumbnail_encoder
+                with self.assertRaises(spg_common.SPGException):
+                    file_gallery_logic.create_thumbnails()
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_web_renditions(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 2000, 3000
+            )
+            helpers.create_mock_image(os.path.join(tempdir.path, "small.jpg"), 800, 600)
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "animation.gif"), 2000, 3000
+            )
+            web_path = os.path.join(tempdir.path, "public", "images", "web")
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # No renditions are generated by default
+            file_gallery_logic.create_thumbnails()
+            tempdir.compare([".empty"], path="public/images/web")
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual([], images_data["photo.jpg"]["renditions"])
+
+            gallery_config["web_renditions"] = [2048, 1024, 4096]
+
+            # The renditions are generated together with the thumbnails, only if they are smaller than the photo, so
+            # only the thumbnails of the large photo are generated again
+            with mock.patch(
+                "simplegallery.media.create_thumbnails",
+                wraps=spg_media.create_thumbnails,
+            ) as create:
+                file_gallery_logic.create_thumbnails()
+            self.assertEqual(1, create.call_count)
+            tempdir.compare(
+                [".empty", "photo@1024.jpg", "photo@2048.jpg"], path="public/images/web"
+            )
+            self.assertEqual(
+                (683, 1024),
+                spg_media.get_image_size(os.path.join(web_path, "photo@1024.jpg")),
+            )
+
+            # The renditions are recorded in the images data, sorted by size
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                [
+                    dict(src="images/web/photo@1024.jpg", size=(683, 1024)),
+                    dict(src="images/web/photo@2048.jpg", size=(1365, 2048)),
+                ],
+                images_data["photo.jpg"]["renditions"],
+            )
+            self.assertEqual("images/photos/photo.jpg", images_data["photo.jpg"]["src"])
+            self.assertEqual([], images_data["small.jpg"]["renditions"])
+            self.assertEqual([], images_data["animation.gif"]["renditions"])
+
+            # Nothing is regenerated if nothing changed
+            with mock.patch("simplegallery.common.log") as log:
+                file_gallery_logic.create_thumbnails()
+                log.assert_called_with("New thumbnails generated: 0")
+
+            # Invalid renditions are reported
+            gallery_config["web_renditions"] = [1024.5]
+            with self.assertRaises(spg_common.SPGException):
+                file_gallery_logic.create_thumbnails()
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_create_thumbnails_content_addressed(self, input):
+        with TempDirectory() as tempdir:
+            helpers.create_mock_image(
+                os.path.join(tempdir.path, "photo.jpg"), 3000, 1500
+            )
+            shutil.copy(
+                os.path.join(tempdir.path, "photo.jpg"),
+                os.path.join(tempdir.path, "copy.jpg"),
+            )
+            helpers.create_mock_image(os.path.join(tempdir.path, "photo.png"), 800, 600)
+            thumbnails_path = os.path.join(
+                tempdir.path, "public", "images", "thumbnails"
+            )
+            web_path = os.path.join(tempdir.path, "public", "images", "web")
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            gallery_config["content_addressed_thumbnails"] = True
+            gallery_config["web_renditions"] = [2048]
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+
+            # Photos with the same name don't overwrite each other and identical photos share their thumbnails
+            file_gallery_logic.create_thumbnails()
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                images_data["photo.jpg"]["thumbnails"],
+                images_data["copy.jpg"]["thumbnails"],
+            )
+            self.assertEqual(
+                images_data["photo.jpg"]["renditions"],
+                images_data["copy.jpg"]["renditions"],
+            )
+            self.assertNotEqual(
+                images_data["photo.jpg"]["thumbnails"],
+                images_data["photo.png"]["thumbnails"],
+            )
+            self.assertEqual(5, len(os.listdir(thumbnails_path)))
+            self.assertEqual(2, len(os.listdir(web_path)))
+            for thumbnail in images_data["photo.png"]["thumbnails"]:
+                self.assertRegex(
+                    thumbnail["src"], r"^images/thumbnails/[0-9a-f]{16}.jpg$"
+                )
+
+            # The content hashes are cached and the thumbnails are not generated again
+            with mock.patch(
+                "simplegallery.cache.compute_content_hash", side_effect=RuntimeError
+            ):
+                with mock.patch("simplegallery.common.log") as log:
+                    file_gallery_logic.create_thumbnails()
+                    log.assert_any_call("New thumbnails generated: 0")
+
+            # Without the metadata cache each photo is hashed only once per build
+            gallery_config["disable_cache"] = True
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+            with mock.patch(
+                "simplegallery.cache.compute_content_hash",
+                wraps=spg_cache.compute_content_hash,
+            ) as compute_content_hash:
+                file_gallery_logic.create_thumbnails()
+                file_gallery_logic.generate_images_data({})
+            self.assertEqual(3, compute_content_hash.call_count)
+            gallery_config["disable_cache"] = False
+
+            # The renditions of photos which cannot be probed are not removed as orphans
+            with mock.patch.object(FilesGalleryLogic, "get_probe", side_effect=OSError):
+                file_gallery_logic.create_thumbnails()
+            self.assertEqual(2, len(os.listdir(web_path)))
+
+            # Thumbnails with different settings get new names and the orphaned thumbnails are removed
+            gallery_config["thumbnail_height"] = 100
+            file_gallery_logic.create_thumbnails()
+            new_images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(
+                sorted(
+                    [".empty"]
+                    + [
+                        os.path.basename(thumbnail["src"])
+                        for image_name in ["photo.jpg", "photo.png"]
+                        for thumbnail in new_images_data[image_name]["thumbnails"]
+                    ]
+                ),
+                sorted(os.listdir(thumbnails_path)),
+            )
+            self.assertEqual(
+                images_data["photo.jpg"]["renditions"],
+                new_images_data["photo.jpg"]["renditions"],
+            )
+
+            # The thumbnails and the images data of deleted photos are removed when the gallery is built again
+            file_gallery_logic.create_images_data_file()
+            os.remove(
+                os.path.join(tempdir.path, "public", "images", "photos", "photo.png")
+            )
+            file_gallery_logic.create_thumbnails()
+            file_gallery_logic.create_images_data_file()
+            with open(gallery_config["images_data_file"], "r") as images_data_in:
+                self.assertEqual(
+                    ["copy.jpg", "photo.jpg"], sorted(json.load(images_data_in))
+                )
+            for thumbnail in new_images_data["photo.png"]["thumbnails"]:
+                self.assertFalse(
+                    os.path.exists(
+                        os.path.join(tempdir.path, "public", thumbnail["src"])
+                    )
+                )
+            self.assertEqual(3, len(os.listdir(thumbnails_path)))
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_update_sprites(self, input):
+        with TempDirectory() as tempdir:
+            for photo_name, color in [("d.jpg", "red"), ("e.jpg", "green")]:
+                Image.new("RGB", (1000, 500), color).save(
+                    os.path.join(tempdir.path, photo_name)
+                )
+            Image.new("RGB", (500, 500), "blue").save(
+                os.path.join(tempdir.path, "b.jpg")
+            )
+            photos_path = os.path.join(tempdir.path, "public", "images", "photos")
+            sprites_path = os.path.join(tempdir.path, "public", "images", "sprites")
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            gallery_config["thumbnail_sprite_size"] = 4
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+            file_gallery_logic.create_thumbnails()
+
+            # The thumbnails of consecutive photos are packed into the same atlas, b.jpg ends its group
+            images_data = file_gallery_logic.generate_images_data({})
+            self.assertEqual(2, len(os.listdir(sprites_path)))
+            self.assertEqual(
+                images_data["d.jpg"]["sprite"]["src"],
+                images_data["e.jpg"]["sprite"]["src"],
+            )
+            self.assertNotEqual(
+                images_data["b.jpg"]["sprite"]["src"],
+                images_data["d.jpg"]["sprite"]["src"],
+            )
+            self.assertEqual(
+                dict(
+                    src=images_data["d.jpg"]["sprite"]["src"],
+                    position=[0, 0],
+                    size=[200.3125, 100],
+                ),
+                images_data["d.jpg"]["sprite"],
+            )
+            self.assertEqual([100, 0], images_data["e.jpg"]["sprite"]["position"])
+            self.assertEqual(
+                dict(
+                    src=images_data["b.jpg"]["sprite"]["src"],
+                    position=[0, 0],
+                    size=[100, 100],
+                ),
+                images_data["b.jpg"]["sprite"],
+            )
+
+            # Only the atlas containing a changed, added or removed photo is generated again and the old one is removed
+            def update(expected_photo_names):
+                file_gallery_logic.create_thumbnails()
+                with mock.patch("simplegallery.common.log") as log:
+                    new_images_data = file_gallery_logic.generate_images_data({})
+                    log.assert_called_with("New sprites generated: 1")
+                tempdir.compare(
+                    sorted(
+                        set(
+                            os.path.basename(
+                                new_images_data[photo_name]["sprite"]["src"]
+                            )
+                            for photo_name in new_images_data
+                        )
+                    ),
+                    path="public/images/sprites",
+                )
+                for photo_name in expected_photo_names:
+                    self.assertEqual(
+                        images_data[photo_name]["sprite"],
+                        new_images_data[photo_name]["sprite"],
+                    )
+                return new_images_data
+
+            Image.new("RGB", (500, 500), "yellow").save(
+                os.path.join(photos_path, "b.jpg")
+            )
+            images_data = update(["d.jpg", "e.jpg"])
+
+            Image.new("RGB", (500, 500), "black").save(
+                os.path.join(photos_path, "c.jpg")
+            )
+            images_data = update(["b.jpg", "d.jpg", "e.jpg"])
+
+            os.remove(os.path.join(photos_path, "e.jpg"))
+            images_data = update(["b.jpg", "c.jpg"])
+
+            # The thumbnails are packed in the order in which the photos are displayed and encoded like the thumbnails
+            gallery_config["thumbnail_encoder"] = dict(quality=50)
+            with mock.patch.object(
+                spg_media, "create_sprite", wraps=spg_media.create_sprite
+            ) as create_sprite:
+                file_gallery_logic.generate_images_data(
+                    {name: images_data[name] for name in ["d.jpg", "c.jpg", "b.jpg"]}
+                )
+            self.assertEqual(
+                ["d.jpg", "c.jpg", "b.jpg"],
+                [
+                    os.path.basename(thumbnail_path)
+                    for call in create_sprite.call_args_list
+                    for thumbnail_path in call[0][0]
+                ],
+            )
+            for call in create_sprite.call_args_list:
+                self.assertEqual(dict(quality=50), call[0][4])
+
+            # Invalid sizes are reported
+            gallery_config["thumbnail_sprite_size"] = "2"
+            with self.assertRaises(spg_common.SPGException):
+                file_gallery_logic.generate_images_data({})
+
+    def test_get_sprite_groups(self):
+        photo_names = [f"photo{index:03}.jpg" for index in range(200)]
+        groups = get_sprite_groups(photo_names, 10)
+        self.assertEqual(photo_names, [name for group in groups for name in group])
+        self.assertTrue(all(len(group) <= 10 for group in groups))
+
+        # Adding or removing a photo only changes the groups around it
+        for changed_photo_names in [
+            photo_names[:100] + photo_names[101:],
+            photo_names[:100] + ["photo100a.jpg"] + photo_names[100:],
+        ]:
+            changed_groups = get_sprite_groups(changed_photo_names, 10)
+            unchanged_groups = [group for group in groups if group in changed_groups]
+            self.assertGreaterEqual(len(unchanged_groups), len(groups) - 2)
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_find_duplicates(self, input):
+        with TempDirectory() as tempdir:
+            fractal = Image.effect_mandelbrot((1000, 500), (-2, -1, 1, 1), 100)
+            fractal = fractal.convert("RGB")
+            fractal.save(os.path.join(tempdir.path, "photo.jpg"))
+            fractal.resize((500, 250)).save(os.path.join(tempdir.path, "copy.jpg"))
+            fractal.transpose(Image.FLIP_LEFT_RIGHT).save(
+                os.path.join(tempdir.path, "other.jpg")
+            )
+
+            # Flat images and videos are never considered duplicates
+            helpers.create_mock_image(os.path.join(tempdir.path, "flat.png"), 1000, 500)
+            helpers.create_mock_image(os.path.join(tempdir.path, "flat.gif"), 500, 250)
+            helpers.create_mock_video(os.path.join(tempdir.path, "video.mp4"), 64, 32)
+
+            gallery_config = helpers.init_gallery_and_read_gallery_config(tempdir.path)
+            gallery_config["thumbnail_sprite_size"] = 10
+            file_gallery_logic = FilesGalleryLogic(gallery_config)
+            file_gallery_logic.create_thumbnails()
+
+            # The photo with the highest resolution comes first in each group
+            self.assertEqual(
+                [["photo.jpg", "copy.jpg"]], file_gallery_logic.find_duplicates()
+            )
+
+            # The hashes are read from the cache instead of hashing the thumbnails again
+            with mock.patch(
+                "simplegallery.duplicates.compute_image_dhash", side_effect=RuntimeError
+            ):
+                self.assertEqual(
+                    [["photo.jpg", "copy.jpg"]], file_gallery_logic.find_duplicates()
+                )
+
+            # The duplicates are excluded from the images data before the thumbnails are packed into sprites
+            with mock.patch.object(
+                spg_media, "create_sprite", wraps=spg_media.create_sprite
+            ) as create_sprite:
+                file_gallery_logic.create_images_data_file(excluded_photos=["copy.jpg"])
+            sprite_thumbnails = [
+                os.path.basename(thumbnail_path)
+                for call in create_sprite.call_args_list
+                for thumbnail_path in call[0][0]
+            ]
+            self.assertEqual(5, len(sprite_thumbnails))
+            self.assertNotIn("copy.jpg", sprite_thumbnails)
+            with open(gallery_config["images_data_file"], "r") as images_data_in:
+                self.assertEqual(
+                    ["flat.gif", "flat.png", "other.jpg", "photo.jpg", "video.mp4"],
+                    sorted(json.load(images_data_in)),
+                )
+
     @mock.patch("builtins.input", side_effect=["", "", "", ""])
     def test_generate_images_data(self, input):
         with TempDirectory() as tempdir:
@@ -0,0 +1,162 @@
+import unittest
+from unittest import mock
+import os
+import sqlite3
+from testfixtures import TempDirectory
+import simplegallery.cache as spg_cache
+import simplegallery.media as spg_media
+import simplegallery.test.helpers as helpers
+
+
+class MetadataCacheTestCase(unittest.TestCase):
+    def test_get_cache_path(self):
+        self.assertEqual(
+            os.path.join("gallery", ".spg-cache"),
+            spg_cache.get_cache_path(
+                dict(images_data_file=os.path.join("gallery", "images_data.json"))
+            ),
+        )
+        self.assertEqual(
+            "cache",
+            spg_cache.get_cache_path(
+                dict(images_data_file="images_data.json", cache_path="cache")
+            ),
+        )
+
+    def test_get_probe(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photo.jpg")
+            helpers.create_mock_image(image_path, 1000, 500)
+            cache_path = os.path.join(tempdir.path, ".spg-cache")
+
+            # The first request probes the file
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                probe = cache.get_probe(image_path)
+                self.assertEqual((1000, 500), probe.size)
+
+            # Unchanged files are not probed again, even after reopening the cache
+            with mock.patch(
+                "simplegallery.media.MediaProbe.__init__", side_effect=RuntimeError
+            ):
+                with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                    cached_probe = cache.get_probe(image_path)
+            self.assertEqual(probe.to_dict(), cached_probe.to_dict())
+            self.assertEqual(probe.date, cached_probe.date)
+            self.assertEqual(image_path, cached_probe.path)
+
+            # Changed files are probed again
+            helpers.create_mock_image(image_path, 500, 500)
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                self.assertEqual((500, 500), cache.get_probe(image_path).size)
+
+            # Unchanged files are probed again when a refresh is requested
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                with mock.patch(
+                    "simplegallery.media.MediaProbe.__init__", side_effect=RuntimeError
+                ):
+                    with self.assertRaises(RuntimeError):
+                        cache.get_probe(image_path, refresh=True)
+
+    def test_version_invalidation(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photo.jpg")
+            helpers.create_mock_image(image_path, 1000, 500)
+            cache_path = os.path.join(tempdir.path, ".spg-cache")
+
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                cache.get_probe(image_path)
+
+            # Entries created by a different version of the metadata extraction are removed
+            with mock.patch.object(
+                spg_media.MediaProbe, "VERSION", spg_media.MediaProbe.VERSION + 1
+            ):
+                with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                    count = cache.connection.execute(
+                        "SELECT COUNT(*) FROM metadata"
+                    ).fetchone()[0]
+            self.assertEqual(0, count)
+
+    def test_evict_stale_entries(self):
+        with TempDirectory() as tempdir:
+            cache_path = os.path.join(tempdir.path, ".spg-cache")
+            image_paths = []
+            for index in range(5):
+                image_paths.append(os.path.join(tempdir.path, f"photo{index}.jpg"))
+                helpers.create_mock_image(image_paths[-1], 100, 100)
+
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                for image_path in image_paths:
+                    cache.get_probe(image_path)
+
+            # Only the requested entries and the allowed number of stale ones are kept
+            with spg_cache.MetadataCache(
+                cache_path, tempdir.path, max_stale_entries=2
+            ) as cache:
+                cache.get_probe(image_paths[0])
+
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                count = cache.connection.execute(
+                    "SELECT COUNT(*) FROM metadata"
+                ).fetchone()[0]
+            self.assertEqual(3, count)
+
+    def test_perceptual_hash(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photo.jpg")
+            helpers.create_mock_image(image_path, 1000, 500)
+            cache_path = os.path.join(tempdir.path, ".spg-cache")
+
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                cache.get_probe(image_path)
+                self.assertIsNone(cache.get_perceptual_hash(image_path))
+                cache.set_perceptual_hash(image_path, 2**64 - 1)
+
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                self.assertEqual(2**64 - 1, cache.get_perceptual_hash(image_path))
+
+            # The hash is discarded when the file changes
+            helpers.create_mock_image(image_path, 500, 500)
+            with spg_cache.MetadataCache(cache_path, tempdir.path) as cache:
+                self.assertIsNone(cache.get_perceptual_hash(image_path))
+
+
+class ThumbnailManifestTestCase(unittest.TestCase):
+    def test_placeholder(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photo.jpg")
+            thumbnail_path = os.path.join(tempdir.path, "thumbnail.jpg")
+            helpers.create_mock_image(image_path, 100, 100)
+            helpers.create_mock_image(thumbnail_path, 10, 10)
+            cache_path = os.path.join(tempdir.path, ".spg-cache")
+            placeholder = dict(color="#ff0000", preview="data:image/png;base64,")
+
+            # Create a manifest without the placeholder column like older versions
+            os.makedirs(cache_path)
+            connection = sqlite3.connect(
+                os.path.join(cache_path, spg_cache.ThumbnailManifest.DATABASE_NAME)
+            )
+            connection.execute(
+                "CREATE TABLE thumbnails (path TEXT PRIMARY KEY, source_signature TEXT, settings TEXT, "
+                "thumbnail_signature TEXT, width INTEGER, height INTEGER)"
+            )
+            connection.close()
+
+            # The placeholder is recorded together with the thumbnail
+            with spg_cache.ThumbnailManifest(cache_path, tempdir.path) as manifest:
+                self.assertIsNone(manifest.get_placeholder(thumbnail_path))
+                manifest.record(
+                    image_path, thumbnail_path, dict(height=10), (10, 10), placeholder
+                )
+            with spg_cache.ThumbnailManifest(cache_path, tempdir.path) as manifest:
+                self.assertEqual(placeholder, manifest.get_placeholder(thumbnail_path))
+                self.assertTrue(
+                    manifest.is_fresh(image_path, thumbnail_path, dict(height=10))
+                )
+
+                # The placeholder is unknown once the thumbnail changed
+                helpers.create_mock_image(thumbnail_path, 20, 10)
+                self.assertIsNone(manifest.get_placeholder(thumbnail_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
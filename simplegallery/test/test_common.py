@@ -0,0 +1,43 @@
+import unittest
+import simplegallery.common as spg_common
+
+
+def square(value):
+    if value < 0:
+        raise spg_common.SPGException(f"Negative value: {value}")
+    return value * value
+
+
+class CommonTestCase(unittest.TestCase):
+    def test_run_parallel(self):
+        tasks = [(value,) for value in [3, -1, 2, 5, -4, 1, 0]]
+
+        for jobs, use_threads in [(1, False), (3, True), (3, False)]:
+            results = list(
+                spg_common.run_parallel(square, tasks, jobs, use_threads=use_threads)
+            )
+
+            # Results are returned in the order of the tasks and errors are collected per task
+            self.assertEqual(tasks, [task for task, _, _ in results])
+            self.assertEqual(
+                [9, None, 4, 25, None, 1, 0], [result for _, result, _ in results]
+            )
+            self.assertEqual(
+                [
+                    None,
+                    "Negative value: -1",
+                    None,
+                    None,
+                    "Negative value: -4",
+                    None,
+                    None,
+                ],
+                [
+                    spg_common.get_error_message(exception) if exception else None
+                    for _, _, exception in results
+                ],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest import mock
+import os
+import gzip
+from testfixtures import TempDirectory
+import simplegallery.compression as spg_compression
+
+
+class CompressionTestCase(unittest.TestCase):
+    def test_compress_public_files(self):
+        with TempDirectory() as tempdir:
+            html = b"<html>" + b"<p>photo</p>" * 100 + b"</html>"
+            tempdir.write("index.html", html)
+            tempdir.write("slides/page-1.json", b"[]")
+            tempdir.write("images/photos/photo.jpg", b"jpeg")
+            tempdir.write("page-2.html.gz", b"stale")
+            tempdir.write("archive.tar.gz", b"archive")
+            tempdir.write("index.html.br", b"disabled encoding")
+
+            with mock.patch.object(
+                spg_compression, "get_encodings", return_value=["gzip"]
+            ):
+                self.assertEqual(
+                    2, spg_compression.compress_public_files(tempdir.path, 2)
+                )
+
+                # Media files are skipped and the compressed copies of removed pages and of disabled encodings are
+                # removed
+                tempdir.compare(
+                    [
+                        "archive.tar.gz",
+                        "images/",
+                        "images/photos/",
+                        "images/photos/photo.jpg",
+                        "index.html",
+                        "index.html.gz",
+                        "slides/",
+                        "slides/page-1.json",
+                        "slides/page-1.json.gz",
+                    ]
+                )
+                with gzip.open(os.path.join(tempdir.path, "index.html.gz")) as gz_in:
+                    self.assertEqual(html, gz_in.read())
+
+                # The modification time is not stored in the compressed copies
+                self.assertEqual(b"\0\0\0\0", tempdir.read("index.html.gz")[4:8])
+
+                # Only the modified files are compressed again, files written again with the same content keep their
+                # compressed copies
+                self.assertEqual(0, spg_compression.compress_public_files(tempdir.path))
+                index_path = os.path.join(tempdir.path, "index.html")
+                tempdir.write("index.html", html)
+                os.utime(index_path, ns=(0, os.stat(index_path).st_mtime_ns + 1))
+                with mock.patch("os.replace") as replace:
+                    self.assertEqual(
+                        0, spg_compression.compress_public_files(tempdir.path)
+                    )
+                    replace.assert_not_called()
+                self.assertTrue(
+                    spg_compression.is_sidecar_fresh(index_path, index_path + ".gz")
+                )
+
+                tempdir.write("index.html", b"<html></html>")
+                os.utime(index_path, ns=(0, os.stat(index_path).st_mtime_ns + 1))
+                self.assertEqual(1, spg_compression.compress_public_files(tempdir.path))
+                with gzip.open(index_path + ".gz") as gz_in:
+                    self.assertEqual(b"<html></html>", gz_in.read())
+
+    @unittest.skipIf(spg_compression.brotli is None, "brotli is not installed")
+    def test_compress_brotli(self):
+        with TempDirectory() as tempdir:
+            tempdir.write("main.css", b"body { color: red; }")
+            self.assertEqual(2, spg_compression.compress_public_files(tempdir.path))
+            self.assertEqual(
+                b"body { color: red; }",
+                spg_compression.brotli.decompress(tempdir.read("main.css.br")),
+            )
+
+    def test_remove_stale_sidecars(self):
+        with TempDirectory() as tempdir:
+            tempdir.write("index.html", b"<html></html>")
+            tempdir.write("index.html.gz", b"gzip")
+            tempdir.write("index.html.br", b"brotli")
+            tempdir.write("archive.tar.gz", b"archive")
+
+            # The compressed copies are removed when the precompression is disabled
+            self.assertEqual(
+                1, spg_compression.remove_stale_sidecars(tempdir.path, ["gzip"])
+            )
+            self.assertEqual(1, spg_compression.remove_stale_sidecars(tempdir.path, []))
+            tempdir.compare(["archive.tar.gz", "index.html"])
@@ -0,0 +1,73 @@
+import unittest
+import random
+from PIL import Image
+import simplegallery.duplicates as spg_duplicates
+
+
+class DuplicatesTestCase(unittest.TestCase):
+    def test_compute_dhash(self):
+        gradient = Image.linear_gradient("L").convert("RGB")
+
+        # Resized copies have the same hash, different images a distant one
+        horizontal_hash = spg_duplicates.compute_dhash(gradient.rotate(90))
+        self.assertEqual(
+            horizontal_hash,
+            spg_duplicates.compute_dhash(gradient.rotate(90).resize((1000, 500))),
+        )
+        self.assertLess(
+            32,
+            spg_duplicates.get_hamming_distance(
+                horizontal_hash, spg_duplicates.compute_dhash(gradient)
+            ),
+        )
+
+    def test_bk_tree_search(self):
+        random.seed(0)
+        hashes = [random.getrandbits(16) for _ in range(500)]
+
+        tree = spg_duplicates.BKTree()
+        for index, item_hash in enumerate(hashes):
+            tree.add(item_hash, index)
+
+        # The results are the same as comparing the hash to all others
+        for item_hash in hashes[:20]:
+            expected = sorted(
+                (spg_duplicates.get_hamming_distance(item_hash, other_hash), index)
+                for index, other_hash in enumerate(hashes)
+                if spg_duplicates.get_hamming_distance(item_hash, other_hash) <= 3
+            )
+            self.assertEqual(expected, sorted(tree.search(item_hash, 3)))
+
+    def test_find_duplicate_groups(self):
+        # Photos are only grouped with the first photo of their group, not through a chain of neighbours
+        random.seed(0)
+        base = random.getrandbits(64) | 0xFFFF0000
+        hashes = dict(a=base, b=base ^ 0b1, c=base ^ 0b11, d=base ^ 0b111)
+        self.assertEqual(
+            [["a", "b"], ["c", "d"]], spg_duplicates.find_duplicate_groups(hashes, 1)
+        )
+        self.assertEqual(
+            [["a", "b", "c"]], spg_duplicates.find_duplicate_groups(hashes, 2)
+        )
+
+        # The order of the dictionary defines the representatives of the groups
+        hashes = dict(d=hashes["d"], c=hashes["c"], b=hashes["b"], a=hashes["a"])
+        self.assertEqual(
+            [["d", "c", "b"]], spg_duplicates.find_duplicate_groups(hashes, 2)
+        )
+
+    def test_degenerate_hashes(self):
+        # Flat images have hashes with almost all bits equal, which are never grouped
+        flat_hash = spg_duplicates.compute_dhash(Image.new("RGB", (100, 100), "red"))
+        self.assertTrue(spg_duplicates.is_degenerate_hash(flat_hash))
+        self.assertTrue(spg_duplicates.is_degenerate_hash(2**64 - 1))
+        self.assertEqual(
+            [],
+            spg_duplicates.find_duplicate_groups(
+                dict(flat=flat_hash, dark=flat_hash ^ 0b1, light=2**64 - 1)
+            ),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
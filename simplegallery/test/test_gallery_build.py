@@ -3,11 +3,14 @@ from unittest import mock
 import sys
 import os
 import json
+from collections import OrderedDict
 from PIL import Image
 from testfixtures import TempDirectory
+import simplegallery.common as spg_common
 import simplegallery.gallery_init as gallery_init
 import simplegallery.gallery_build as gallery_build
 import simplegallery.media as spg_media
+import simplegallery.test.helpers as helpers
 
 
 def create_mock_image(path, width, height):
@@ -43,10 +46,18 @@ class SPGBuildTestCase(unittest.TestCase):
             # Check thumbnail created
             sys.argv = ["gallery_build", "-p", tempdir.path]
             gallery_build.main()
-            tempdir.compare([".empty", "photo.jpg"], path="public/images/thumbnails")
+            tempdir.compare(
+                [".empty", "photo.jpg", "photo@1x.jpg"], path="public/images/thumbnails"
+            )
             self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_path))
 
-            # Check thumbnail not regenerated without force
+            # Check thumbnail not regenerated without changes
+            thumbnail_mtime = os.stat(thumbnail_path).st_mtime_ns
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+            self.assertEqual(thumbnail_mtime, os.stat(thumbnail_path).st_mtime_ns)
+
+            # Check thumbnail regenerated after the photo changed
             create_mock_image(
                 os.path.join(tempdir.path, "public", "images", "photos", "photo.jpg"),
                 500,
@@ -54,12 +65,14 @@ class SPGBuildTestCase(unittest.TestCase):
             )
             sys.argv = ["gallery_build", "-p", tempdir.path]
             gallery_build.main()
-            self.assertEqual((640, 320), spg_media.get_image_size(thumbnail_path))
+            self.assertEqual((320, 320), spg_media.get_image_size(thumbnail_path))
 
             # Check thumbnail regenerated with force
+            thumbnail_mtime = os.stat(thumbnail_path).st_mtime_ns
             sys.argv = ["gallery_build", "-p", tempdir.path, "-ft"]
             gallery_build.main()
             self.assertEqual((320, 320), spg_media.get_image_size(thumbnail_path))
+            self.assertNotEqual(thumbnail_mtime, os.stat(thumbnail_path).st_mtime_ns)
 
     @mock.patch("builtins.input", side_effect=["", "", "", ""])
     def test_images_data_generation(self, input):
@@ -73,7 +86,13 @@ class SPGBuildTestCase(unittest.TestCase):
             gallery_build.main()
 
             tempdir.compare(
-                ["templates", "public", "gallery.json", "images_data.json"],
+                [
+                    ".spg-cache",
+                    "templates",
+                    "public",
+                    "gallery.json",
+                    "images_data.json",
+                ],
                 recursive=False,
             )
 
@@ -85,8 +104,10 @@ class SPGBuildTestCase(unittest.TestCase):
             sys.argv = ["gallery_init", "-p", tempdir.path]
             gallery_init.main()
 
+            # The HTML is written while the template is generated instead of rendering it at once
             sys.argv = ["gallery_build", "-p", tempdir.path]
-            gallery_build.main()
+            with mock.patch("jinja2.Template.render", side_effect=RuntimeError):
+                gallery_build.main()
 
             tempdir.compare(
                 ["css", "images", "js", "index.html"], path="public", recursive=False
@@ -104,10 +125,467 @@ class SPGBuildTestCase(unittest.TestCase):
                     html,
                 )
                 self.assertIn('<a href="images/photos/photo.jpg"', html)
+                self.assertIn(
+                    'srcset="images/thumbnails/photo@1x.jpg 320w, images/thumbnails/photo.jpg 640w"',
+                    html,
+                )
+                self.assertIn('sizes="320px"', html)
+                self.assertIn(
+                    "--w: 320; --h: 160; background: #fe0000 url(data:image/png;base64,",
+                    html,
+                )
                 self.assertIn(
                     'background: #333366 url("images/photos/photo.jpg")', html
                 )
 
+            # An error in the template keeps the previous page instead of leaving a partially written one
+            template_path = os.path.join(
+                tempdir.path, "templates", "index_template.jinja"
+            )
+            with open(template_path, "r") as template_in:
+                template = template_in.read()
+            with open(template_path, "w") as template_out:
+                template_out.write(
+                    template.replace("</body>", "{{ missing_function() }}</body>")
+                )
+            gallery_build.get_jinja_environment.cache_clear()
+            with self.assertRaises(SystemExit):
+                gallery_build.main()
+            tempdir.compare(
+                ["css", "images", "js", "index.html"], path="public", recursive=False
+            )
+            with open(
+                os.path.join(tempdir.path, "public", "index.html"), "r"
+            ) as html_in:
+                self.assertEqual(html, html_in.read())
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_template_cache(self, input):
+        with TempDirectory() as tempdir:
+            create_mock_image(os.path.join(tempdir.path, "photo.jpg"), 1000, 500)
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+
+            # The compiled templates are stored in the cache of the gallery
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+            self.assertEqual(
+                2,
+                len(os.listdir(os.path.join(tempdir.path, ".spg-cache", "templates"))),
+            )
+
+            # The environment is created only once for each templates folder
+            templates_path = os.path.join(tempdir.path, "templates")
+            self.assertIs(
+                gallery_build.get_jinja_environment(templates_path),
+                gallery_build.get_jinja_environment(templates_path),
+            )
+
+            # The next build uses the compiled templates
+            with mock.patch("jinja2.Environment.compile", side_effect=RuntimeError):
+                gallery_build.get_jinja_environment.cache_clear()
+                gallery_build.main()
+
+    def test_images_view(self):
+        images_data = OrderedDict(
+            (name, dict(name=name, src=f"images/photos/{name}"))
+            for name in ["a.jpg", "b.jpg", "c.jpg"]
+        )
+        images = gallery_build.ImagesView(images_data)
+
+        # The view returns the images data dictionaries without copying them
+        self.assertEqual(3, len(images))
+        self.assertIs(images_data["b.jpg"], images[1])
+        self.assertIs(images_data["c.jpg"], images[-1])
+        self.assertEqual(
+            ["a.jpg", "b.jpg", "c.jpg"], [image["name"] for image in images]
+        )
+        self.assertEqual(["b.jpg", "c.jpg"], [image["name"] for image in images[1:]])
+        self.assertIs(images_data["c.jpg"], images[1:][1])
+        with self.assertRaises(IndexError):
+            images[3]
+
+    def test_images_view_get_section(self):
+        # The names are not sorted in display order, as in remote galleries
+        names = ["c.jpg", "a.jpg", "e.jpg", "b.jpg", "d.jpg"]
+        images_data = OrderedDict((name, dict(name=name)) for name in names)
+        images = gallery_build.ImagesView(images_data)
+
+        for first_name, last_name in [
+            ("a.jpg", "c.jpg"),
+            ("b", "d"),
+            ("d.jpg", "z.jpg"),
+            ("a.jpg", "a.jpg"),
+            ("f.jpg", "g.jpg"),
+            ("c.jpg", "a.jpg"),
+        ]:
+            # Compare to checking the names of all images
+            expected_names = [name for name in names if first_name <= name <= last_name]
+            expected_first_photo = (
+                names.index(expected_names[0]) + 1 if expected_names else -1
+            )
+
+            first_photo, section = images.get_section(first_name, last_name)
+            self.assertEqual(expected_first_photo, first_photo)
+            self.assertEqual(expected_names, [image["name"] for image in section])
+
+        # Sections of a slice are relative to the slice
+        first_photo, section = images[2:].get_section("a.jpg", "c.jpg")
+        self.assertEqual(2, first_photo)
+        self.assertEqual(["b.jpg"], [image["name"] for image in section])
+
+    def test_get_pages(self):
+        images = [
+            dict(name=f"photo{index}.jpg", date=date)
+            for index, date in enumerate(["2019", "2019", "2019", "2020", ""])
+        ]
+
+        self.assertEqual([("", images)], gallery_build.get_pages(images, {}))
+        self.assertEqual(
+            [("", images[:2]), ("", images[2:4]), ("", images[4:])],
+            gallery_build.get_pages(images, dict(page_size=2)),
+        )
+        self.assertEqual(
+            [("2019", images[:3]), ("2020", images[3:4]), ("", images[4:])],
+            gallery_build.get_pages(images, dict(paginate_by_date=True)),
+        )
+        self.assertEqual(
+            [
+                ("2019", images[:2]),
+                ("2019", images[2:3]),
+                ("2020", images[3:4]),
+                ("", images[4:]),
+            ],
+            gallery_build.get_pages(images, dict(paginate_by_date=True, page_size=2)),
+        )
+        self.assertEqual([("", [])], gallery_build.get_pages([], dict(page_size=2)))
+
+        with self.assertRaises(spg_common.SPGException):
+            gallery_build.get_pages(images, dict(page_size=-1))
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_pagination(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(5):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["page_size"] = 2
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+
+            # Pages which were not generated by the gallery are never removed
+            tempdir.write("public/page-4.html", b"<html></html>")
+
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+
+            # Each page links to the others and to the slide manifests of its neighbours
+            tempdir.compare(
+                [
+                    "css",
+                    "images",
+                    "js",
+                    "slides",
+                    "index.html",
+                    "page-2.html",
+                    "page-3.html",
+                    "page-4.html",
+                ],
+                path="public",
+                recursive=False,
+            )
+            with open(
+                os.path.join(tempdir.path, "public", "page-2.html"), "r"
+            ) as html_in:
+                html = html_in.read()
+            self.assertIn('<a href="images/photos/photo2.jpg"', html)
+            self.assertNotIn('<a href="images/photos/photo1.jpg"', html)
+            self.assertIn('data-previous-slides="slides/page-1.json"', html)
+            self.assertIn('data-next-slides="slides/page-3.json"', html)
+            self.assertIn('href="index.html" rel="prev"', html)
+
+            with open(
+                os.path.join(tempdir.path, "public", "slides", "page-3.json"), "r"
+            ) as slides_in:
+                slides = json.load(slides_in)
+            self.assertEqual(1, len(slides))
+            self.assertEqual("images/photos/photo4.jpg", slides[0]["src"])
+            self.assertEqual([1000, 500], slides[0]["size"])
+            self.assertEqual(sorted(gallery_build.SLIDE_KEYS), sorted(slides[0]))
+
+            # The pages of a previous build are removed when the gallery has fewer pages
+            gallery_config["page_size"] = 0
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+            tempdir.compare(
+                ["css", "images", "js", "slides", "index.html", "page-4.html"],
+                path="public",
+                recursive=False,
+            )
+            tempdir.compare([], path="public/slides")
+            with open(
+                os.path.join(tempdir.path, "public", "index.html"), "r"
+            ) as html_in:
+                self.assertNotIn("gallery-pagination", html_in.read())
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_slides_manifest(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(3):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+
+            # The slides are inline and the thumbnails reference them by their position
+            index_html_path = os.path.join(tempdir.path, "public", "index.html")
+            with open(index_html_path, "r") as html_in:
+                html = html_in.read()
+            self.assertIn('data-slide="2"', html)
+            self.assertNotIn("data-renditions", html)
+
+            # The type and the size of the photos are kept, so that the slides can be created if the manifest fails
+            self.assertIn(
+                'data-type="image"\n         data-gallery="0"\n         data-width="1000"\n         data-height="500"',
+                html,
+            )
+            manifest_start = '<script type="application/json" id="gallery-slides">'
+            manifest = html[html.index(manifest_start) + len(manifest_start) :]
+            slides = json.loads(manifest[: manifest.index("</script>")])
+            self.assertEqual(3, len(slides))
+            self.assertEqual("images/photos/photo2.jpg", slides[2]["src"])
+            self.assertEqual(sorted(gallery_build.SLIDE_KEYS), sorted(slides[2]))
+
+            # The slides can be loaded from a separate manifest instead
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["slides_manifest"] = "external"
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            gallery_build.main()
+
+            with open(index_html_path, "r") as html_in:
+                self.assertIn('data-src="slides/page-1.json"', html_in.read())
+            with open(
+                os.path.join(tempdir.path, "public", "slides", "page-1.json"), "r"
+            ) as slides_in:
+                self.assertEqual(slides, json.load(slides_in))
+
+            gallery_config["slides_manifest"] = "html"
+            with self.assertRaises(spg_common.SPGException):
+                gallery_build.get_slides_manifest_type(gallery_config)
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_lazy_thumbnails(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(3):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["lazy_thumbnails"] = True
+            gallery_config["above_the_fold_thumbnails"] = 1
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+
+            # The first thumbnail is loaded with a high priority and the others lazily by the browser. The thumbnails
+            # keep their src, so that they are displayed without scripts.
+            with open(
+                os.path.join(tempdir.path, "public", "index.html"), "r"
+            ) as html_in:
+                html = html_in.read()
+            self.assertEqual(3, html.count('width="320" height="160" decoding="async"'))
+            self.assertEqual(1, html.count('fetchpriority="high"'))
+            self.assertEqual(2, html.count('loading="lazy"'))
+            self.assertIn('<img src="images/thumbnails/photo0.jpg"', html)
+            self.assertIn('<img src="images/thumbnails/photo1.jpg"', html)
+            self.assertNotIn("data-srcset", html)
+
+            gallery_config["above_the_fold_thumbnails"] = -1
+            with self.assertRaises(spg_common.SPGException):
+                gallery_build.get_above_the_fold_count(gallery_config)
+            self.assertIsNone(gallery_build.get_above_the_fold_count({}))
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_precompress(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(3):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["precompress"] = True
+            gallery_config["page_size"] = 2
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+            index_html_path = os.path.join(tempdir.path, "public", "index.html")
+            self.assertTrue(os.path.exists(index_html_path + ".gz"))
+
+            # The unchanged pages and manifests are not written again, so their compressed copies stay up to date
+            with mock.patch("simplegallery.common.log") as log:
+                gallery_build.main()
+                log.assert_any_call("Compressed files written: 0")
+
+            # The compressed copies are removed when the precompression is disabled
+            gallery_config["precompress"] = False
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            gallery_build.main()
+            self.assertFalse(os.path.exists(index_html_path + ".gz"))
+            self.assertTrue(os.path.exists(index_html_path))
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_optimize_html(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(3):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+
+            index_html_path = os.path.join(tempdir.path, "public", "index.html")
+            with open(index_html_path, "r") as html_in:
+                html = html_in.read()
+
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["optimize_html"] = True
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            gallery_build.main()
+
+            with open(index_html_path, "r") as html_in:
+                optimized_html = html_in.read()
+
+            # The local stylesheets are inlined and the scripts deferred
+            self.assertIn("\n      <a href", html)
+            self.assertNotIn(
+                "\n", optimized_html.split("<body>")[1].split("<script")[0]
+            )
+            self.assertNotIn('href="css/main.css"', optimized_html)
+            self.assertIn(".gallery>a", optimized_html)
+            self.assertIn("url(images/default-skin.png)", optimized_html)
+            self.assertIn('<script src="js/main.js" defer></script>', optimized_html)
+
+            # Apart from that the rendered document is the same
+            def get_body(dom):
+                (document,) = [child for child in dom[2] if child[0] == "html"]
+                return [child for child in document[2] if child[0] == "body"]
+
+            self.assertEqual(
+                get_body(helpers.parse_dom(html, ["defer"])),
+                get_body(helpers.parse_dom(optimized_html, ["defer"])),
+            )
+
+    @mock.patch("builtins.input", side_effect=["", "", "", ""])
+    def test_virtual_gallery(self, input):
+        with TempDirectory() as tempdir:
+            for index in range(3):
+                create_mock_image(
+                    os.path.join(tempdir.path, f"photo{index}.jpg"), 1000, 500
+                )
+
+            sys.argv = ["gallery_init", "-p", tempdir.path]
+            gallery_init.main()
+
+            gallery_config_path = os.path.join(tempdir.path, "gallery.json")
+            with open(gallery_config_path, "r") as gallery_config_in:
+                gallery_config = json.load(gallery_config_in)
+            gallery_config["virtual_gallery_chunk_size"] = 2
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+
+            sys.argv = ["gallery_build", "-p", tempdir.path]
+            gallery_build.main()
+
+            # The photos are rendered by the browser from the manifests instead of the HTML
+            with open(
+                os.path.join(tempdir.path, "public", "index.html"), "r"
+            ) as html_in:
+                html = html_in.read()
+            self.assertIn('data-manifest="slides/gallery.json"', html)
+            self.assertNotIn('<a href="images/photos/', html)
+
+            tempdir.compare(
+                ["chunk-1.json", "chunk-2.json", "files.json", "gallery.json"],
+                path="public/slides",
+            )
+            with open(
+                os.path.join(tempdir.path, "public", "slides", "gallery.json"), "r"
+            ) as manifest_in:
+                self.assertEqual(
+                    dict(
+                        chunk_size=2,
+                        chunks=["slides/chunk-1.json", "slides/chunk-2.json"],
+                        sizes=[[320, 160]] * 3,
+                    ),
+                    json.load(manifest_in),
+                )
+            with open(
+                os.path.join(tempdir.path, "public", "slides", "chunk-2.json"), "r"
+            ) as chunk_in:
+                chunk = json.load(chunk_in)
+            self.assertEqual(1, len(chunk))
+            self.assertEqual("images/photos/photo2.jpg", chunk[0]["src"])
+            self.assertEqual(
+                sorted(gallery_build.VIRTUAL_GALLERY_KEYS), sorted(chunk[0])
+            )
+
+            # A virtualized gallery cannot be split into pages
+            gallery_config["page_size"] = 2
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            with self.assertRaises(SystemExit) as cm:
+                gallery_build.main()
+            self.assertEqual(cm.exception.code, 1)
+
+            # The manifests are removed when the gallery is not virtualized anymore
+            del gallery_config["page_size"]
+            del gallery_config["virtual_gallery_chunk_size"]
+            with open(gallery_config_path, "w") as gallery_config_out:
+                json.dump(gallery_config, gallery_config_out)
+            gallery_build.main()
+            tempdir.compare([], path="public/slides")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -77,6 +77,10 @@ class SPGInitTestCase(unittest.TestCase):
             gallery_config["thumbnails_path"],
             os.path.join(gallery_root, "public", "images", "thumbnails"),
         )
+        self.assertEqual(
+            gallery_config["web_path"],
+            os.path.join(gallery_root, "public", "images", "web"),
+        )
         self.assertEqual(gallery_config["title"], title)
         self.assertEqual(gallery_config["description"], description)
         self.assertEqual(gallery_config["thumbnail_height"], thumbnail_height)
@@ -0,0 +1,362 @@
+import unittest
+from unittest import mock
+import os
+import io
+import base64
+import struct
+import cv2
+import numpy as np
+from datetime import datetime
+from PIL import Image
+from testfixtures import TempDirectory
+import simplegallery.common as spg_common
+import simplegallery.media as spg_media
+import simplegallery.test.helpers as helpers
+
+
+def create_mock_exif_image(path, width, height, orientation, description, date):
+    """
+    Creates a mock JPEG image containing EXIF data
+    :param path: path where the image should be stored
+    :param width: width of the image
+    :param height: height of the image
+    :param orientation: value of the Orientation EXIF tag
+    :param description: value of the ImageDescription EXIF tag
+    :param date: value of the DateTime EXIF tag
+    """
+    exif = Image.Exif()
+    exif[spg_media.EXIF_TAG_MAP["Orientation"]] = orientation
+    exif[spg_media.EXIF_TAG_MAP["ImageDescription"]] = description
+    exif[spg_media.EXIF_TAG_MAP["DateTime"]] = date
+
+    img = Image.new("RGB", (width, height), color="red")
+    img.save(path, exif=exif)
+    img.close()
+
+
+class MediaTestCase(unittest.TestCase):
+    def test_media_probe_exif(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photo.jpg")
+            create_mock_exif_image(
+                image_path, 1000, 500, 6, "Test description", "2020:06:13 10:11:12"
+            )
+
+            probe = spg_media.MediaProbe(image_path)
+            self.assertEqual("image", probe.type)
+            self.assertEqual((1000, 500), probe.raw_size)
+            self.assertEqual((500, 1000), probe.size)
+            self.assertEqual(datetime(2020, 6, 13, 10, 11, 12), probe.date)
+            self.assertEqual("Test description", probe.description)
+            self.assertEqual(os.path.getmtime(image_path), probe.mtime)
+
+            # The probe should return the same results as the individual functions
+            self.assertEqual(spg_media.get_image_size(image_path), probe.size)
+            self.assertEqual(spg_media.get_image_date(image_path), probe.date)
+            self.assertEqual(
+                spg_media.get_image_description(image_path), probe.description
+            )
+
+    def test_media_probe_without_exif(self):
+        with TempDirectory() as tempdir:
+            for name in ["photo.jpg", "photo.png", "photo.gif"]:
+                image_path = os.path.join(tempdir.path, name)
+                helpers.create_mock_image(image_path, 1000, 500)
+
+                probe = spg_media.MediaProbe(image_path)
+                self.assertEqual("image", probe.type)
+                self.assertEqual((1000, 500), probe.size)
+                self.assertEqual("", probe.description)
+                self.assertEqual(
+                    datetime.fromtimestamp(os.path.getctime(image_path)), probe.date
+                )
+
+    def test_media_probe_unsupported_type(self):
+        with TempDirectory() as tempdir:
+            tempdir.write("document.txt", b"Test")
+            with self.assertRaises(spg_common.SPGException):
+                spg_media.MediaProbe(os.path.join(tempdir.path, "document.txt"))
+
+    def test_fast_image_thumbnail(self):
+        with TempDirectory() as tempdir:
+            y, x = np.mgrid[0:1200, 0:1600]
+            pixels = np.stack(
+                [128 + 100 * np.sin(x / 40), 255 * x / 1600, 255 * y / 1200], axis=-1
+            )
+
+            for orientation, thumbnail_size in [
+                (1, (213, 160)),
+                (3, (213, 160)),
+                (6, (120, 160)),
+            ]:
+                image_path = os.path.join(tempdir.path, f"photo{orientation}.jpg")
+                exif = Image.Exif()
+                exif[spg_media.EXIF_TAG_MAP["Orientation"]] = orientation
+                Image.fromarray(pixels.astype(np.uint8)).save(image_path, exif=exif)
+
+                fast_path = os.path.join(tempdir.path, "fast.jpg")
+                reference_path = os.path.join(tempdir.path, "reference.jpg")
+                spg_media.create_image_thumbnail(image_path, fast_path, 160)
+                spg_media.create_image_thumbnail(
+                    image_path, reference_path, 160, fast=False
+                )
+
+                # The fast thumbnail has the same size and is almost identical to the reference thumbnail
+                with Image.open(fast_path) as fast, Image.open(
+                    reference_path
+                ) as reference:
+                    self.assertEqual(thumbnail_size, fast.size)
+                    self.assertEqual(thumbnail_size, reference.size)
+                    self.assertGreater(
+                        spg_media.compute_psnr(fast, reference),
+                        spg_media.FAST_THUMBNAIL_MIN_PSNR,
+                    )
+
+    def test_thumbnail_encoding(self):
+        with TempDirectory() as tempdir:
+            y, x = np.mgrid[0:240, 0:320]
+            pixels = np.stack(
+                [128 + 100 * np.sin(x / 7), 255 * x / 320, 128 + 100 * np.cos(y / 5)],
+                axis=-1,
+            )
+            image = Image.fromarray(pixels.astype(np.uint8))
+
+            self.assertAlmostEqual(1.0, spg_media.compute_ssim(image, image))
+            self.assertLess(
+                spg_media.compute_ssim(image.transpose(Image.FLIP_LEFT_RIGHT), image),
+                0.5,
+            )
+
+            # JPEGs are optimized and progressive, the other formats are chosen by the file extension
+            for extension, image_format in [
+                (".jpg", "JPEG"),
+                (".webp", "WEBP"),
+                (".avif", "AVIF"),
+            ]:
+                if not spg_media.is_thumbnail_format_supported(extension):
+                    continue
+                thumbnail_path = os.path.join(tempdir.path, "thumbnail" + extension)
+                spg_media.save_thumbnail(image, thumbnail_path)
+                with Image.open(thumbnail_path) as thumbnail:
+                    self.assertEqual(image_format, thumbnail.format)
+                    self.assertEqual((320, 240), thumbnail.size)
+                    if image_format == "JPEG":
+                        self.assertTrue(thumbnail.info.get("progressive"))
+
+            with self.assertRaises(spg_common.SPGException):
+                spg_media.save_thumbnail(
+                    image, os.path.join(tempdir.path, "thumbnail.bmp")
+                )
+
+            # The quality is searched to fit the target size
+            thumbnail_path = os.path.join(tempdir.path, "thumbnail.jpg")
+            max_quality_size = len(
+                spg_media.encode_image(
+                    image,
+                    "JPEG",
+                    spg_media.THUMBNAIL_FORMATS[".jpg"][1],
+                    spg_media.MAX_THUMBNAIL_QUALITY,
+                )
+            )
+            target_size = max_quality_size // 2
+            spg_media.save_thumbnail(
+                image, thumbnail_path, dict(target_size=target_size)
+            )
+            self.assertLessEqual(os.path.getsize(thumbnail_path), target_size)
+            self.assertGreater(os.path.getsize(thumbnail_path), target_size // 2)
+
+            # The lowest quality reaching the target SSIM is selected
+            spg_media.save_thumbnail(image, thumbnail_path, dict(target_ssim=0.9))
+            with Image.open(thumbnail_path) as thumbnail:
+                self.assertGreaterEqual(spg_media.compute_ssim(thumbnail, image), 0.9)
+            self.assertLess(os.path.getsize(thumbnail_path), max_quality_size)
+
+            # The target size limits the quality selected for the target SSIM
+            spg_media.save_thumbnail(
+                image, thumbnail_path, dict(target_ssim=0.999, target_size=target_size)
+            )
+            self.assertLessEqual(os.path.getsize(thumbnail_path), target_size)
+
+    def test_get_placeholder(self):
+        pixels = np.zeros((60, 100, 3), dtype=np.uint8)
+        pixels[:, :70] = (0, 0, 200)
+        pixels[:, 70:] = (200, 0, 0)
+        placeholder = spg_media.get_placeholder(Image.fromarray(pixels))
+
+        # The dominant color is the color covering most of the image
+        self.assertEqual("#0000c8", placeholder["color"])
+
+        # The preview keeps the aspect ratio and averages the pixels in blocks
+        self.assertTrue(placeholder["preview"].startswith("data:image/png;base64,"))
+        preview_data = base64.b64decode(placeholder["preview"].split(",")[1])
+        with Image.open(io.BytesIO(preview_data)) as preview:
+            self.assertEqual((8, 5), preview.size)
+            self.assertEqual((0, 0, 200), preview.getpixel((0, 0)))
+            self.assertEqual((200, 0, 0), preview.getpixel((7, 4)))
+
+        # Images smaller than the preview are kept as they are
+        placeholder = spg_media.get_placeholder(Image.new("RGB", (3, 1), "white"))
+        self.assertEqual("#ffffff", placeholder["color"])
+
+    def test_video_info(self):
+        with TempDirectory() as tempdir:
+            video_path = os.path.join(tempdir.path, "video.mp4")
+            helpers.create_mock_video(video_path, 320, 240, frames=10, fps=10)
+
+            video_info = spg_media.parse_mp4_video_info(video_path)
+            self.assertEqual(320, video_info["width"])
+            self.assertEqual(240, video_info["height"])
+            self.assertEqual(0, video_info["rotation"])
+            self.assertAlmostEqual(1.0, video_info["duration"], places=2)
+            self.assertEqual("mp4v", video_info["codec"])
+            self.assertEqual((320, 240), spg_media.get_video_size(video_path))
+
+            # The size and rotation reported by OpenCV are used if the container cannot be parsed
+            with mock.patch(
+                "simplegallery.media.parse_mp4_video_info", return_value=None
+            ):
+                self.assertEqual((320, 240), spg_media.get_video_size(video_path))
+
+            # Rotate the video by 90 degrees in the transformation matrix of the track header
+            with open(video_path, "r+b") as video_file:
+                content = video_file.read()
+                video_file.seek(content.index(b"tkhd") + 4 + 40)
+                video_file.write(struct.pack(">4i", 0, 0x10000, -0x10000, 0))
+
+            self.assertEqual(90, spg_media.parse_mp4_video_info(video_path)["rotation"])
+            self.assertEqual((240, 320), spg_media.get_video_size(video_path))
+
+    def test_video_thumbnail(self):
+        with TempDirectory() as tempdir:
+            video_path = os.path.join(tempdir.path, "video.mp4")
+            thumbnail_path = os.path.join(tempdir.path, "video.jpg")
+            helpers.create_mock_video(video_path, 320, 240)
+
+            # The video is probed without reading frames and every capture is released
+            captures = []
+            video_capture_class = cv2.VideoCapture
+
+            def create_capture(path):
+                captures.append(mock.Mock(wraps=video_capture_class(path)))
+                return captures[-1]
+
+            with mock.patch("cv2.VideoCapture", side_effect=create_capture):
+                probe = spg_media.MediaProbe(video_path)
+                self.assertEqual((320, 240), probe.size)
+                self.assertEqual("video", probe.type)
+                self.assertEqual(0, len(captures))
+
+                self.assertEqual(
+                    (80, 60),
+                    spg_media.create_thumbnail(video_path, thumbnail_path, 60),
+                )
+
+            self.assertEqual(1, len(captures))
+            captures[0].read.assert_called_once()
+            captures[0].release.assert_called_once()
+            self.assertEqual((80, 60), spg_media.get_image_size(thumbnail_path))
+
+    def test_sprite(self):
+        positions, size = spg_media.get_sprite_layout(
+            [(300, 200), (200, 200), (100, 100)], max_width=600, padding=2
+        )
+        self.assertEqual([(0, 0), (302, 0), (0, 202)], positions)
+        self.assertEqual((502, 302), size)
+
+        with TempDirectory() as tempdir:
+            thumbnail_paths = []
+            for index, (color, tile_size) in enumerate(
+                [("red", (300, 200)), ("green", (200, 200)), ("blue", (100, 100))]
+            ):
+                thumbnail_paths.append(os.path.join(tempdir.path, f"{index}.jpg"))
+                Image.new("RGB", tile_size, color).save(thumbnail_paths[-1])
+
+            sprite_path = os.path.join(tempdir.path, "sprite.jpg")
+            spg_media.create_sprite(thumbnail_paths, positions, size, sprite_path)
+
+            with Image.open(sprite_path) as sprite:
+                self.assertEqual((502, 302), sprite.size)
+                for position, color in zip(
+                    [(150, 100), (400, 100), (50, 250)],
+                    [(254, 0, 0), (0, 128, 1), (0, 0, 254)],
+                ):
+                    for channel, expected in zip(sprite.getpixel(position), color):
+                        self.assertAlmostEqual(expected, channel, delta=4)
+
+    def test_get_remote_image_size(self):
+        random = np.random.default_rng(0)
+        files = {}
+        for image_format, size in [
+            ("JPEG", (800, 600)),
+            ("PNG", (300, 400)),
+            ("GIF", (640, 480)),
+        ]:
+            pixels = random.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+            content = io.BytesIO()
+            Image.fromarray(pixels).save(content, image_format)
+            files[f"/photo.{image_format.lower()}"] = content.getvalue()
+
+        for supports_range in [True, False]:
+            with helpers.MockImageServer(files, supports_range) as server:
+                for path, size in [
+                    ("/photo.jpeg", (800, 600)),
+                    ("/photo.png", (300, 400)),
+                    ("/photo.gif", (640, 480)),
+                ]:
+                    self.assertEqual(
+                        size, spg_media.get_remote_image_size(server.url(path))
+                    )
+
+                # Only the beginning of each image is transferred if the server supports ranges
+                if supports_range:
+                    self.assertEqual(
+                        3 * spg_media.REMOTE_IMAGE_CHUNK_SIZE, server.bytes_sent
+                    )
+
+    def test_get_remote_image_size_large_header(self):
+        # The EXIF data makes the header larger than the first requested range
+        exif = Image.Exif()
+        exif[spg_media.EXIF_TAG_MAP["ImageDescription"]] = "x" * 40000
+        content = io.BytesIO()
+        Image.new("RGB", (800, 600), color="red").save(content, "JPEG", exif=exif)
+
+        with helpers.MockImageServer({"/photo.jpg": content.getvalue()}) as server:
+            self.assertEqual(
+                (800, 600), spg_media.get_remote_image_size(server.url("/photo.jpg"))
+            )
+            self.assertEqual(3, len(server.requests))
+
+    def test_get_remote_image_size_errors(self):
+        with helpers.MockImageServer({"/broken.jpg": b"Not an image"}) as server:
+            with self.assertRaises(spg_common.SPGException):
+                spg_media.get_remote_image_size(server.url("/broken.jpg"))
+            with self.assertRaises(Exception):
+                spg_media.get_remote_image_size(server.url("/missing.jpg"))
+
+    def test_get_metadata(self):
+        with TempDirectory() as tempdir:
+            image_path = os.path.join(tempdir.path, "photos", "photo.jpg")
+            thumbnail_path = os.path.join(tempdir.path, "thumbnails", "photo.jpg")
+            tempdir.makedir("photos")
+            tempdir.makedir("thumbnails")
+            create_mock_exif_image(
+                image_path, 1000, 500, 8, "Test description", "2020:06:13 10:11:12"
+            )
+            spg_media.create_thumbnail(image_path, thumbnail_path, 100)
+
+            image_data = spg_media.get_metadata(
+                image_path, thumbnail_path, tempdir.path
+            )
+            self.assertEqual(os.path.join("photos", "photo.jpg"), image_data["src"])
+            self.assertEqual(
+                os.path.join("thumbnails", "photo.jpg"), image_data["thumbnail"]
+            )
+            self.assertEqual((500, 1000), image_data["size"])
+            self.assertEqual((50, 100), image_data["thumbnail_size"])
+            self.assertEqual("image", image_data["type"])
+            self.assertEqual("Test description", image_data["description"])
+            self.assertEqual(datetime(2020, 6, 13, 10, 11, 12), image_data["date"])
+
+
+if __name__ == "__main__":
+    unittest.main()
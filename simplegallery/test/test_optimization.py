@@ -0,0 +1,90 @@
+import unittest
+from testfixtures import TempDirectory
+import simplegallery.optimization as spg_optimization
+import simplegallery.test.helpers as helpers
+
+HTML = """<!doctype html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>R&D &amp; photos</title>
+  <!-- Stylesheets -->
+  <link rel="stylesheet" href="css/main.css">
+  <link rel="stylesheet" href="https://example.com/bootstrap.css">
+  <!--[if lt IE 9]><script src="html5shiv.js"></script><![endif]-->
+</head>
+<body>
+  <div class="gallery">
+    <a href="images/photos/photo.jpg"
+       class="gallery-photo"
+       data-index="0"
+       style="--w: 320; --h: 160">
+       <img src="images/thumbnails/photo.jpg"
+            class="thumbnail rounded" alt="A  caption&nbsp;with  spaces"/></a>
+    <span>first</span> <span>second</span>
+  </div>
+  <pre>
+  preformatted   text
+  </pre>
+  <textarea>  keep &lt;this&gt;  </textarea>
+  <script type="application/json" id="gallery-slides">[{"description": "a < b"}]</script>
+  <script src="js/main.js"></script>
+  <script>
+    var  x = 1 < 2;
+  </script>
+</body>
+</html>
+"""
+
+
+class OptimizationTestCase(unittest.TestCase):
+    def test_optimize_html(self):
+        # The HTML is optimized while it is generated in small chunks
+        chunks = [HTML[start : start + 7] for start in range(0, len(HTML), 7)]
+        html = "".join(spg_optimization.optimize_html(chunks))
+
+        self.assertEqual(
+            helpers.parse_dom(HTML, ["defer"]), helpers.parse_dom(html, ["defer"])
+        )
+        self.assertLess(len(html), len(HTML))
+        self.assertNotIn("\n  <div", html)
+        self.assertNotIn("Stylesheets", html)
+        self.assertIn("<pre>\n  preformatted   text\n  </pre>", html)
+        self.assertIn("<textarea>  keep &lt;this&gt;  </textarea>", html)
+        self.assertIn("var  x = 1 < 2;", html)
+        self.assertIn("<title>R&amp;D &amp; photos</title>", html)
+        self.assertIn('<link rel="stylesheet" href="css/main.css">', html)
+
+        # External scripts are deferred
+        self.assertIn('<script src="js/main.js" defer></script>', html)
+        self.assertIn('<script type="application/json" id="gallery-slides">', html)
+        self.assertIn('<!--[if lt IE 9]><script src="html5shiv.js"></script>', html)
+
+    def test_inline_css(self):
+        with TempDirectory() as tempdir:
+            tempdir.write(
+                "css/main.css",
+                b".icon { background: url('../images/icon.png') } "
+                b".logo { background: url(https://example.com/logo.png) }",
+            )
+
+            html = "".join(spg_optimization.optimize_html([HTML], tempdir.path))
+
+            # Local stylesheets are inlined with their URLs rebased on the page
+            self.assertIn(
+                "<style>.icon { background: url('images/icon.png') } "
+                ".logo { background: url(https://example.com/logo.png) }</style>",
+                html,
+            )
+            self.assertNotIn('href="css/main.css"', html)
+            self.assertIn(
+                '<link rel="stylesheet" href="https://example.com/bootstrap.css">',
+                html,
+            )
+
+            # Large stylesheets are still loaded separately
+            tempdir.write(
+                "css/main.css", b" " * (spg_optimization.INLINE_CSS_MAX_SIZE + 1)
+            )
+            html = "".join(spg_optimization.optimize_html([HTML], tempdir.path))
+            self.assertIn('<link rel="stylesheet" href="css/main.css">', html)